@@ -0,0 +1,302 @@
+"""请求准入控制 - 限制同时运行的 Agent 数量，超出时按用户加权公平排队或返回 429
+
+config.json 格式:
+{
+  "concurrency": {
+    "max_concurrent": 16,   # 同时运行的 Agent 请求数
+    "max_queue": 64,        # 排队等待的最大请求数，超出直接 429
+    "queue_timeout": 30,    # 排队最长等待秒数，超时 429
+    "retry_after": 5,       # 429 响应中 Retry-After 的秒数
+    "per_user": {
+      "rate": 0,            # 每个用户每秒可开始的请求数（令牌桶补充速率），0 表示不限制
+      "burst": 10,          # 令牌桶容量（允许的突发请求数）
+      "max_queued": 0,      # 单个用户最多排队的请求数，0 表示只受 max_queue 限制
+      "default_weight": 1,  # 加权公平排队的默认权重
+      "weights": {}         # 按用户覆盖权重，如 {"batch-bot": 0.25, "oncall": 4}
+    }
+  }
+}
+
+- 用户由请求体的 user_id 标识，未携带时按客户端 IP 区分。
+- 排队按 WFQ（加权公平排队）放行：每个请求的虚拟完成时间 = max(当前虚拟时间, 该用户上一个请求的完成时间)
+  + cost / weight，名额释放时放行虚拟完成时间最小的请求。一个用户一次提交的大批请求只会占用按权重分得的份额，
+  其他用户的新请求不会排在整批之后；只有一个用户在排队时退化为 FIFO。
+- cost 默认 1；/enrich/batch 按 IOC 的 asset 批次数计 cost，大批量富化消耗更多份额与令牌。
+- 限制在单个 worker 进程内生效（多 worker 模式下每个 worker 各自计算）。
+"""
+
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from tracing import ADMISSION_QUEUE_DEPTH, ADMISSION_REJECTED, ADMISSION_WAIT_SECONDS
+
+_PER_USER_DEFAULTS: Dict[str, Any] = {
+    "rate": 0,
+    "burst": 10,
+    "max_queued": 0,
+    "default_weight": 1,
+    "weights": {},
+}
+
+
+class AdmissionRejected(Exception):
+    """队列已满、排队超时或超出用户速率限制"""
+
+    def __init__(self, reason: str, retry_after: int) -> None:
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """令牌桶：每秒补充 rate 个令牌，最多积累 burst 个"""
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self, amount: float = 1.0) -> float:
+        """取 amount 个令牌：成功返回 0；不足时不扣减，返回还需等待的秒数"""
+        now = time.monotonic()
+        self._refill(now)
+        amount = min(amount, self.burst)
+        if self.tokens >= amount:
+            self.tokens -= amount
+            return 0.0
+        return (amount - self.tokens) / self.rate if self.rate > 0 else math.inf
+
+    def reserve(self, amount: float = 1.0) -> float:
+        """预约 amount 个令牌（允许透支），返回需要等待的秒数；按调用顺序先到先得"""
+        now = time.monotonic()
+        self._refill(now)
+        self.tokens -= min(amount, self.burst)
+        return -self.tokens / self.rate if self.tokens < 0 and self.rate > 0 else 0.0
+
+    def refund(self, amount: float = 1.0) -> None:
+        """归还已取走但未使用的令牌（请求被拒绝或放弃排队）"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.burst, self.tokens + min(amount, self.burst))
+
+    def idle(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.burst
+
+
+class AdmissionSlot:
+    """已获得的执行名额；release() 幂等，可在多个收尾路径上调用"""
+
+    def __init__(self, controller: "AdmissionController") -> None:
+        self._controller = controller
+        self._released = False
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._controller._release()
+
+
+class _Waiter:
+    __slots__ = ("future", "user")
+
+    def __init__(self, future: asyncio.Future, user: str) -> None:
+        self.future = future
+        self.user = user
+
+
+class AdmissionController:
+    """
+    基于事件循环的准入控制（单个 worker 进程内生效）。
+
+    名额释放时直接移交给虚拟完成时间最小的等待者（同一用户内部仍是 FIFO），不会被新请求插队。
+    """
+
+    def __init__(self) -> None:
+        self.max_concurrent = 16
+        self.max_queue = 64
+        self.queue_timeout = 30.0
+        self.retry_after = 5
+        self.user_rate = 0.0
+        self.user_burst = 10.0
+        self.user_max_queued = 0
+        self.default_weight = 1.0
+        self.weights: Dict[str, float] = {}
+        self._settings: Any = None
+        self._active = 0
+        # (虚拟完成时间, 序号, waiter)；超时 / 取消的 waiter 惰性删除
+        self._heap: List[Any] = []
+        self._seq = itertools.count()
+        self._queued = 0
+        self._queued_by_user: Counter = Counter()
+        self._virtual = 0.0
+        self._last_finish: Dict[str, float] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_user_queue_full = 0
+        self.rejected_timeout = 0
+        self.rate_limited = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        ADMISSION_QUEUE_DEPTH.set(0)
+
+    def configure(self, settings: Optional[Dict[str, Any]]) -> None:
+        """按配置调整限制；同一份配置对象重复调用无开销"""
+        if settings is self._settings:
+            return
+        self._settings = settings
+        settings = settings if isinstance(settings, dict) else {}
+        self.max_concurrent = max(1, int(settings.get("max_concurrent", 16)))
+        self.max_queue = max(0, int(settings.get("max_queue", 64)))
+        self.queue_timeout = float(settings.get("queue_timeout", 30))
+        self.retry_after = int(settings.get("retry_after", 5))
+        per_user = settings.get("per_user") if isinstance(settings.get("per_user"), dict) else {}
+        per_user = {key: per_user.get(key, default) for key, default in _PER_USER_DEFAULTS.items()}
+        user_rate = max(0.0, float(per_user["rate"]))
+        user_burst = max(1.0, float(per_user["burst"]))
+        if (user_rate, user_burst) != (self.user_rate, self.user_burst):
+            # 速率参数变化后按新参数重新计算；其他配置变化时保留各用户已消耗的额度
+            self._buckets.clear()
+        self.user_rate, self.user_burst = user_rate, user_burst
+        self.user_max_queued = max(0, int(per_user["max_queued"]))
+        self.default_weight = max(0.01, float(per_user["default_weight"]))
+        self.weights = {str(user): max(0.01, float(weight)) for user, weight in (per_user["weights"] or {}).items()}
+        # 上限调大时立即放行排队中的请求
+        while self._active < self.max_concurrent and self._hand_off():
+            self._active += 1
+
+    def _take_token(self, user: str, cost: float) -> None:
+        if self.user_rate <= 0:
+            return
+        bucket = self._buckets.get(user)
+        if bucket is None:
+            if len(self._buckets) > 4096:
+                # 令牌已补满的用户与新建无异，清理掉
+                self._buckets = {key: b for key, b in self._buckets.items() if not b.idle()}
+            bucket = self._buckets[user] = TokenBucket(self.user_rate, self.user_burst)
+        wait = bucket.try_take(cost)
+        if wait > 0:
+            self.rate_limited += 1
+            ADMISSION_REJECTED.inc(reason="rate_limited")
+            raise AdmissionRejected(f"请求过于频繁：用户 {user} 超出速率限制", max(1, math.ceil(wait)))
+
+    def _refund_token(self, user: str, cost: float) -> None:
+        bucket = self._buckets.get(user) if self.user_rate > 0 else None
+        if bucket is not None:
+            bucket.refund(cost)
+
+    async def acquire(self, user: str = "anonymous", cost: float = 1.0) -> AdmissionSlot:
+        immediate = self._active < self.max_concurrent and not self._queued
+        # 先检查容量再取令牌：因队列已满被拒绝的请求不消耗用户的速率额度
+        if not immediate:
+            if self._queued >= self.max_queue:
+                self.rejected_queue_full += 1
+                ADMISSION_REJECTED.inc(reason="queue_full")
+                raise AdmissionRejected("服务繁忙：等待队列已满", self.retry_after)
+            if self.user_max_queued and self._queued_by_user[user] >= self.user_max_queued:
+                self.rejected_user_queue_full += 1
+                ADMISSION_REJECTED.inc(reason="user_queue_full")
+                raise AdmissionRejected(f"服务繁忙：用户 {user} 排队请求过多", self.retry_after)
+        self._take_token(user, cost)
+
+        if immediate:
+            self._active += 1
+            self.admitted += 1
+            ADMISSION_WAIT_SECONDS.observe(0.0, outcome="admitted")
+            return AdmissionSlot(self)
+
+        weight = self.weights.get(user, self.default_weight)
+        finish = max(self._virtual, self._last_finish.get(user, 0.0)) + max(cost, 0.01) / weight
+        self._last_finish[user] = finish
+        waiter = _Waiter(asyncio.get_running_loop().create_future(), user)
+        heapq.heappush(self._heap, (finish, next(self._seq), waiter))
+        self._enqueued(user, 1)
+        started = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter.future, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # 请求没有开始执行，令牌归还给该用户
+            self._discard(waiter)
+            self._refund_token(user, cost)
+            self.rejected_timeout += 1
+            ADMISSION_REJECTED.inc(reason="timeout")
+            ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, outcome="timeout")
+            raise AdmissionRejected("服务繁忙：排队超时", self.retry_after) from None
+        except asyncio.CancelledError:
+            self._discard(waiter)
+            self._refund_token(user, cost)
+            ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, outcome="cancelled")
+            raise
+
+        waited = time.perf_counter() - started
+        self.total_wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+        self.admitted += 1
+        ADMISSION_WAIT_SECONDS.observe(waited, outcome="admitted")
+        return AdmissionSlot(self)
+
+    def _enqueued(self, user: str, delta: int) -> None:
+        self._queued += delta
+        self._queued_by_user[user] += delta
+        if self._queued_by_user[user] <= 0:
+            del self._queued_by_user[user]
+        ADMISSION_QUEUE_DEPTH.set(self._queued)
+
+    def _hand_off(self) -> bool:
+        while self._heap:
+            finish, _, waiter = heapq.heappop(self._heap)
+            if waiter.future.done():
+                continue
+            self._virtual = max(self._virtual, finish)
+            self._enqueued(waiter.user, -1)
+            waiter.future.set_result(None)
+            if not self._queued:
+                # 队列清空：所有用户的完成时间都不晚于虚拟时间，不再需要记录
+                self._last_finish.clear()
+            return True
+        return False
+
+    def _release(self) -> None:
+        # 上限被调小时不再移交，让 active 自然回落
+        if self._active <= self.max_concurrent and self._hand_off():
+            return
+        self._active -= 1
+
+    def _discard(self, waiter: _Waiter) -> None:
+        if waiter.future.done() and not waiter.future.cancelled():
+            # 名额已移交但调用方被取消（如客户端断开）或恰好同时超时：归还名额
+            self._release()
+            return
+        # 未被移交的 waiter 仍留在堆中，由 _hand_off 惰性跳过；这里只更新计数
+        waiter.future.cancel()
+        self._enqueued(waiter.user, -1)
+        if not self._queued:
+            self._heap.clear()
+            self._last_finish.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active": self._active,
+            "queued": self._queued,
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_user_queue_full": self.rejected_user_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+            "rate_limited": self.rate_limited,
+            "avg_wait_seconds": self.total_wait_seconds / self.admitted if self.admitted else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+            "per_user_rate": self.user_rate or None,
+            "queued_by_user": dict(self._queued_by_user.most_common(10)),
+        }
@@ -0,0 +1,55 @@
+"""对比两次压测结果（bench/run_bench.py --output 生成的 JSON）
+
+用法:
+    python bench/compare.py bench/results/base.json bench/results/new.json
+"""
+
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# (显示名, 取值路径, 越小越好)
+_METRICS: List[Tuple[str, Tuple[str, ...], bool]] = [
+    ("rps", ("summary", "rps"), False),
+    ("errors", ("summary", "errors"), True),
+    ("latency p50 ms", ("summary", "latency_ms", "p50"), True),
+    ("latency p95 ms", ("summary", "latency_ms", "p95"), True),
+    ("latency p99 ms", ("summary", "latency_ms", "p99"), True),
+    ("ttft p50 ms", ("summary", "ttft_ms", "p50"), True),
+    ("ttft p95 ms", ("summary", "ttft_ms", "p95"), True),
+    ("ttft p99 ms", ("summary", "ttft_ms", "p99"), True),
+    ("rss peak MB", ("resources", "rss_mb", "peak"), True),
+    ("sockets peak", ("resources", "open_sockets", "peak"), True),
+]
+
+
+def _get(data: Dict[str, Any], path: Tuple[str, ...]) -> Optional[float]:
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data if isinstance(data, (int, float)) else None
+
+
+def main() -> None:
+    if len(sys.argv) != 3:
+        raise SystemExit(__doc__)
+    base, new = (json.loads(Path(p).read_text(encoding="utf-8")) for p in sys.argv[1:3])
+    print(f"base: {base['meta'].get('git_commit', '?')[:10]}  new: {new['meta'].get('git_commit', '?')[:10]}")
+    if base["meta"].get("params") != new["meta"].get("params"):
+        print("⚠️  两次压测参数不同，对比结果仅供参考")
+    print(f"{'metric':<16}{'base':>12}{'new':>12}{'change':>10}")
+    for name, path, lower_is_better in _METRICS:
+        a, b = _get(base, path), _get(new, path)
+        if a is None or b is None:
+            print(f"{name:<16}{str(a):>12}{str(b):>12}{'':>10}")
+            continue
+        change = "" if a == 0 else f"{(b - a) / a * 100:+.1f}%"
+        worse = (b > a) if lower_is_better else (b < a)
+        flag = " ⚠️" if worse and a and abs(b - a) / a > 0.1 else ""
+        print(f"{name:<16}{a:>12}{b:>12}{change:>10}{flag}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+"""离线压测：stub LLM + stub MCP servers + 真实 FastAPI 应用
+
+用法（在项目根目录执行）:
+    python bench/run_bench.py --concurrency 8 --iterations 40 --output bench/results/$(git rev-parse --short HEAD).json
+    python bench/compare.py bench/results/old.json bench/results/new.json
+    python bench/run_bench.py --workers 4 --concurrency 32   # 多 worker 模式（cluster.py）
+
+流程:
+1. 启动 stub LLM（bench/stub_llm.py）与三个 stub MCP server：intel（SSE）、splunk（Streamable HTTP）、
+   thehive（stdio，由应用自己拉起）
+2. 生成临时 config.json，以子进程方式启动 uvicorn main:app（--workers > 1 时启动 cluster.py，
+   checkpointer 为工作目录下的共享 SQLite，RSS / socket 统计包含所有 worker 子进程）
+3. 并发执行 scenarios.json 中的多轮对话（同一场景的各轮共用 thread_id，只发送新消息）
+4. 期间采样应用进程的 RSS 与打开的 socket 数
+5. 输出 p50/p95/p99 延迟、TTFT、RPS、RSS、socket 数，并写入 JSON（带 git commit，便于跨提交对比）
+
+TTFT 只在 --mode stream（/chat/stream）下统计：请求发出到收到第一个 token 事件的时间。
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+BENCH_DIR = Path(__file__).resolve().parent
+ROOT_DIR = BENCH_DIR.parent
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "mean": None, "max": None}
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        # nearest-rank
+        index = max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))
+        return round(ordered[index], 2)
+
+    return {
+        "p50": rank(50),
+        "p95": rank(95),
+        "p99": rank(99),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+def _git(*args: str) -> Optional[str]:
+    try:
+        return subprocess.run(["git", *args], cwd=ROOT_DIR, capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        return None
+
+
+# ---------- 进程资源采样 ----------
+
+
+def _rss_mb(pid: int) -> Optional[float]:
+    try:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / 1024 / 1024
+    except Exception:
+        return None
+
+
+def _open_sockets(pid: int) -> Optional[int]:
+    fd_dir = Path(f"/proc/{pid}/fd")
+    if fd_dir.is_dir():
+        count = 0
+        for fd in fd_dir.iterdir():
+            try:
+                if os.readlink(fd).startswith("socket:"):
+                    count += 1
+            except OSError:
+                continue
+        return count
+    try:
+        import psutil
+        return len(psutil.Process(pid).net_connections())
+    except Exception:
+        return None
+
+
+def _descendants(pid: int) -> List[int]:
+    pids = [pid]
+    for current in pids:
+        try:
+            children = Path(f"/proc/{current}/task/{current}/children").read_text().split()
+        except OSError:
+            continue
+        pids.extend(int(child) for child in children)
+    return pids
+
+
+class ResourceSampler:
+    def __init__(self, pid: int, interval: float = 0.2, include_children: bool = False) -> None:
+        self.pid = pid
+        self.interval = interval
+        self.include_children = include_children
+        self.rss: List[float] = []
+        self.sockets: List[int] = []
+
+    def sample(self) -> None:
+        if self.include_children:
+            pids = _descendants(self.pid)
+            rss_values = [v for v in (_rss_mb(pid) for pid in pids) if v is not None]
+            socket_values = [v for v in (_open_sockets(pid) for pid in pids) if v is not None]
+            rss = sum(rss_values) if rss_values else None
+            sockets = sum(socket_values) if socket_values else None
+        else:
+            rss = _rss_mb(self.pid)
+            sockets = _open_sockets(self.pid)
+        if rss is not None:
+            self.rss.append(rss)
+        if sockets is not None:
+            self.sockets.append(sockets)
+
+    async def run(self, stop: asyncio.Event) -> None:
+        while not stop.is_set():
+            self.sample()
+            try:
+                await asyncio.wait_for(stop.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+        self.sample()
+
+    def summary(self) -> Dict[str, Any]:
+        def stats(values: List[float]) -> Dict[str, Optional[float]]:
+            if not values:
+                return {"start": None, "peak": None, "end": None}
+            return {"start": round(values[0], 1), "peak": round(max(values), 1), "end": round(values[-1], 1)}
+
+        return {"rss_mb": stats(self.rss), "open_sockets": stats(self.sockets)}
+
+
+# ---------- 子进程 ----------
+
+
+class Processes:
+    def __init__(self, log_dir: Path) -> None:
+        self.log_dir = log_dir
+        self.procs: List[subprocess.Popen] = []
+
+    def spawn(self, name: str, cmd: List[str], env: Optional[Dict[str, str]] = None) -> subprocess.Popen:
+        log = open(self.log_dir / f"{name}.log", "w")
+        proc = subprocess.Popen(cmd, cwd=ROOT_DIR, env=env, stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+        self.procs.append(proc)
+        return proc
+
+    def stop(self) -> None:
+        for proc in reversed(self.procs):
+            if proc.poll() is None:
+                try:
+                    os.killpg(proc.pid, signal.SIGTERM)
+                except ProcessLookupError:
+                    pass
+        for proc in self.procs:
+            try:
+                proc.wait(10)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+
+
+async def _wait_port(port: int, timeout: float, proc: subprocess.Popen) -> None:
+    """等待端口可连接（SSE 端点是长连接，不能用普通 GET 探测）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"进程已退出（code={proc.returncode}）: port {port}")
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"等待超时: port {port}")
+
+
+async def _wait_http(url: str, timeout: float, proc: subprocess.Popen) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"进程已退出（code={proc.returncode}）: {url}")
+            try:
+                # 多 worker 模式下前端在 worker 就绪前返回 503
+                if (await client.get(url, timeout=1)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"等待超时: {url}")
+
+
+def _write_config(path: Path, args: argparse.Namespace, ports: Dict[str, int], work_dir: Path) -> None:
+    stdio_cmd = [str(BENCH_DIR / "stub_mcp.py"), "--group", "thehive", "--transport", "stdio", "--latency", str(args.tool_latency)]
+    config = {
+        "model": {"name": "bench-stub"},
+        "skills_dir": str(ROOT_DIR / "skills"),
+        "memories_dir": str(work_dir / "memories"),
+        "mcp": {
+            "schema_cache_path": str(work_dir / "mcp_tools.json"),
+            "servers": {
+                "intel": {"url": f"http://127.0.0.1:{ports['intel']}/sse", "transport": "sse"},
+                "splunk": {"url": f"http://127.0.0.1:{ports['splunk']}/mcp", "transport": "http"},
+                "thehive": {"command": sys.executable, "args": stdio_cmd, "transport": "stdio"},
+            },
+        },
+        "concurrency": {"max_concurrent": max(16, args.concurrency), "max_queue": 1024, "queue_timeout": 300},
+        "checkpointer": {"backend": "memory", "max_threads": 10000},
+        "env": {"OPENAI_API_KEY": "bench", "OPENAI_BASE_URL": f"http://127.0.0.1:{ports['llm']}/v1"},
+    }
+    if args.workers > 1:
+        config["cluster"] = {
+            "workers": args.workers,
+            "host": "127.0.0.1",
+            "port": ports["app"],
+            "checkpointer": {"backend": "sqlite", "path": str(work_dir / "checkpoints.sqlite")},
+        }
+    if args.config_overlay:
+        overlay = json.loads(Path(args.config_overlay).read_text(encoding="utf-8"))
+        config.update(overlay)
+    path.write_text(json.dumps(config, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+# ---------- 压测客户端 ----------
+
+
+async def _run_turn(client: httpx.AsyncClient, mode: str, content: str, thread_id: Optional[str]) -> Dict[str, Any]:
+    body: Dict[str, Any] = {"messages": [{"role": "user", "content": content}]}
+    if thread_id:
+        body["thread_id"] = thread_id
+    started = time.perf_counter()
+    result: Dict[str, Any] = {"ok": False, "ttft_ms": None, "thread_id": thread_id}
+
+    if mode == "chat":
+        response = await client.post("/chat", json=body)
+        result["latency_ms"] = (time.perf_counter() - started) * 1000
+        if response.status_code == 200:
+            result.update(ok=True, thread_id=response.json().get("thread_id"))
+        else:
+            result["error"] = f"HTTP {response.status_code}"
+        return result
+
+    async with client.stream("POST", "/chat/stream", json=body) as response:
+        if response.status_code != 200:
+            await response.aread()
+            result["latency_ms"] = (time.perf_counter() - started) * 1000
+            result["error"] = f"HTTP {response.status_code}"
+            return result
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if event["type"] == "token" and result["ttft_ms"] is None:
+                result["ttft_ms"] = (time.perf_counter() - started) * 1000
+            elif event["type"] == "final":
+                result.update(ok=True, thread_id=event.get("thread_id"))
+            elif event["type"] == "error":
+                result["error"] = event.get("message")
+    result["latency_ms"] = (time.perf_counter() - started) * 1000
+    return result
+
+
+async def _run_scenario(client: httpx.AsyncClient, mode: str, scenario: Dict[str, Any]) -> List[Dict[str, Any]]:
+    thread_id = None
+    turns = []
+    for content in scenario["turns"]:
+        try:
+            turn = await _run_turn(client, mode, content, thread_id)
+        except httpx.HTTPError as e:
+            turn = {"ok": False, "latency_ms": None, "ttft_ms": None, "error": f"{type(e).__name__}: {e}"}
+        turn["scenario"] = scenario["name"]
+        turns.append(turn)
+        if not turn["ok"]:
+            break
+        thread_id = turn.get("thread_id")
+    return turns
+
+
+async def _load(base_url: str, args: argparse.Namespace, scenarios: List[Dict[str, Any]], sampler: ResourceSampler) -> Dict[str, Any]:
+    limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.request_timeout, limits=limits) as client:
+        # 预热：每个场景跑一遍，避免首次调用的建连/初始化计入结果
+        for scenario in scenarios:
+            await _run_scenario(client, args.mode, scenario)
+
+        next_index = 0
+        turns: List[Dict[str, Any]] = []
+
+        async def worker() -> None:
+            nonlocal next_index
+            while next_index < args.iterations:
+                scenario = scenarios[next_index % len(scenarios)]
+                next_index += 1
+                turns.extend(await _run_scenario(client, args.mode, scenario))
+
+        stop = asyncio.Event()
+        sampling = asyncio.create_task(sampler.run(stop))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        await sampling
+
+        server = {}
+        paths = [("agent", "/agent/stats"), ("admission", "/admission/stats"), ("llm_pool", "/llm/pool")]
+        if args.workers > 1:
+            paths.append(("cluster", "/cluster/stats"))
+        for name, path in paths:
+            try:
+                server[name] = (await client.get(path)).json()
+            except Exception:
+                pass
+    return {"turns": turns, "elapsed": elapsed, "server": server}
+
+
+def _summarize(turns: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    ok = [t for t in turns if t["ok"]]
+    by_scenario: Dict[str, Any] = {}
+    for name in sorted({t["scenario"] for t in turns}):
+        items = [t for t in turns if t["scenario"] == name]
+        by_scenario[name] = {
+            "turns": len(items),
+            "errors": sum(1 for t in items if not t["ok"]),
+            "latency_ms": _percentiles([t["latency_ms"] for t in items if t["ok"]]),
+        }
+    errors = [t.get("error") for t in turns if not t["ok"]]
+    return {
+        "turns": len(turns),
+        "errors": len(errors),
+        "error_samples": sorted(set(str(e) for e in errors))[:5],
+        "duration_s": round(elapsed, 2),
+        "rps": round(len(ok) / elapsed, 2) if elapsed else None,
+        "latency_ms": _percentiles([t["latency_ms"] for t in ok]),
+        "ttft_ms": _percentiles([t["ttft_ms"] for t in ok if t["ttft_ms"] is not None]),
+        "scenarios": by_scenario,
+    }
+
+
+def _print_summary(summary: Dict[str, Any], resources: Dict[str, Any]) -> None:
+    latency, ttft = summary["latency_ms"], summary["ttft_ms"]
+    print("=" * 60)
+    print(f"turns={summary['turns']} errors={summary['errors']} duration={summary['duration_s']}s rps={summary['rps']}")
+    print(f"latency ms: p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} max={latency['max']}")
+    print(f"ttft ms:    p50={ttft['p50']} p95={ttft['p95']} p99={ttft['p99']}")
+    print(f"rss MB:     {resources['rss_mb']}")
+    print(f"sockets:    {resources['open_sockets']}")
+    for name, item in summary["scenarios"].items():
+        print(f"  {name:<14} turns={item['turns']:<5} errors={item['errors']:<3} p50={item['latency_ms']['p50']} p95={item['latency_ms']['p95']}")
+    if summary["error_samples"]:
+        print(f"errors: {summary['error_samples']}")
+    print("=" * 60)
+
+
+async def _main(args: argparse.Namespace) -> Dict[str, Any]:
+    scenarios = json.loads(Path(args.scenarios).read_text(encoding="utf-8"))
+    if args.scenario:
+        scenarios = [s for s in scenarios if s["name"] in set(args.scenario)]
+    if not scenarios:
+        raise SystemExit("没有可执行的场景")
+
+    ports = {name: _free_port() for name in ("llm", "intel", "splunk", "app")}
+    work_dir = Path(tempfile.mkdtemp(prefix="deepagents-bench-"))
+    processes = Processes(work_dir)
+    try:
+        llm = processes.spawn("stub_llm", [
+            sys.executable, str(BENCH_DIR / "stub_llm.py"), "--port", str(ports["llm"]),
+            "--ttft", str(args.llm_ttft), "--tokens-per-second", str(args.llm_tps), "--reply-tokens", str(args.reply_tokens),
+        ])
+        intel = processes.spawn("stub_mcp_intel", [
+            sys.executable, str(BENCH_DIR / "stub_mcp.py"), "--group", "intel", "--transport", "sse",
+            "--port", str(ports["intel"]), "--latency", str(args.tool_latency),
+        ])
+        splunk = processes.spawn("stub_mcp_splunk", [
+            sys.executable, str(BENCH_DIR / "stub_mcp.py"), "--group", "splunk", "--transport", "streamable-http",
+            "--port", str(ports["splunk"]), "--latency", str(args.tool_latency),
+        ])
+        await _wait_port(ports["llm"], 30, llm)
+        await _wait_port(ports["intel"], 30, intel)
+        await _wait_port(ports["splunk"], 30, splunk)
+
+        config_path = work_dir / "config.json"
+        _write_config(config_path, args, ports, work_dir)
+        env = {k: v for k, v in os.environ.items() if not k.startswith(("OPENAI_", "DEEPAGENTS_"))}
+        env["DEEPAGENTS_CONFIG"] = str(config_path)
+        if args.workers > 1:
+            app = processes.spawn("app", [sys.executable, str(ROOT_DIR / "cluster.py")], env=env)
+        else:
+            app = processes.spawn("app", [
+                sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(ports["app"]),
+                "--log-level", "warning",
+            ], env=env)
+        base_url = f"http://127.0.0.1:{ports['app']}"
+        await _wait_http(f"{base_url}/health", 120, app)
+
+        print(f"🚀 压测开始: mode={args.mode} concurrency={args.concurrency} iterations={args.iterations} scenarios={[s['name'] for s in scenarios]}")
+        sampler = ResourceSampler(app.pid, include_children=args.workers > 1)
+        run = await _load(base_url, args, scenarios, sampler)
+    finally:
+        processes.stop()
+
+    summary = _summarize(run["turns"], run["elapsed"])
+    resources = sampler.summary()
+    _print_summary(summary, resources)
+    params = {k: v for k, v in vars(args).items() if k != "output"}
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "git_commit": _git("rev-parse", "HEAD"),
+            "git_dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": params,
+            "logs": str(work_dir),
+        },
+        "summary": summary,
+        "resources": resources,
+        "server": run["server"],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="deepagents_minimal 离线压测")
+    parser.add_argument("--mode", choices=["stream", "chat"], default="stream", help="stream=/chat/stream（统计 TTFT），chat=/chat")
+    parser.add_argument("--concurrency", type=int, default=8, help="并发执行的场景数")
+    parser.add_argument("--iterations", type=int, default=40, help="总共执行的场景次数（按 scenarios 轮转）")
+    parser.add_argument("--scenarios", default=str(BENCH_DIR / "scenarios.json"))
+    parser.add_argument("--scenario", action="append", help="只执行指定名称的场景（可重复）")
+    parser.add_argument("--llm-ttft", type=float, default=0.2, help="stub LLM 首 token 延迟（秒）")
+    parser.add_argument("--llm-tps", type=float, default=50.0, help="stub LLM 每秒输出 token 数")
+    parser.add_argument("--reply-tokens", type=int, default=40, help="stub LLM 文本回复的 token 数")
+    parser.add_argument("--tool-latency", type=float, default=0.1, help="stub MCP tool 调用延迟（秒）")
+    parser.add_argument("--request-timeout", type=float, default=300.0)
+    parser.add_argument("--workers", type=int, default=1, help="worker 进程数（> 1 时通过 cluster.py 启动多 worker 模式）")
+    parser.add_argument("--config-overlay", help="合并到生成的 config.json 顶层的 JSON 文件（如开启 response_cache）")
+    parser.add_argument("--output", help="结果 JSON 输出路径")
+    args = parser.parse_args()
+
+    result = asyncio.run(_main(args))
+    if args.output:
+        output = Path(args.output)
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(result, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"💾 结果已写入 {output}")
+
+
+if __name__ == "__main__":
+    main()
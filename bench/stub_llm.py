@@ -0,0 +1,130 @@
+"""确定性的 OpenAI 兼容 stub（压测用，不访问真实模型）
+
+用法:
+    python bench/stub_llm.py --port 9100 --ttft 0.2 --tokens-per-second 50 --reply-tokens 40
+
+行为（只取决于请求内容，结果可复现）:
+- 最后一条消息是用户消息且包含 [[tool:名称 {json 参数}]] 标记 → 返回对应的 tool 调用；
+  同一条消息中的多个标记在同一轮返回（并行 tool 调用）。请求中未提供的 tool 会被忽略。
+- 其他情况 → 返回 reply-tokens 个 token 的文本回复。
+- stream=true 时先等待 ttft 秒再按 tokens-per-second 逐个下发；否则一次性返回（耗时相同）。
+- --error-rate 大于 0 时按该比例返回 503（测试 LLM 网关的故障转移与熔断）。
+
+GET /stats 返回已处理的请求数。
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from typing import Any, Dict, List
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+_MARKER = re.compile(r"\[\[tool:(\w+)\s+(\{.*?\})\]\]")
+
+app = FastAPI()
+settings = {"ttft": 0.2, "tokens_per_second": 50.0, "reply_tokens": 40, "error_rate": 0.0}
+stats = {"requests": 0, "stream_requests": 0, "tool_call_turns": 0, "errors": 0}
+
+
+def _text_of(content: Any) -> str:
+    if isinstance(content, list):
+        return " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _plan(body: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """根据最后一条消息决定本轮返回的 tool 调用"""
+    messages = body.get("messages") or []
+    if not messages or messages[-1].get("role") != "user":
+        return []
+    available = {t.get("function", {}).get("name") for t in body.get("tools") or []}
+    calls = []
+    for index, (name, args) in enumerate(_MARKER.findall(_text_of(messages[-1].get("content")))):
+        if name in available:
+            calls.append({"id": f"call_{len(messages)}_{index}", "type": "function", "function": {"name": name, "arguments": args}})
+    return calls
+
+
+def _reply_tokens(body: Dict[str, Any]) -> List[str]:
+    seed = len(body.get("messages") or [])
+    return [f"tok{(seed + i) % 97} " for i in range(int(settings["reply_tokens"]))]
+
+
+def _usage(body: Dict[str, Any], completion_tokens: int) -> Dict[str, int]:
+    prompt_tokens = sum(len(json.dumps(m, ensure_ascii=False)) // 4 for m in body.get("messages") or [])
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    stats["requests"] += 1
+    if settings["error_rate"] > 0 and random.random() < settings["error_rate"]:
+        stats["errors"] += 1
+        return JSONResponse({"error": {"message": "stub overloaded", "type": "server_error"}}, status_code=503)
+    calls = _plan(body)
+    tokens = [] if calls else _reply_tokens(body)
+    if calls:
+        stats["tool_call_turns"] += 1
+    interval = 1.0 / settings["tokens_per_second"] if settings["tokens_per_second"] > 0 else 0.0
+    base = {"id": f"stub-{stats['requests']}", "created": int(time.time()), "model": body.get("model", "stub")}
+
+    if body.get("stream"):
+        stats["stream_requests"] += 1
+
+        async def generate():
+            await asyncio.sleep(settings["ttft"])
+            if calls:
+                delta = {"role": "assistant", "tool_calls": [dict(c, index=i) for i, c in enumerate(calls)]}
+                chunk = dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+                yield f"data: {json.dumps(chunk)}\n\n"
+            for i, token in enumerate(tokens):
+                if i:
+                    await asyncio.sleep(interval)
+                chunk = dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {"content": token}, "finish_reason": None}])
+                yield f"data: {json.dumps(chunk)}\n\n"
+            finish = "tool_calls" if calls else "stop"
+            chunk = dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {}, "finish_reason": finish}], usage=_usage(body, len(tokens)))
+            yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(generate(), media_type="text/event-stream")
+
+    await asyncio.sleep(settings["ttft"] + interval * max(0, len(tokens) - 1))
+    message: Dict[str, Any] = {"role": "assistant", "content": None if calls else "".join(tokens)}
+    if calls:
+        message["tool_calls"] = calls
+    return JSONResponse(dict(
+        base,
+        object="chat.completion",
+        choices=[{"index": 0, "message": message, "finish_reason": "tool_calls" if calls else "stop"}],
+        usage=_usage(body, len(tokens)),
+    ))
+
+
+@app.get("/stats")
+def get_stats() -> Dict[str, int]:
+    return stats
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="OpenAI 兼容 stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=0.2, help="首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="返回 503 的请求比例")
+    args = parser.parse_args()
+    settings.update(ttft=args.ttft, tokens_per_second=args.tokens_per_second, reply_tokens=args.reply_tokens, error_rate=args.error_rate)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
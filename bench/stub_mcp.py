@@ -0,0 +1,117 @@
+"""模拟 skills 所用 MCP tools 的 stub server（压测用，不访问真实后端）
+
+用法:
+    python bench/stub_mcp.py --group intel --transport sse --port 9201 --latency 0.1
+    python bench/stub_mcp.py --group splunk --transport streamable-http --port 9202
+    python bench/stub_mcp.py --group thehive --transport stdio
+
+group:
+- intel:   query_asset_info / query_device_info / query_ioc_reputation / query_ioc_intelligence
+- splunk:  get_indexes / get_splunk_info / run_splunk_query
+- thehive: thehive_get_case / thehive_list_case_observables / thehive_create_ioc / waf_prod_op
+- all:     以上全部
+
+返回值只取决于参数（确定性）；每次调用先异步等待 latency 秒。
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+from typing import Optional
+
+from mcp.server.fastmcp import FastMCP
+
+parser = argparse.ArgumentParser(description="MCP stub server")
+parser.add_argument("--group", default="all", choices=["intel", "splunk", "thehive", "all"])
+parser.add_argument("--transport", default="stdio", choices=["stdio", "sse", "streamable-http"])
+parser.add_argument("--host", default="127.0.0.1")
+parser.add_argument("--port", type=int, default=9201)
+parser.add_argument("--latency", type=float, default=0.1, help="每次 tool 调用的模拟后端延迟（秒）")
+args = parser.parse_args()
+
+mcp = FastMCP(f"stub-{args.group}", host=args.host, port=args.port)
+
+
+def _score(value: str) -> int:
+    return int(hashlib.sha256(value.encode("utf-8")).hexdigest()[:4], 16) % 100
+
+
+async def _respond(payload: dict) -> str:
+    await asyncio.sleep(args.latency)
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def _enabled(group: str) -> bool:
+    return args.group in (group, "all")
+
+
+if _enabled("intel"):
+    @mcp.tool()
+    async def query_asset_info(domainOrip: str) -> str:
+        """查询域名/IP 的资产归属，支持逗号分隔的多个目标"""
+        targets = [t.strip() for t in domainOrip.split(",") if t.strip()]
+        return await _respond({"assets": [{"target": t, "owner": f"team-{_score(t) % 7}", "env": "prod"} for t in targets]})
+
+    @mcp.tool()
+    async def query_device_info(user_name: Optional[str] = None, device_name: Optional[str] = None, sn: Optional[str] = None) -> str:
+        """根据用户名、设备名或 SN 查询设备信息（三选一）"""
+        key = user_name or device_name or sn or ""
+        return await _respond({"device": f"PC-{_score(key):02d}", "user": user_name or "u0000000", "sn": sn or f"SN{_score(key)}"})
+
+    @mcp.tool()
+    async def query_ioc_reputation(ioc: str) -> str:
+        """查询单个 IOC 的信誉"""
+        score = _score(ioc)
+        severity = "high" if score > 80 else "medium" if score > 50 else "low"
+        return await _respond({"ioc": ioc, "score": score, "severity": severity})
+
+    @mcp.tool()
+    async def query_ioc_intelligence(ioc: str) -> str:
+        """查询单个 IOC 的上下文情报"""
+        return await _respond({"ioc": ioc, "campaigns": [f"campaign-{_score(ioc) % 5}"], "labels": ["stub"]})
+
+
+if _enabled("splunk"):
+    @mcp.tool()
+    async def get_indexes() -> str:
+        """列出 Splunk 索引"""
+        return await _respond({"indexes": ["main", "security", "network", "proxy"]})
+
+    @mcp.tool()
+    async def get_splunk_info() -> str:
+        """Splunk 实例信息"""
+        return await _respond({"version": "9.1.0", "server_name": "stub-splunk"})
+
+    @mcp.tool()
+    async def run_splunk_query(query: str, earliest_time: str = "-24h", latest_time: str = "now") -> str:
+        """执行 SPL 查询"""
+        rows = [{"_time": f"2024-01-01T00:{i:02d}:00", "count": (_score(query) + i) % 50} for i in range(10)]
+        return await _respond({"query": query, "earliest_time": earliest_time, "latest_time": latest_time, "results": rows})
+
+
+if _enabled("thehive"):
+    @mcp.tool()
+    async def thehive_get_case(case_id: str) -> str:
+        """获取 TheHive case 详情"""
+        return await _respond({"case_id": case_id, "title": f"stub case {case_id}", "severity": 2, "status": "Open"})
+
+    @mcp.tool()
+    async def thehive_list_case_observables(case_id: str) -> str:
+        """列出 case 的 observables"""
+        observables = [{"dataType": "ip", "data": f"10.0.{_score(case_id)}.{i}"} for i in range(5)]
+        return await _respond({"case_id": case_id, "observables": observables})
+
+    @mcp.tool()
+    async def thehive_create_ioc(case_id: str, data_type: str, data: str) -> str:
+        """在 case 中创建 IOC（写操作）"""
+        return await _respond({"case_id": case_id, "created": {"dataType": data_type, "data": data}})
+
+    @mcp.tool()
+    async def waf_prod_op(case_id: str, operation: str, entity: str, environment: str) -> str:
+        """WAF 封禁/解封（写操作）"""
+        return await _respond({"case_id": case_id, "operation": operation, "entity": entity, "environment": environment, "result": "ok"})
+
+
+if __name__ == "__main__":
+    mcp.run(transport=args.transport)
@@ -0,0 +1,470 @@
+"""Checkpointer 工厂 - 让 thread_id 真正续接会话
+
+config.json 格式:
+{
+  "checkpointer": {
+    "backend": "memory",            # memory | sqlite | redis | none
+    "max_threads": 1000,            # memory: LRU 保留的会话数
+    "path": "./data/checkpoints.sqlite",   # sqlite: 数据库文件（WAL 模式）
+    "url": "redis://localhost:6379/0",     # redis: 任意兼容 Redis 协议的服务
+    "prefix": "deepagents:ckpt",    # redis: key 前缀
+    "ttl_seconds": 0                # redis: 会话过期时间（0 表示不过期）
+  }
+}
+
+多 worker 模式（cluster.py）下 backend 为 memory 时，worker 改用 DEEPAGENTS_SHARED_CHECKPOINTER
+指定的共享后端（默认 SQLite WAL，见 cluster.checkpointer）。
+
+sqlite 需要 langgraph-checkpoint-sqlite，redis 需要 redis 包；
+redis 后端只使用基础命令（HSET/HGETALL/ZADD/ZREVRANGE/SADD/SREM/SMEMBERS/DEL/EXPIRE），
+本地可以用 fakeredis 或其他兼容实现替代。
+"""
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import InMemorySaver
+
+try:
+    from langgraph.checkpoint.sqlite import SqliteSaver
+    _SQLITE_AVAILABLE = True
+except ImportError:
+    _SQLITE_AVAILABLE = False
+    SqliteSaver = None  # type: ignore
+
+try:
+    import redis
+    _REDIS_AVAILABLE = True
+except ImportError:
+    _REDIS_AVAILABLE = False
+    redis = None  # type: ignore
+
+
+class _ThreadedAsyncMixin:
+    """用线程池执行同步实现来提供 async 接口（sqlite3 / redis-py 均为阻塞 IO）"""
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        items = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in items:
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+
+class LRUMemorySaver(InMemorySaver):
+    """进程内 checkpointer，只保留最近使用的 max_threads 个会话"""
+
+    def __init__(self, max_threads: int = 1000) -> None:
+        super().__init__()
+        self.max_threads = max_threads
+        self._recent: "OrderedDict[str, None]" = OrderedDict()
+        self._lru_lock = threading.Lock()
+
+    def _touch(self, thread_id: Any) -> None:
+        evicted: List[str] = []
+        with self._lru_lock:
+            key = str(thread_id)
+            self._recent[key] = None
+            self._recent.move_to_end(key)
+            while self.max_threads > 0 and len(self._recent) > self.max_threads:
+                oldest, _ = self._recent.popitem(last=False)
+                evicted.append(oldest)
+        for oldest in evicted:
+            super().delete_thread(oldest)
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        result = super().get_tuple(config)
+        if result is not None:
+            self._touch(config["configurable"]["thread_id"])
+        return result
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        result = super().put(config, checkpoint, metadata, new_versions)
+        self._touch(config["configurable"]["thread_id"])
+        return result
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lru_lock:
+            self._recent.pop(str(thread_id), None)
+        super().delete_thread(thread_id)
+
+
+if _SQLITE_AVAILABLE:
+
+    class WALSqliteSaver(_ThreadedAsyncMixin, SqliteSaver):
+        """本地 SQLite（WAL）checkpointer；同步实现自带锁，async 接口走线程池"""
+
+        @classmethod
+        def open(cls, path: str) -> "WALSqliteSaver":
+            db_path = Path(path)
+            db_path.parent.mkdir(parents=True, exist_ok=True)
+            # check_same_thread=False：SqliteSaver 内部用锁串行化访问
+            conn = sqlite3.connect(str(db_path), check_same_thread=False)
+            # busy_timeout 先于 journal_mode：多个 worker 同时启动时切换 WAL 需要等待其他进程的锁
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            return cls(conn)
+
+        def close(self) -> None:
+            with self.lock:
+                self.conn.close()
+
+
+def _as_str(value: Any) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else str(value)
+
+
+def _as_bytes(value: Any) -> bytes:
+    return value.encode("utf-8") if isinstance(value, str) else bytes(value)
+
+
+def _checkpoint_score(checkpoint: Checkpoint) -> float:
+    try:
+        return datetime.fromisoformat(checkpoint["ts"]).timestamp()
+    except Exception:
+        return 0.0
+
+
+class RedisSaver(_ThreadedAsyncMixin, BaseCheckpointSaver):
+    """
+    基于 Redis 基础命令的 checkpointer。
+
+    key 结构（{p} 为 prefix）:
+      {p}:threads                         set，所有 thread_id
+      {p}:ns:{thread}                     set，thread 下的 checkpoint_ns
+      {p}:idx:{thread}:{ns}               zset，checkpoint_id 按时间排序
+      {p}:cp:{thread}:{ns}:{id}           hash，checkpoint / metadata（均经 serde）/ parent
+      {p}:w:{thread}:{ns}:{id}            hash，pending writes
+    """
+
+    def __init__(self, client: Any, *, prefix: str = "deepagents:ckpt", ttl_seconds: int = 0) -> None:
+        super().__init__()
+        self.client = client
+        self.prefix = prefix
+        self.ttl_seconds = int(ttl_seconds or 0)
+
+    @classmethod
+    def from_url(cls, url: str, **kwargs: Any) -> "RedisSaver":
+        if not _REDIS_AVAILABLE:
+            raise RuntimeError("redis 未安装，无法使用 redis checkpointer（pip install redis）")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def close(self) -> None:
+        close = getattr(self.client, "close", None)
+        if callable(close):
+            close()
+
+    # ---------- key ----------
+
+    def _k_threads(self) -> str:
+        return f"{self.prefix}:threads"
+
+    def _k_ns(self, thread_id: str) -> str:
+        return f"{self.prefix}:ns:{thread_id}"
+
+    def _k_idx(self, thread_id: str, ns: str) -> str:
+        return f"{self.prefix}:idx:{thread_id}:{ns}"
+
+    def _k_cp(self, thread_id: str, ns: str, checkpoint_id: str) -> str:
+        return f"{self.prefix}:cp:{thread_id}:{ns}:{checkpoint_id}"
+
+    def _k_writes(self, thread_id: str, ns: str, checkpoint_id: str) -> str:
+        return f"{self.prefix}:w:{thread_id}:{ns}:{checkpoint_id}"
+
+    def _expire(self, *keys: str) -> None:
+        if self.ttl_seconds > 0:
+            for key in keys:
+                self.client.expire(key, self.ttl_seconds)
+
+    # ---------- 读 ----------
+
+    def _load_writes(self, thread_id: str, ns: str, checkpoint_id: str) -> List[Tuple[str, str, Any]]:
+        raw = self.client.hgetall(self._k_writes(thread_id, ns, checkpoint_id)) or {}
+        rows = []
+        for value in raw.values():
+            item = json.loads(_as_str(value))
+            rows.append(item)
+        rows.sort(key=lambda r: (r.get("task_path", ""), r["task_id"], r["idx"]))
+        return [
+            (r["task_id"], r["channel"], self.serde.loads_typed((r["type"], r["value"].encode("latin-1"))))
+            for r in rows
+        ]
+
+    def _load_tuple(self, thread_id: str, ns: str, checkpoint_id: str) -> Optional[CheckpointTuple]:
+        raw = self.client.hgetall(self._k_cp(thread_id, ns, checkpoint_id))
+        if not raw:
+            return None
+        data = {_as_str(k): v for k, v in raw.items()}
+        parent_id = _as_str(data["parent"]) if data.get("parent") else None
+        if data.get("metadata_type"):
+            metadata = self.serde.loads_typed((_as_str(data["metadata_type"]), _as_bytes(data["metadata"])))
+        elif data.get("metadata"):
+            # 旧格式：纯 JSON
+            metadata = json.loads(_as_str(data["metadata"]))
+        else:
+            metadata = {}
+        return CheckpointTuple(
+            {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint_id}},
+            self.serde.loads_typed((_as_str(data["type"]), _as_bytes(data["checkpoint"]))),
+            metadata,
+            (
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": parent_id}}
+                if parent_id
+                else None
+            ),
+            self._load_writes(thread_id, ns, checkpoint_id),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = str(config["configurable"]["thread_id"])
+        ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = get_checkpoint_id(config)
+        if not checkpoint_id:
+            latest = self.client.zrevrange(self._k_idx(thread_id, ns), 0, 0)
+            if not latest:
+                return None
+            checkpoint_id = _as_str(latest[0])
+        return self._load_tuple(thread_id, ns, checkpoint_id)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        if config is not None:
+            thread_ids = [str(config["configurable"]["thread_id"])]
+        else:
+            thread_ids = sorted(_as_str(t) for t in self.client.smembers(self._k_threads()))
+        want_ns = config["configurable"].get("checkpoint_ns") if config is not None else None
+        want_id = get_checkpoint_id(config) if config is not None else None
+        before_id = get_checkpoint_id(before) if before is not None else None
+
+        count = 0
+        for thread_id in thread_ids:
+            namespaces = [want_ns] if want_ns is not None else sorted(
+                _as_str(n) for n in self.client.smembers(self._k_ns(thread_id))
+            )
+            for ns in namespaces:
+                for raw_id in self.client.zrevrange(self._k_idx(thread_id, ns), 0, -1):
+                    checkpoint_id = _as_str(raw_id)
+                    if want_id and checkpoint_id != want_id:
+                        continue
+                    if before_id and checkpoint_id >= before_id:
+                        continue
+                    item = self._load_tuple(thread_id, ns, checkpoint_id)
+                    if item is None:
+                        continue
+                    if filter and any(item.metadata.get(k) != v for k, v in filter.items()):
+                        continue
+                    yield item
+                    count += 1
+                    if limit is not None and count >= limit:
+                        return
+
+    # ---------- 写 ----------
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = str(config["configurable"]["thread_id"])
+        ns = config["configurable"].get("checkpoint_ns", "")
+        type_, serialized = self.serde.dumps_typed(checkpoint)
+        # metadata 可能含非 JSON 值（如 datetime、自定义对象），与 checkpoint 一样经 serde 序列化
+        metadata_type, serialized_metadata = self.serde.dumps_typed(get_checkpoint_metadata(config, metadata))
+
+        cp_key = self._k_cp(thread_id, ns, checkpoint["id"])
+        self.client.hset(cp_key, mapping={
+            "type": type_,
+            "checkpoint": serialized,
+            "metadata_type": metadata_type,
+            "metadata": serialized_metadata,
+            "parent": config["configurable"].get("checkpoint_id") or "",
+        })
+        self.client.zadd(self._k_idx(thread_id, ns), {checkpoint["id"]: _checkpoint_score(checkpoint)})
+        self.client.sadd(self._k_ns(thread_id), ns)
+        self.client.sadd(self._k_threads(), thread_id)
+        self._expire(cp_key, self._k_idx(thread_id, ns), self._k_ns(thread_id))
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": ns, "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(
+        self,
+        config: RunnableConfig,
+        writes: Sequence[Tuple[str, Any]],
+        task_id: str,
+        task_path: str = "",
+    ) -> None:
+        thread_id = str(config["configurable"]["thread_id"])
+        ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        key = self._k_writes(thread_id, ns, checkpoint_id)
+        # 与 SqliteSaver 一致：特殊 channel 覆盖写，普通 channel 只写一次
+        replace = all(w[0] in WRITES_IDX_MAP for w in writes)
+        existing = set() if replace else {_as_str(f) for f in (self.client.hgetall(key) or {}).keys()}
+        mapping: Dict[str, str] = {}
+        for idx, (channel, value) in enumerate(writes):
+            idx = WRITES_IDX_MAP.get(channel, idx)
+            field = f"{task_id}:{idx}"
+            if field in existing:
+                continue
+            type_, serialized = self.serde.dumps_typed(value)
+            mapping[field] = json.dumps({
+                "task_id": task_id,
+                "task_path": task_path,
+                "idx": idx,
+                "channel": channel,
+                "type": type_,
+                "value": serialized.decode("latin-1"),
+            })
+        if mapping:
+            self.client.hset(key, mapping=mapping)
+            self._expire(key)
+
+    def delete_thread(self, thread_id: str) -> None:
+        thread_id = str(thread_id)
+        keys: List[str] = [self._k_ns(thread_id)]
+        for raw_ns in self.client.smembers(self._k_ns(thread_id)):
+            ns = _as_str(raw_ns)
+            idx_key = self._k_idx(thread_id, ns)
+            for raw_id in self.client.zrevrange(idx_key, 0, -1):
+                checkpoint_id = _as_str(raw_id)
+                keys.append(self._k_cp(thread_id, ns, checkpoint_id))
+                keys.append(self._k_writes(thread_id, ns, checkpoint_id))
+            keys.append(idx_key)
+        self.client.delete(*keys)
+        self.client.srem(self._k_threads(), thread_id)
+
+
+_checkpointer: Optional[BaseCheckpointSaver] = None
+_checkpointer_key: Optional[str] = None
+# 配置变化后被替换的实例：旧 Agent 上进行中的请求 / 流可能仍在使用，等到 shutdown 再关闭
+_retired: List[BaseCheckpointSaver] = []
+_checkpointer_lock = threading.Lock()
+
+
+def _create(settings: Dict[str, Any]) -> Optional[BaseCheckpointSaver]:
+    backend = str(settings.get("backend", "memory")).lower()
+    if backend in {"none", "off", "disabled", ""}:
+        return None
+    if backend == "memory":
+        return LRUMemorySaver(max_threads=int(settings.get("max_threads", 1000)))
+    if backend == "sqlite":
+        if not _SQLITE_AVAILABLE:
+            raise RuntimeError("langgraph-checkpoint-sqlite 未安装，无法使用 sqlite checkpointer")
+        return WALSqliteSaver.open(str(settings.get("path", "./data/checkpoints.sqlite")))
+    if backend == "redis":
+        return RedisSaver.from_url(
+            str(settings.get("url", "redis://localhost:6379/0")),
+            prefix=str(settings.get("prefix", "deepagents:ckpt")),
+            ttl_seconds=int(settings.get("ttl_seconds", 0)),
+        )
+    raise ValueError(f"未知的 checkpointer backend: {backend}")
+
+
+def get_checkpointer(config: Optional[Dict[str, Any]] = None) -> Optional[BaseCheckpointSaver]:
+    """
+    返回进程级 checkpointer。
+
+    同一份 checkpointer 配置复用同一个实例，Agent 重建后会话状态不丢失；
+    配置变化时创建新实例，旧实例保留到 shutdown（仍在旧 Agent 上运行的请求继续可用）。
+    """
+    global _checkpointer, _checkpointer_key
+    config = config or {}
+    settings = config.get("checkpointer") if isinstance(config.get("checkpointer"), dict) else {}
+    shared = os.getenv("DEEPAGENTS_SHARED_CHECKPOINTER")
+    if shared and str(settings.get("backend", "memory")).lower() == "memory":
+        # 多 worker 模式（cluster.py）：进程内的 memory 后端无法在 worker 之间共享，改用共享后端
+        settings = json.loads(shared)
+    key = json.dumps(settings, sort_keys=True, default=str)
+
+    with _checkpointer_lock:
+        if _checkpointer_key == key:
+            return _checkpointer
+        previous = _checkpointer
+        _checkpointer = _create(settings)
+        _checkpointer_key = key
+        if previous is not None:
+            _retired.append(previous)
+        return _checkpointer
+
+
+def _close(saver: BaseCheckpointSaver) -> None:
+    close = getattr(saver, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception as e:
+            print(f"⚠️  checkpointer 关闭失败: {type(e).__name__}: {e}")
+
+
+def close_checkpointer() -> None:
+    """关闭 checkpointer（在应用 shutdown 时调用）"""
+    global _checkpointer, _checkpointer_key
+    with _checkpointer_lock:
+        to_close = _retired[:] + ([_checkpointer] if _checkpointer is not None else [])
+        _retired.clear()
+        _checkpointer, _checkpointer_key = None, None
+    for saver in to_close:
+        _close(saver)
@@ -6,6 +6,8 @@ URL = "http://localhost:8001/chat"
 
 def chat():
     print("Welcome to DeepAgents Chat! Type 'exit' or 'quit' to stop.")
+    # 服务端按 thread_id 保存会话状态，每轮只需发送新消息
+    thread_id = None
     while True:
         try:
             user_input = input("\nYou: ")
@@ -15,11 +17,14 @@ def chat():
             payload = {
                 "messages": [{"role": "user", "content": user_input}]
             }
+            if thread_id:
+                payload["thread_id"] = thread_id
             
             response = requests.post(URL, json=payload)
             response.raise_for_status()
             
             data = response.json()
+            thread_id = data.get("thread_id") or thread_id
             print(f"Agent: {data.get('content')}")
             
         except requests.exceptions.ConnectionError:
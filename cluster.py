@@ -0,0 +1,449 @@
+"""多 worker 部署 - 单机多进程运行 main:app，按 thread_id 亲和路由，stdio MCP server 每台主机只启动一份
+
+用法（在项目根目录执行，代替 uvicorn main:app --workers N）:
+    python cluster.py --workers 4 --port 8000
+
+config.json 格式:
+{
+  "cluster": {
+    "workers": 0,                   # worker 进程数（0 表示 CPU 核数），--workers 优先
+    "host": "0.0.0.0",
+    "port": 8000,
+    "share_stdio_mcp": true,        # stdio MCP server 由前端进程启动一份，worker 经 Streamable HTTP 共用
+    "checkpointer": {"backend": "sqlite", "path": "./data/checkpoints.sqlite"},   # config.checkpointer 为 memory 时 worker 改用的共享后端
+    "restart_delay": 1,             # worker 异常退出后重启前的等待（秒）
+    "startup_timeout": 120          # 等待 worker 就绪（/health）的最长时间（秒），超时未就绪的 worker 杀掉重启
+  }
+}
+
+- 前端进程只做转发：/chat 与 /chat/stream 按 thread_id 做 rendezvous 哈希选择 worker；未携带 thread_id 的请求
+  由前端生成后写入请求体，首轮与后续轮次落在同一 worker。其他请求发给进行中请求最少的 worker，
+  请求头 X-Deepagents-Worker: <序号> 可指定 worker（如逐个抓取 /metrics、/agent/stats）。
+- worker 不可用（启动中 / 崩溃重启中）时按哈希顺序落到下一个 worker：会话状态（消息与 StateBackend 文件）
+  保存在共享 checkpointer（SQLite WAL 或 Redis）中，换 worker 不影响对话正确性，只是失去该 worker 的进程内缓存；
+  /memories/ 的写入已有跨进程文件锁（memory_store）。
+- stdio MCP server 的子进程与常驻会话由前端进程的 MCPConnectionManager 持有（host 级 max_concurrent_calls），
+  以 Streamable HTTP 挂在 /_mcp/<server>/ 下，只接受携带启动时随机 token 的请求；worker 通过 DEEPAGENTS_MCP_SHARED
+  把命令一致的同名 stdio server 换成该地址。前端不热加载配置：新增或修改的 stdio server 由各 worker 自行启动。
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import json
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Mount, Route
+
+try:
+    from mcp.server.lowlevel import Server as MCPServer
+    from mcp.server.streamable_http_manager import StreamableHTTPSessionManager
+    from mcp.types import Tool as MCPTool
+except ImportError:
+    # 未安装 mcp 时 start_shared_stdio() 返回空，不会创建 StdioBridge
+    MCPServer = StreamableHTTPSessionManager = MCPTool = None  # type: ignore
+
+from config_service import ConfigError, config_path, parse_config
+from mcp_tools import close_mcp_connections, get_connection_manager, start_shared_stdio, stdio_key
+
+ROOT_DIR = Path(__file__).resolve().parent
+
+_DEFAULTS: Dict[str, Any] = {
+    "workers": 0,
+    "host": "0.0.0.0",
+    "port": 8000,
+    "share_stdio_mcp": True,
+    "checkpointer": {"backend": "sqlite", "path": "./data/checkpoints.sqlite"},
+    "restart_delay": 1.0,
+    "startup_timeout": 120.0,
+}
+
+# 带会话亲和的路由：请求体中的 thread_id 决定 worker
+_AFFINITY_PATHS = {"/chat", "/chat/stream"}
+WORKER_HEADER = "x-deepagents-worker"
+_HOP_HEADERS = {"connection", "keep-alive", "transfer-encoding", "te", "trailer", "upgrade"}
+# 转发时由 httpx 按新请求体重新生成
+_REQUEST_HEADERS_DROP = _HOP_HEADERS | {"host", "content-length"}
+
+
+def cluster_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    section = config.get("cluster") if isinstance(config.get("cluster"), dict) else {}
+    return {key: section.get(key, default) for key, default in _DEFAULTS.items()}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rendezvous(key: str, workers: List["Worker"]) -> List["Worker"]:
+    """按 hash(key, worker 序号) 排序：worker 不可用时只有落在它上面的会话换到下一个 worker"""
+    return sorted(
+        workers,
+        key=lambda w: hashlib.blake2b(f"{key}:{w.index}".encode("utf-8"), digest_size=8).digest(),
+        reverse=True,
+    )
+
+
+def _with_thread_id(body: bytes) -> Tuple[bytes, Optional[str]]:
+    """取出请求体中的 thread_id；没有时生成一个写回请求体，保证首轮与后续轮次路由一致"""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return body, None
+    if not isinstance(payload, dict):
+        return body, None
+    thread_id = payload.get("thread_id")
+    if not thread_id:
+        thread_id = uuid.uuid4().hex
+        payload["thread_id"] = thread_id
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return body, str(thread_id)
+
+
+class Worker:
+    """一个 uvicorn main:app 子进程（只监听 127.0.0.1）"""
+
+    def __init__(self, index: int, port: int, env: Dict[str, str], log_level: str) -> None:
+        self.index = index
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.env = env
+        self.log_level = log_level
+        self.proc: Optional[subprocess.Popen] = None
+        self.ready = False
+        self.started_at: Optional[float] = None
+        self.restarts = 0
+        self.routed = 0
+        self.active = 0
+        self.connect_errors = 0
+
+    def spawn(self) -> None:
+        self.ready = False
+        self.proc = subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--app-dir", str(ROOT_DIR),
+                "--host", "127.0.0.1", "--port", str(self.port),
+                "--log-level", self.log_level,
+            ],
+            env=self.env,
+        )
+        self.started_at = time.time()
+
+    def alive(self) -> bool:
+        return self.proc is not None and self.proc.poll() is None
+
+    def stop(self, timeout: float = 10.0) -> None:
+        proc = self.proc
+        self.ready = False
+        if proc is None or proc.poll() is not None:
+            return
+        proc.terminate()
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "pid": self.proc.pid if self.proc is not None else None,
+            "port": self.port,
+            "ready": self.ready,
+            "started_at": self.started_at,
+            "restarts": self.restarts,
+            "routed": self.routed,
+            "active": self.active,
+            "connect_errors": self.connect_errors,
+        }
+
+
+class _RelayResponse(StreamingResponse):
+    """
+    转发 worker 的流式响应。
+
+    worker.active 的归还与上游连接的关闭放在包住整个发送过程的 finally 中：正常结束、客户端断开
+    （上游连接随之关闭，worker 取消 Agent 执行）或上游读取出错时都会执行；BackgroundTask 在出错时不会运行。
+    """
+
+    def __init__(self, upstream: httpx.Response, worker: Worker, headers: Dict[str, str]) -> None:
+        super().__init__(upstream.aiter_raw(), status_code=upstream.status_code, headers=headers)
+        self.upstream = upstream
+        self.worker = worker
+
+    async def __call__(self, scope: Any, receive: Any, send: Any) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.worker.active -= 1
+            await self.upstream.aclose()
+
+
+class StdioBridge:
+    """把前端进程持有的 stdio MCP 会话以 Streamable HTTP（无状态模式）暴露给 worker"""
+
+    def __init__(self, servers: Dict[str, Dict[str, Any]], token: str) -> None:
+        self.servers = servers
+        self.token = token
+        self.calls: Dict[str, int] = {name: 0 for name in servers}
+        self.rejected = 0
+        self._sessions = {
+            name: StreamableHTTPSessionManager(app=self._server(name), stateless=True)
+            for name in servers
+        }
+
+    def _server(self, name: str) -> Any:
+        manager = get_connection_manager()
+        server = MCPServer(f"deepagents-shared-{name}")
+
+        @server.list_tools()
+        async def list_tools() -> List[Any]:
+            return [MCPTool.model_validate(schema) for schema in manager.tool_schemas(name)]
+
+        # 参数校验由原 server 完成，返回的 CallToolResult 原样透传
+        @server.call_tool(validate_input=False)
+        async def call_tool(tool: str, arguments: Dict[str, Any]) -> Any:
+            self.calls[name] += 1
+            return await manager.call_tool(name, tool, arguments)
+
+        return server
+
+    def shared_env(self, base_url: str) -> str:
+        """worker 的 DEEPAGENTS_MCP_SHARED"""
+        return json.dumps({
+            name: {
+                "url": f"{base_url}/_mcp/{name}/",
+                "key": stdio_key(connection),
+                "headers": {"Authorization": f"Bearer {self.token}"},
+            }
+            for name, connection in self.servers.items()
+        })
+
+    @contextlib.asynccontextmanager
+    async def run(self):
+        async with contextlib.AsyncExitStack() as stack:
+            for session in self._sessions.values():
+                await stack.enter_async_context(session.run())
+            yield
+
+    def asgi(self, name: str):
+        session = self._sessions[name]
+        expected = f"Bearer {self.token}".encode("utf-8")
+
+        async def app(scope, receive, send) -> None:
+            headers = dict(scope.get("headers") or [])
+            if not secrets.compare_digest(headers.get(b"authorization", b""), expected):
+                self.rejected += 1
+                await JSONResponse({"detail": "forbidden"}, status_code=403)(scope, receive, send)
+                return
+            await session.handle_request(scope, receive, send)
+
+        return app
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "servers": list(self.servers),
+            "calls": dict(self.calls),
+            "rejected": self.rejected,
+            "status": {name: get_connection_manager().status().get(name) for name in self.servers},
+        }
+
+
+class Cluster:
+    """worker 进程的启动 / 就绪检测 / 崩溃重启，以及前端的亲和转发"""
+
+    def __init__(self, config: Dict[str, Any], settings: Dict[str, Any], log_level: str = "info") -> None:
+        self.settings = settings
+        self.host = str(settings["host"])
+        self.port = int(settings["port"])
+        count = int(settings["workers"]) or (os.cpu_count() or 1)
+        self.bridge: Optional[StdioBridge] = None
+        if settings["share_stdio_mcp"]:
+            servers = start_shared_stdio(config)
+            if servers:
+                self.bridge = StdioBridge(servers, secrets.token_urlsafe(24))
+        self.workers = [Worker(i, _free_port(), self._worker_env(config, i), log_level) for i in range(count)]
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(None, connect=5.0),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=64),
+        )
+        self.no_worker = 0
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+
+    def _worker_env(self, config: Dict[str, Any], index: int) -> Dict[str, str]:
+        env = dict(os.environ)
+        env["DEEPAGENTS_CONFIG"] = str(config_path().resolve())
+        env["DEEPAGENTS_WORKER_ID"] = str(index)
+        if self.bridge is not None:
+            env["DEEPAGENTS_MCP_SHARED"] = self.bridge.shared_env(f"http://127.0.0.1:{self.port}")
+        checkpointer = config.get("checkpointer") if isinstance(config.get("checkpointer"), dict) else {}
+        if str(checkpointer.get("backend", "memory")).lower() == "memory" and self.settings["checkpointer"]:
+            env["DEEPAGENTS_SHARED_CHECKPOINTER"] = json.dumps(self.settings["checkpointer"])
+        return env
+
+    async def start(self) -> None:
+        shared = json.loads(self.workers[0].env.get("DEEPAGENTS_SHARED_CHECKPOINTER", "null"))
+        print(f"🧩 多 worker 模式: {len(self.workers)} 个 worker，共享 checkpointer: {shared or '按 config.checkpointer'}，"
+              f"共享 stdio MCP: {list(self.bridge.servers) if self.bridge else []}")
+        # 不等待 worker 就绪：前端要先开始监听，worker 启动时才能连上 /_mcp/ 下的共享 stdio server
+        self._tasks = [asyncio.create_task(self._supervise(worker), name=f"worker:{worker.index}") for worker in self.workers]
+        self._tasks.append(asyncio.create_task(self._report_ready()))
+
+    async def _report_ready(self) -> None:
+        deadline = time.monotonic() + float(self.settings["startup_timeout"])
+        while not all(w.ready for w in self.workers) and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+        print(f"✅ {sum(1 for w in self.workers if w.ready)}/{len(self.workers)} 个 worker 就绪")
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.gather(*(asyncio.to_thread(worker.stop) for worker in self.workers))
+        await self.client.aclose()
+
+    async def _supervise(self, worker: Worker) -> None:
+        while not self._stopping:
+            worker.spawn()
+            if await self._wait_ready(worker):
+                while worker.alive():
+                    await asyncio.sleep(0.5)
+                reason = f"已退出（code={worker.proc.returncode}）"
+            elif worker.alive():
+                # 进程仍在但超时未通过 /health（如卡在启动阶段）：杀掉重启，否则会一直不接收请求
+                await asyncio.to_thread(worker.stop)
+                reason = f"启动超时（>{float(self.settings['startup_timeout']):g}s 未就绪）"
+            else:
+                reason = f"启动失败（code={worker.proc.returncode}）"
+            worker.ready = False
+            if self._stopping:
+                return
+            worker.restarts += 1
+            print(f"⚠️  worker {worker.index} {reason}，{self.settings['restart_delay']}s 后重启")
+            await asyncio.sleep(float(self.settings["restart_delay"]))
+
+    async def _wait_ready(self, worker: Worker) -> bool:
+        deadline = time.monotonic() + float(self.settings["startup_timeout"])
+        while worker.alive() and time.monotonic() < deadline:
+            try:
+                if (await self.client.get(f"{worker.url}/health", timeout=1)).status_code == 200:
+                    worker.ready = True
+                    return True
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+        return False
+
+    def candidates(self, request: Request, thread_id: Optional[str]) -> List[Worker]:
+        ready = [w for w in self.workers if w.ready]
+        pinned = request.headers.get(WORKER_HEADER)
+        if pinned is not None:
+            return [w for w in ready if str(w.index) == pinned]
+        if thread_id is not None:
+            return rendezvous(thread_id, ready)
+        return sorted(ready, key=lambda w: (w.active, w.routed))
+
+    async def proxy(self, request: Request) -> Response:
+        body = await request.body()
+        thread_id = None
+        if request.method == "POST" and request.url.path in _AFFINITY_PATHS:
+            body, thread_id = _with_thread_id(body)
+        headers = [(k, v) for k, v in request.headers.raw if k.decode("latin-1").lower() not in _REQUEST_HEADERS_DROP]
+
+        for worker in self.candidates(request, thread_id):
+            upstream = self.client.build_request(
+                request.method,
+                f"{worker.url}{request.url.path}",
+                params=request.url.query,
+                headers=headers,
+                content=body,
+            )
+            try:
+                response = await self.client.send(upstream, stream=True)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                # 请求尚未送达，换下一个 worker
+                worker.connect_errors += 1
+                continue
+            worker.routed += 1
+            worker.active += 1
+            response_headers = {k: v for k, v in response.headers.items() if k.lower() not in _HOP_HEADERS}
+            response_headers[WORKER_HEADER] = str(worker.index)
+            return _RelayResponse(response, worker, response_headers)
+
+        self.no_worker += 1
+        return JSONResponse({"detail": "没有可用的 worker"}, status_code=503, headers={"Retry-After": "1"})
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": [worker.stats() for worker in self.workers],
+            "ready": sum(1 for w in self.workers if w.ready),
+            "no_worker": self.no_worker,
+            "shared_checkpointer": json.loads(self.workers[0].env.get("DEEPAGENTS_SHARED_CHECKPOINTER", "null")) if self.workers else None,
+            "shared_stdio_mcp": self.bridge.stats() if self.bridge is not None else None,
+        }
+
+
+def create_app(cluster: Cluster) -> Starlette:
+    @contextlib.asynccontextmanager
+    async def lifespan(app: Starlette):
+        async with (cluster.bridge.run() if cluster.bridge is not None else contextlib.nullcontext()):
+            await cluster.start()
+            try:
+                yield
+            finally:
+                await cluster.stop()
+                await asyncio.to_thread(close_mcp_connections)
+
+    async def cluster_stats(request: Request) -> Response:
+        return JSONResponse(cluster.stats())
+
+    routes: List[Any] = [Route("/cluster/stats", cluster_stats, methods=["GET"])]
+    if cluster.bridge is not None:
+        routes += [Mount(f"/_mcp/{name}", app=cluster.bridge.asgi(name)) for name in cluster.bridge.servers]
+    routes.append(Route("/{path:path}", cluster.proxy, methods=["GET", "POST", "PUT", "PATCH", "DELETE", "HEAD", "OPTIONS"]))
+    return Starlette(routes=routes, lifespan=lifespan)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="多 worker 模式运行 deepagents-minimal")
+    parser.add_argument("--workers", type=int, default=None, help="worker 进程数（默认 cluster.workers，0 为 CPU 核数）")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--port", type=int, default=None)
+    parser.add_argument("--log-level", default="warning", help="worker 的 uvicorn 日志级别")
+    args = parser.parse_args()
+
+    path = config_path()
+    try:
+        config = parse_config(path.read_text(encoding="utf-8")) if path.exists() else {}
+    except ConfigError as e:
+        raise SystemExit(f"❌ {path}: {e}")
+    settings = cluster_settings(config)
+    for key in ("workers", "host", "port"):
+        if getattr(args, key) is not None:
+            settings[key] = getattr(args, key)
+
+    cluster = Cluster(config, settings, log_level=args.log_level)
+    uvicorn.run(create_app(cluster), host=cluster.host, port=cluster.port, log_level="info")
+
+
+if __name__ == "__main__":
+    main()
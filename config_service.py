@@ -0,0 +1,300 @@
+"""配置服务 - config.json 只在启动、文件变化或显式 reload 时读取一次并按 schema 校验，请求路径只读内存快照
+
+config.json 格式:
+{
+  "config_reload": {
+    "watch": true,       # 后台线程监视 config.json，内容变化后在后台重建 Agent 并原子替换
+    "interval": 2        # 检查间隔（秒）
+  }
+}
+
+- 校验失败（JSON 语法错误、字段类型不对，如 mcp.servers 写成列表）或运行中文件被删除时保留上一份配置与 Agent，
+  错误记录在 /agent/stats 的 config.last_error；未列出的字段原样保留，不影响各模块自己的默认值。
+- config.env 写入 os.environ：进程启动时已存在的环境变量优先（不覆盖）；由配置写入的变量在重新加载时
+  跟随配置更新，从配置中删除后同步从 os.environ 删除。
+- watch 为 false 时只在 POST /config/reload 或 MCP tool schema 变化时重建。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Literal, Optional, Set, Tuple, Union
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, model_validator
+
+from tracing import span
+
+_DEFAULTS: Dict[str, Any] = {
+    "watch": True,
+    "interval": 2.0,
+}
+
+
+def reload_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    section = config.get("config_reload") if isinstance(config.get("config_reload"), dict) else {}
+    return {key: section.get(key, default) for key, default in _DEFAULTS.items()}
+
+
+def config_path() -> Path:
+    return Path(os.getenv("DEEPAGENTS_CONFIG", "./config.json"))
+
+
+# ---------- schema：只约束各模块依赖的结构，未知字段原样保留 ----------
+
+
+class _Section(BaseModel):
+    model_config = ConfigDict(extra="allow")
+
+
+Section = Optional[Dict[str, Any]]
+
+
+class EndpointSchema(_Section):
+    base_url: str
+    weight: float = Field(default=1.0, ge=0)
+    headers: Dict[str, str] = Field(default_factory=dict)
+
+
+class ModelSchema(_Section):
+    name: Optional[str] = None
+    base_url: Optional[str] = None
+    api_key: Optional[str] = None
+    accesscode: Optional[str] = None
+    endpoints: List[Union[str, EndpointSchema]] = Field(default_factory=list)
+    gateway: Section = None
+    http: Section = None
+
+
+class MCPServerSchema(_Section):
+    url: Optional[str] = None
+    command: Optional[str] = None
+    args: List[str] = Field(default_factory=list)
+    # 与 langchain-mcp-adapters 支持的取值一致
+    transport: Optional[Literal["sse", "http", "streamable_http", "streamable-http", "stdio", "websocket"]] = None
+    headers: Dict[str, str] = Field(default_factory=dict)
+    timeout: Optional[float] = Field(default=None, gt=0)
+    discovery_timeout: Optional[float] = Field(default=None, gt=0)
+    max_concurrent_calls: Optional[int] = Field(default=None, ge=1)
+    max_qps: Optional[float] = Field(default=None, ge=0)
+
+    @model_validator(mode="after")
+    def _url_or_command(self) -> "MCPServerSchema":
+        if not self.url and not self.command:
+            raise ValueError("需要 url 或 command")
+        return self
+
+
+class MCPSchema(_Section):
+    disabled: Union[bool, str] = False
+    servers: Dict[str, Union[str, MCPServerSchema]] = Field(default_factory=dict)
+    result_cache: Section = None
+    drain_timeout: Optional[float] = Field(default=None, ge=0)
+    max_concurrent_calls: Optional[int] = Field(default=None, ge=1)
+    max_qps: Optional[float] = Field(default=None, ge=0)
+
+
+class ReloadSchema(_Section):
+    watch: bool = True
+    interval: float = Field(default=2.0, gt=0)
+
+
+class ConfigSchema(_Section):
+    model: ModelSchema = Field(default_factory=ModelSchema)
+    mcp: MCPSchema = Field(default_factory=MCPSchema)
+    env: Dict[str, Optional[Union[str, int, float, bool]]] = Field(default_factory=dict)
+    skills_dir: Optional[str] = None
+    memories_dir: Optional[str] = None
+    memory_files: Optional[List[str]] = None
+    react_prompt: Optional[str] = None
+    response_format: Section = None
+    config_reload: ReloadSchema = Field(default_factory=ReloadSchema)
+    # 各功能模块的配置段：只要求是对象，具体字段由模块的 xxx_settings() 解释
+    concurrency: Section = None
+    stream: Section = None
+    tracing: Section = None
+    checkpointer: Section = None
+    context: Section = None
+    results: Section = None
+    relevance: Section = None
+    skills_index: Section = None
+    memory_store: Section = None
+    memory_namespaces: Section = None
+    model_routing: Section = None
+    response_cache: Section = None
+    enrich: Section = None
+    cluster: Section = None
+
+
+class ConfigError(Exception):
+    """配置文件无法解析或未通过 schema 校验"""
+
+
+def _describe(e: ValidationError) -> str:
+    errors = e.errors()
+    parts = [f"{'.'.join(str(p) for p in err['loc']) or '<root>'}: {err['msg']}" for err in errors[:5]]
+    more = f"（另有 {len(errors) - 5} 处）" if len(errors) > 5 else ""
+    return "; ".join(parts) + more
+
+
+def parse_config(text: str) -> Dict[str, Any]:
+    """解析并校验配置；返回原始 dict（各模块仍按 dict 读取），失败时抛出 ConfigError"""
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ConfigError(f"JSON 解析失败: {e}") from None
+    if not isinstance(data, dict):
+        raise ConfigError("顶层必须是 JSON 对象")
+    try:
+        ConfigSchema.model_validate(data)
+    except ValidationError as e:
+        raise ConfigError(f"校验失败: {_describe(e)}") from None
+    return data
+
+
+def fingerprint_of(config: Dict[str, Any]) -> str:
+    raw = json.dumps(config, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+# ---------- config.env ----------
+
+_env_lock = threading.Lock()
+# 由配置写入 os.environ 的 key；不在其中的已有环境变量视为进程环境，配置不覆盖
+_env_owned: Set[str] = set()
+
+
+def apply_env(config: Dict[str, Any]) -> None:
+    """把 config.env 同步到 os.environ：更新 / 删除配置写入过的 key，不覆盖进程原有的环境变量"""
+    env = config.get("env") if isinstance(config.get("env"), dict) else {}
+    wanted = {str(key): str(value) for key, value in env.items() if key and value is not None}
+    with _env_lock:
+        for key in list(_env_owned):
+            if key not in wanted:
+                os.environ.pop(key, None)
+                _env_owned.discard(key)
+        for key, value in wanted.items():
+            if key not in _env_owned and key in os.environ:
+                continue
+            os.environ[key] = value
+            _env_owned.add(key)
+
+
+# ---------- 配置源 ----------
+
+
+class ConfigSource:
+    """config.json 的内存快照：按 (mtime, size) 判断文件是否变化，变化时才读取、校验"""
+
+    def __init__(self, path: Callable[[], Path] = config_path) -> None:
+        self._path = path
+        self._stat_key: Optional[tuple] = None
+        self.config: Dict[str, Any] = {}
+        self.fingerprint: Optional[str] = None
+        self.loads = 0
+        self.rejected = 0
+        self.last_loaded_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    def _stat(self) -> tuple:
+        path = self._path()
+        try:
+            st = path.stat()
+            return (str(path), st.st_mtime_ns, st.st_size)
+        except OSError:
+            return (str(path), None, None)
+
+    def changed(self) -> bool:
+        return self._stat() != self._stat_key
+
+    def load(self) -> Tuple[Dict[str, Any], bool]:
+        """
+        读取并校验配置文件，返回 (配置, 内容是否变化)。
+
+        首次加载时文件不存在视为空配置；已有配置后文件消失（编辑器替换文件、误删）与解析或校验失败一样，
+        保留上一份配置并抛出 ConfigError（同一份错误内容不会重复读取，直到文件再次变化）。
+        """
+        stat_key = self._stat()
+        path = Path(stat_key[0])
+        with span("config.load", path=str(path)):
+            try:
+                if stat_key[1] is not None:
+                    config = parse_config(path.read_text(encoding="utf-8"))
+                elif self.fingerprint is None:
+                    config = {}
+                else:
+                    raise ConfigError(f"配置文件不存在: {path}")
+            except ConfigError as e:
+                self._stat_key = stat_key
+                self.rejected += 1
+                self.last_error = str(e)
+                raise
+            except OSError as e:
+                raise ConfigError(f"读取失败: {type(e).__name__}: {e}") from None
+        self._stat_key = stat_key
+        self.last_error = None
+        fingerprint = fingerprint_of(config)
+        if fingerprint == self.fingerprint:
+            return self.config, False
+        self.config = config
+        self.fingerprint = fingerprint
+        self.loads += 1
+        self.last_loaded_at = time.time()
+        return config, True
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": str(self._path()),
+            "fingerprint": self.fingerprint,
+            "loads": self.loads,
+            "rejected": self.rejected,
+            "last_loaded_at": self.last_loaded_at,
+            "last_error": self.last_error,
+        }
+
+
+class ConfigWatcher:
+    """后台守护线程：每 interval 秒调用一次 check()，trigger() 立即唤醒"""
+
+    def __init__(self, check: Callable[[], None], interval: Callable[[], float]) -> None:
+        self._check = check
+        self._interval = interval
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.checks = 0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        thread, self._thread = self._thread, None
+        self._stopped.set()
+        self._wake.set()
+        if thread is not None:
+            thread.join(timeout)
+
+    def trigger(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stopped.is_set():
+            self._wake.wait(max(0.1, float(self._interval())))
+            self._wake.clear()
+            if self._stopped.is_set():
+                break
+            self.checks += 1
+            try:
+                self._check()
+            except Exception as e:
+                print(f"⚠️  配置检查失败: {type(e).__name__}: {e}")
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
@@ -0,0 +1,209 @@
+"""上下文窗口管理 - 大 tool 输出转存到虚拟文件系统 + 超出 token 预算时摘要早期对话（默认关闭）
+
+config.json 格式:
+{
+  "context": {
+    "enabled": false,
+    "max_input_tokens": 64000,          # 发给模型的上下文 token 预算
+    "summarize_at": 0.75,               # 估算 token 数超过 预算 × 该比例 时摘要早期对话
+    "keep_messages": 12,                # 摘要后保留的最近消息条数
+    "tool_output_max_tokens": 4000,     # 单个 tool 输出超过该值时转存，消息中只留引用 + 预览
+    "tool_output_preview_lines": 20,
+    "tool_output_dir": "/tool_outputs"
+  }
+}
+
+- tool 输出转存：完整内容写入 StateBackend（随 checkpoint 持久化，但不再进入每次的模型请求），
+  消息中替换为文件路径 + 概要（JSON 会给出记录数和字段名）+ 前几行，模型需要细节时用 read_file / grep 分页查看。
+  ls/read_file/grep 等文件 tool 自身的输出不转存（否则分页读取会被再次转存）。
+- 摘要：复用 deepagents 的 SummarizationMiddleware，触发条件/保留条数改为上面的预算配置；
+  被摘要的原始消息写入 /conversation_history/<thread_id>.md。
+token 数用 langchain 的 count_tokens_approximately 估算（约 4 字符 / token）。
+
+与 deepagents 内置 middleware 的关系：create_deep_agent 总会安装 FilesystemMiddleware（tool 输出超过
+20000 tokens 时驱逐到 /large_tool_results/）和 SummarizationMiddleware（有模型 profile 时在 85% 上下文触发，
+否则 170000 tokens），且不提供修改这两个阈值的参数，所以按预算的转存与摘要只能作为额外的 middleware 加入：
+- 转存：本模块的 middleware 位于内置 FilesystemMiddleware 之内，先处理 tool 输出；超过 tool_output_max_tokens
+  的输出被替换为引用后，内置驱逐看到的是小消息，不再触发。tool_output_max_tokens ≥ 20000 时由内置驱逐先生效。
+- 摘要：内置摘要的 before_model 先执行，但阈值更高；本模块在 max_input_tokens × summarize_at 处先摘要，
+  此后消息保持在预算内，内置摘要只在单步增长超过两者差值时作为兜底触发。
+- subagent（task tool）只有内置 middleware，不受本配置影响。
+"""
+
+import json
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.types import Command
+
+from deepagents.backends.utils import sanitize_tool_call_id
+from deepagents.middleware.summarization import SummarizationMiddleware
+
+try:
+    from deepagents.middleware.filesystem import TOOLS_EXCLUDED_FROM_EVICTION
+except ImportError:
+    TOOLS_EXCLUDED_FROM_EVICTION = ("ls", "glob", "grep", "read_file", "edit_file", "write_file")
+
+_DEFAULTS: Dict[str, Any] = {
+    "enabled": False,
+    "max_input_tokens": 64000,
+    "summarize_at": 0.75,
+    "keep_messages": 12,
+    "tool_output_max_tokens": 4000,
+    "tool_output_preview_lines": 20,
+    "tool_output_dir": "/tool_outputs",
+}
+
+
+# deepagents FilesystemMiddleware 的默认 tool_token_limit_before_evict（create_deep_agent 不开放此参数）
+_BUILTIN_EVICT_TOKENS = 20000
+
+
+def context_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    section = config.get("context") if isinstance(config.get("context"), dict) else {}
+    return {key: section.get(key, default) for key, default in _DEFAULTS.items()}
+
+
+def content_text(content: Any) -> str:
+    if isinstance(content, list):
+        return "\n".join(
+            block if isinstance(block, str) else str(block.get("text", "")) if isinstance(block, dict) else str(block)
+            for block in content
+        )
+    return content if isinstance(content, str) else str(content)
+
+
+def describe_payload(text: str) -> str:
+    """JSON 输出的结构概要（记录数、字段名）；非 JSON 返回行数"""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return "%d 行文本" % (text.count("\n") + 1)
+    if isinstance(data, list):
+        fields = sorted(data[0].keys()) if data and isinstance(data[0], dict) else []
+        return f"JSON 数组，{len(data)} 条记录" + (f"，字段: {', '.join(fields)}" if fields else "")
+    if isinstance(data, dict):
+        parts = []
+        for key, value in data.items():
+            if isinstance(value, list):
+                fields = sorted(value[0].keys()) if value and isinstance(value[0], dict) else []
+                parts.append(f"{key}: {len(value)} 条" + (f"（字段: {', '.join(fields)}）" if fields else ""))
+            else:
+                parts.append(key)
+        return "JSON 对象，" + "; ".join(parts)
+    return "JSON 标量"
+
+
+class ToolOutputOffloadMiddleware(AgentMiddleware):
+    """tool 输出超过 token 阈值时写入虚拟文件系统，消息中只保留引用和预览"""
+
+    def __init__(
+        self,
+        backend: Callable[[Any], Any],
+        max_tokens: int = 4000,
+        preview_lines: int = 20,
+        output_dir: str = "/tool_outputs",
+    ) -> None:
+        super().__init__()
+        self.backend = backend
+        self.max_tokens = int(max_tokens)
+        self.preview_lines = int(preview_lines)
+        self.output_dir = "/" + output_dir.strip("/")
+        self.offloaded = 0
+        self.offloaded_tokens = 0
+
+    def _oversized(self, result: Any) -> Optional[str]:
+        if not isinstance(result, ToolMessage) or result.name in TOOLS_EXCLUDED_FROM_EVICTION:
+            return None
+        text = content_text(result.content)
+        # 先按字符数粗筛，避免每个小结果都做 token 估算
+        if len(text) <= self.max_tokens * 4:
+            return None
+        return text if count_tokens_approximately([result]) > self.max_tokens else None
+
+    def _reference(self, result: ToolMessage, path: str, text: str) -> ToolMessage:
+        lines = text.splitlines()
+        preview = "\n".join(line[:500] for line in lines[: self.preview_lines])
+        tokens = count_tokens_approximately([result])
+        content = (
+            f"[输出过大（约 {tokens} tokens），完整内容已保存到 {path}]\n"
+            f"概要: {describe_payload(text)}\n"
+            f"用 read_file(\"{path}\", offset=..., limit=...) 分页查看，或用 grep 搜索。\n"
+            f"前 {min(len(lines), self.preview_lines)} 行 / 共 {len(lines)} 行:\n{preview}"
+        )
+        self.offloaded += 1
+        self.offloaded_tokens += tokens
+        return ToolMessage(content=content, tool_call_id=result.tool_call_id, name=result.name, status=result.status)
+
+    def _path(self, result: ToolMessage) -> str:
+        # 部分模型/网关的 tool_call_id 不是全局唯一（如按消息序号生成），加随机后缀避免覆盖已有文件
+        return f"{self.output_dir}/{sanitize_tool_call_id(result.tool_call_id)}-{uuid.uuid4().hex[:6]}.txt"
+
+    def _replace(self, result: ToolMessage, path: str, text: str, write_result: Any) -> Any:
+        if write_result.error:
+            # 写入失败时退化为截断，保证上下文不会被撑爆
+            print(f"⚠️  tool 输出转存失败（{write_result.error}），改为截断")
+            limit = self.max_tokens * 4
+            return ToolMessage(
+                content=text[:limit] + f"\n...[已截断，原始长度 {len(text)} 字符]",
+                tool_call_id=result.tool_call_id, name=result.name, status=result.status,
+            )
+        message = self._reference(result, path, text)
+        if write_result.files_update is None:
+            return message
+        return Command(update={"files": write_result.files_update, "messages": [message]})
+
+    def wrap_tool_call(self, request, handler):
+        result = handler(request)
+        text = self._oversized(result)
+        if text is None:
+            return result
+        path = self._path(result)
+        return self._replace(result, path, text, self.backend(request.runtime).write(path, text))
+
+    async def awrap_tool_call(self, request, handler):
+        result = await handler(request)
+        text = self._oversized(result)
+        if text is None:
+            return result
+        path = self._path(result)
+        return self._replace(result, path, text, await self.backend(request.runtime).awrite(path, text))
+
+
+class BudgetSummarizationMiddleware(SummarizationMiddleware):
+    """
+    按 context.max_input_tokens 预算触发的摘要。
+
+    create_deep_agent 不允许同名 middleware 重复出现，内置的 SummarizationMiddleware 又无法改阈值，
+    因此用子类（不同类名）作为第二个摘要层；与内置摘要的配合见模块说明。
+    """
+
+
+def build_context_middleware(config: Dict[str, Any], model: Any, backend: Callable[[Any], Any]) -> List[AgentMiddleware]:
+    settings = context_settings(config)
+    if not settings["enabled"]:
+        return []
+    trigger_tokens = int(settings["max_input_tokens"] * settings["summarize_at"])
+    if int(settings["tool_output_max_tokens"]) >= _BUILTIN_EVICT_TOKENS:
+        print(f"⚠️  context.tool_output_max_tokens ≥ {_BUILTIN_EVICT_TOKENS}：deepagents 内置的驱逐会先生效")
+    print(
+        f"🧠 上下文管理: 预算 {settings['max_input_tokens']} tokens，超过 {trigger_tokens} 摘要，"
+        f"tool 输出 > {settings['tool_output_max_tokens']} tokens 转存到 {settings['tool_output_dir']}"
+    )
+    return [
+        ToolOutputOffloadMiddleware(
+            backend,
+            max_tokens=settings["tool_output_max_tokens"],
+            preview_lines=settings["tool_output_preview_lines"],
+            output_dir=settings["tool_output_dir"],
+        ),
+        BudgetSummarizationMiddleware(
+            model,
+            backend=backend,
+            trigger=("tokens", trigger_tokens),
+            keep=("messages", int(settings["keep_messages"])),
+        ),
+    ]
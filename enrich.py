@@ -0,0 +1,145 @@
+"""批量 IOC 富化 - 直接调用 asset-intel-lookup 的 MCP tools，不经过 LLM
+
+config.json 格式:
+{
+  "enrich": {
+    "asset_batch_size": 20,       # query_asset_info 每次逗号拼接的目标数
+    "max_iocs": 1000,             # 单次请求的 IOC 上限
+    "summary_max_chars": 20000    # 交给 LLM 总结的结果文本上限
+  }
+}
+
+- 域名/IP → query_asset_info，按 asset_batch_size 逗号拼接成批调用
+- 所有 IOC → query_ioc_reputation，每个 IOC 单独调用、全部并发
+
+调用经过 MCPConnectionManager，因此受每个 server 的 max_concurrent_calls
+限制并命中 result_cache；吞吐取决于后端限流而不是模型延迟。
+"""
+
+import asyncio
+import ipaddress
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List
+
+from langchain_core.tools import BaseTool
+
+ASSET_TOOL = "query_asset_info"
+REPUTATION_TOOL = "query_ioc_reputation"
+
+_DEFAULTS: Dict[str, Any] = {
+    "asset_batch_size": 20,
+    "max_iocs": 1000,
+    "summary_max_chars": 20000,
+}
+
+_DOMAIN = re.compile(r"^(?=.{1,253}$)(?:[a-z0-9](?:[a-z0-9-]{0,61}[a-z0-9])?\.)+[a-z]{2,63}$", re.IGNORECASE)
+
+
+def is_asset(value: str) -> bool:
+    """域名或 IP（含网段）才查资产归属；URL/哈希/邮箱只查信誉"""
+    try:
+        ipaddress.ip_network(value, strict=False)
+        return True
+    except ValueError:
+        return bool(_DOMAIN.match(value))
+
+
+def normalize_iocs(iocs: List[str]) -> List[str]:
+    """去空白、去重并保持原顺序"""
+    seen = set()
+    result = []
+    for ioc in iocs:
+        ioc = (ioc or "").strip()
+        if ioc and ioc not in seen:
+            seen.add(ioc)
+            result.append(ioc)
+    return result
+
+
+def _output_text(content: Any) -> str:
+    if isinstance(content, list):
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content
+        )
+    return str(content)
+
+
+async def _call(tool: BaseTool, record: Dict[str, Any], args: Dict[str, Any]) -> Dict[str, Any]:
+    started = time.perf_counter()
+    try:
+        # 以 tool call 形式调用才能拿到 ToolMessage.status，区分 MCP 返回的 isError 结果
+        message = await tool.ainvoke({"type": "tool_call", "id": uuid.uuid4().hex, "name": tool.name, "args": args})
+        record["content"] = _output_text(message.content)
+        record["status"] = message.status
+        if message.status == "error":
+            record["error"] = record["content"]
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return record
+
+
+async def enrich_iocs(
+    iocs: List[str],
+    tools: List[BaseTool],
+    asset_batch_size: int = 20,
+    asset_info: bool = True,
+    reputation: bool = True,
+) -> AsyncIterator[Dict[str, Any]]:
+    """并发执行所有查询，按完成顺序逐条产出结果"""
+    by_name = {tool.name: tool for tool in tools}
+    pending: List[asyncio.Future] = []
+
+    if asset_info:
+        assets = [ioc for ioc in iocs if is_asset(ioc)]
+        tool = by_name.get(ASSET_TOOL)
+        if tool is None and assets:
+            yield {"type": "error", "message": f"MCP tool {ASSET_TOOL} 未加载"}
+        elif tool is not None:
+            size = max(1, asset_batch_size)
+            for i in range(0, len(assets), size):
+                batch = assets[i:i + size]
+                record = {"type": "asset_info", "targets": batch}
+                pending.append(asyncio.ensure_future(_call(tool, record, {"domainOrip": ",".join(batch)})))
+
+    if reputation:
+        tool = by_name.get(REPUTATION_TOOL)
+        if tool is None and iocs:
+            yield {"type": "error", "message": f"MCP tool {REPUTATION_TOOL} 未加载"}
+        elif tool is not None:
+            for ioc in iocs:
+                record = {"type": "reputation", "ioc": ioc}
+                pending.append(asyncio.ensure_future(_call(tool, record, {"ioc": ioc})))
+
+    try:
+        for next_done in asyncio.as_completed(pending):
+            yield await next_done
+    finally:
+        # 客户端断开时取消尚未完成的查询
+        for future in pending:
+            future.cancel()
+
+
+def summary_prompt(records: List[Dict[str, Any]], max_chars: int) -> str:
+    """把富化结果整理成交给 LLM 总结的文本，超出 max_chars 截断"""
+    lines = []
+    for record in records:
+        target = record.get("ioc") or ",".join(record.get("targets", []))
+        body = record.get("content") if record.get("status") == "success" else f"查询失败: {record.get('error')}"
+        lines.append(f"[{record['type']}] {target}: {body}")
+    text = "\n".join(lines)
+    if len(text) > max_chars:
+        text = text[:max_chars] + "\n...（结果过长已截断）"
+    return (
+        "以下是批量 IOC 富化的工具返回结果。请按资产归属与风险等级（高/中/低/未知）汇总，"
+        "列出高风险 IOC 及依据，仅基于结果下结论，不要编造。\n\n" + text
+    )
+
+
+def enrich_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    section = config.get("enrich") if isinstance(config.get("enrich"), dict) else {}
+    return {key: section.get(key, default) for key, default in _DEFAULTS.items()}
@@ -0,0 +1,336 @@
+"""模型响应缓存 - 相同上下文的模型调用直接返回缓存结果（默认关闭）
+
+config.json 格式:
+{
+  "response_cache": {
+    "enabled": false,
+    "backend": "memory",                # memory | sqlite
+    "path": "./.cache/llm_responses.sqlite",
+    "ttl_seconds": 3600,
+    "max_entries": 1000,
+    "bypass_tools": []                  # 在内置写操作 tool（waf_prod_op、thehive_create_ioc）之外追加
+  }
+}
+
+缓存 key = 规范化后的消息（去掉 message id / tool_call id、压缩空白）+ system prompt
++ 模型名 + tool 集合。写操作类 tool（mcp_tools.NEVER_CACHE_TOOLS 始终包含在内，bypass_tools 只能追加）：
+- 会话中已经执行过这些 tool 时不读写缓存（之后的上下文依赖外部系统的实时状态）；
+- 模型响应中调用了这些 tool 时不写入缓存（避免重放写操作）。
+只做精确匹配；命中时不会产生逐 token 的流式输出，只有完整消息。
+sqlite 后端的读写在异步路径上经 asyncio.to_thread 执行，不阻塞事件循环。
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from langchain.agents.middleware import AgentMiddleware, ModelRequest, ModelResponse
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage, messages_from_dict, messages_to_dict
+
+from mcp_tools import NEVER_CACHE_TOOLS
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def _normalize_text(content: Any) -> str:
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and block.get("type") == "text":
+                parts.append(block.get("text", ""))
+            else:
+                parts.append(json.dumps(block, sort_keys=True, ensure_ascii=False, default=str))
+        content = " ".join(parts)
+    return _WHITESPACE.sub(" ", str(content or "")).strip()
+
+
+def _normalize_message(message: BaseMessage) -> Dict[str, Any]:
+    item: Dict[str, Any] = {"type": message.type, "content": _normalize_text(message.content)}
+    if isinstance(message, AIMessage) and message.tool_calls:
+        item["tool_calls"] = [{"name": c.get("name"), "args": c.get("args")} for c in message.tool_calls]
+    if isinstance(message, ToolMessage):
+        item["name"] = message.name
+    return item
+
+
+def _tool_signature(tool: Any) -> Dict[str, Any]:
+    if isinstance(tool, dict):
+        function = tool.get("function") if isinstance(tool.get("function"), dict) else tool
+        return {"name": function.get("name"), "description": function.get("description")}
+    return {"name": getattr(tool, "name", None), "description": getattr(tool, "description", None)}
+
+
+class _MemoryStore:
+    """进程内 LRU + TTL"""
+
+    # 纯内存操作，异步路径上直接调用
+    blocking = False
+
+    def __init__(self, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            created_at, value = item
+            if self.ttl_seconds > 0 and time.time() - created_at > self.ttl_seconds:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        with self._lock:
+            self._data[key] = (time.time(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def size(self) -> int:
+        return len(self._data)
+
+
+class _SqliteStore:
+    """本地 SQLite（WAL）存储，跨重启保留；按最近访问时间淘汰"""
+
+    # 磁盘 I/O（含 commit），异步路径上放到线程中执行
+    blocking = True
+
+    def __init__(self, path: str, max_entries: int, ttl_seconds: float) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evictions = 0
+        db_path = Path(path)
+        db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.executescript(
+                """
+                PRAGMA busy_timeout=5000;
+                PRAGMA journal_mode=WAL;
+                PRAGMA synchronous=NORMAL;
+                CREATE TABLE IF NOT EXISTS responses (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at);
+                """
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds > 0 and now - created_at > self.ttl_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            return value
+
+    def set(self, key: str, value: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            if count > self.max_entries:
+                excess = count - self.max_entries
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                    (excess,),
+                )
+                self.evictions += excess
+            self._conn.commit()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class ResponseCacheMiddleware(AgentMiddleware):
+    """包裹模型调用的响应缓存"""
+
+    def __init__(self, store: Any, bypass_tools: Set[str]) -> None:
+        super().__init__()
+        self.store = store
+        self.bypass_tools = bypass_tools
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.bypassed = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _key(self, request: ModelRequest) -> Optional[str]:
+        """返回缓存 key；不可缓存的请求返回 None"""
+        if request.response_format is not None:
+            return None
+        for message in request.messages:
+            if isinstance(message, ToolMessage) and message.name in self.bypass_tools:
+                return None
+        payload = {
+            "model": getattr(request.model, "model_name", None) or getattr(request.model, "model", None),
+            "system": _normalize_text(request.system_message.content) if request.system_message else "",
+            "messages": [_normalize_message(m) for m in request.messages],
+            "tools": sorted((_tool_signature(t) for t in request.tools), key=lambda t: str(t["name"])),
+            "tool_choice": request.tool_choice,
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _lookup(self, key: str) -> Optional[ModelResponse]:
+        value = self.store.get(key)
+        if value is None:
+            return None
+        messages = messages_from_dict(json.loads(value))
+        # 每次命中都分配新的 message id / tool_call id，避免同一会话中 id 重复
+        for message in messages:
+            message.id = None
+            if isinstance(message, AIMessage):
+                for call in message.tool_calls:
+                    call["id"] = f"call_{uuid.uuid4().hex[:24]}"
+        return ModelResponse(result=messages)
+
+    def _save(self, key: str, response: Any) -> None:
+        if isinstance(response, AIMessage):
+            messages: List[BaseMessage] = [response]
+        elif isinstance(response, ModelResponse) and response.structured_response is None:
+            messages = list(response.result)
+        else:
+            return
+        for message in messages:
+            if isinstance(message, AIMessage):
+                if any(c.get("name") in self.bypass_tools for c in message.tool_calls):
+                    self._count("bypassed")
+                    return
+                if message.invalid_tool_calls:
+                    return
+        self.store.set(key, json.dumps(messages_to_dict(messages), ensure_ascii=False))
+        self._count("stores")
+
+    def wrap_model_call(self, request: ModelRequest, handler: Callable) -> Any:
+        key = self._key(request)
+        if key is None:
+            self._count("bypassed")
+            return handler(request)
+        cached = self._lookup(key)
+        if cached is not None:
+            self._count("hits")
+            return cached
+        self._count("misses")
+        response = handler(request)
+        self._save(key, response)
+        return response
+
+    async def awrap_model_call(self, request: ModelRequest, handler: Callable) -> Any:
+        key = self._key(request)
+        if key is None:
+            self._count("bypassed")
+            return await handler(request)
+        blocking = self.store.blocking
+        cached = await asyncio.to_thread(self._lookup, key) if blocking else self._lookup(key)
+        if cached is not None:
+            self._count("hits")
+            return cached
+        self._count("misses")
+        response = await handler(request)
+        if blocking:
+            await asyncio.to_thread(self._save, key, response)
+        else:
+            self._save(key, response)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": True,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "stores": self.stores,
+            "bypassed": self.bypassed,
+            "evictions": self.store.evictions,
+            "entries": self.store.size(),
+        }
+
+
+_cache: Optional[ResponseCacheMiddleware] = None
+_cache_key: Optional[str] = None
+# 配置变化后被替换的缓存：旧 Agent 可能仍在使用，等到 shutdown 再关闭
+_retired: List[ResponseCacheMiddleware] = []
+_cache_lock = threading.Lock()
+
+
+def get_response_cache(config: Optional[Dict[str, Any]] = None) -> Optional[ResponseCacheMiddleware]:
+    """返回进程级响应缓存 middleware；未启用时返回 None。同一份配置复用同一实例"""
+    global _cache, _cache_key
+    config = config or {}
+    settings = config.get("response_cache") if isinstance(config.get("response_cache"), dict) else {}
+    key = json.dumps(settings, sort_keys=True, default=str)
+    with _cache_lock:
+        if _cache_key == key:
+            return _cache
+        if _cache is not None:
+            _retired.append(_cache)
+        _cache, _cache_key = None, key
+        if settings.get("enabled"):
+            ttl = float(settings.get("ttl_seconds", 3600))
+            max_entries = int(settings.get("max_entries", 1000))
+            if str(settings.get("backend", "memory")).lower() == "sqlite":
+                store: Any = _SqliteStore(str(settings.get("path", "./.cache/llm_responses.sqlite")), max_entries, ttl)
+            else:
+                store = _MemoryStore(max_entries, ttl)
+            # 内置写操作 tool 是下限，配置只能追加
+            _cache = ResponseCacheMiddleware(store, set(NEVER_CACHE_TOOLS) | set(settings.get("bypass_tools") or []))
+        return _cache
+
+
+def response_cache_stats() -> Dict[str, Any]:
+    cache = _cache
+    return cache.stats() if cache is not None else {"enabled": False}
+
+
+def close_response_cache() -> None:
+    """关闭缓存存储（在应用 shutdown 时调用）"""
+    global _cache, _cache_key
+    with _cache_lock:
+        to_close = _retired[:] + ([_cache] if _cache is not None else [])
+        _retired.clear()
+        _cache, _cache_key = None, None
+    for cache in to_close:
+        if hasattr(cache.store, "close"):
+            cache.store.close()
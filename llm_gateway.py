@@ -0,0 +1,465 @@
+"""LLM 网关 - 多 endpoint 加权选择、按 p95 延迟发送对冲请求、熔断与重试预算（配置 model.endpoints 时生效）
+
+config.json 格式:
+{
+  "model": {
+    "endpoints": [
+      {"base_url": "https://gw-a.example.com/api/v3", "weight": 3},
+      {"base_url": "https://gw-b.example.com/api/v3", "weight": 1, "headers": {"apikey": "..."}}
+    ],
+    "gateway": {
+      "hedge": true,                  # 主请求超过对冲延迟仍未返回时，向另一个 endpoint 发送同样的请求
+      "hedge_quantile": 0.95,         # 对冲延迟 = 最近成功请求首字节延迟的分位数
+      "hedge_initial_delay": 2.0,     # 样本不足 20 个时使用的对冲延迟（秒）
+      "hedge_min_delay": 0.2,
+      "hedge_max_delay": 30,
+      "max_attempts": 3,              # 单个请求最多发往几个 endpoint（主请求 + 对冲 + 故障转移）
+      "breaker_failures": 5,          # 连续失败次数达到该值时熔断该 endpoint
+      "breaker_cooldown": 30,         # 熔断后多少秒放行一个试探请求
+      "retry_ratio": 0.2,             # 重试预算：每个请求积攒 0.2 次额外尝试的额度
+      "retry_burst": 10               # 重试预算上限（也是初始额度）
+    }
+  }
+}
+
+- ChatOpenAI 仍只配置一个 base_url（第一个 endpoint）；发往任一 endpoint base_url 的请求在 httpx transport 层
+  按权重改写到选中的 endpoint（熔断中的 endpoint 不参与选择），因此所有档位 / subagent / 总结调用都经过网关。
+- 对冲：主请求在对冲延迟（按流式 / 非流式分别统计的首字节延迟分位数）内没有响应时，向另一个 endpoint
+  发送相同请求，先响应的一方胜出，另一方立即取消（关闭连接）。流式请求以收到第一个数据块为准
+  （网关通常立即返回响应头，首 token 前的等待发生在 body 中）。只用于异步请求；同步请求只做故障转移。
+- 失败（连接错误 / 超时 / 429 / 5xx）计入熔断；没有其他尝试在进行时转移到下一个 endpoint。
+  对冲与故障转移都消耗重试预算，预算耗尽时不再发送额外请求，避免网关整体变慢时把流量放大。
+- endpoint 的 headers 覆盖请求头（不同网关使用不同凭证时）。
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+_DEFAULTS: Dict[str, Any] = {
+    "hedge": True,
+    "hedge_quantile": 0.95,
+    "hedge_initial_delay": 2.0,
+    "hedge_min_delay": 0.2,
+    "hedge_max_delay": 30,
+    "max_attempts": 3,
+    "breaker_failures": 5,
+    "breaker_cooldown": 30,
+    "retry_ratio": 0.2,
+    "retry_burst": 10,
+}
+
+# 每个 endpoint 保留的延迟样本数；少于 _MIN_SAMPLES 时使用 hedge_initial_delay
+_WINDOW = 200
+_MIN_SAMPLES = 20
+
+
+def gateway_settings(model_config: Dict[str, Any]) -> Dict[str, Any]:
+    section = model_config.get("gateway") if isinstance(model_config.get("gateway"), dict) else {}
+    return {key: section.get(key, default) for key, default in _DEFAULTS.items()}
+
+
+def normalize_base_url(base_url: str) -> str:
+    """ChatOpenAI 会在 base_url 后拼接 /chat/completions，所以 base_url 应为 https://xxx/v1 这种格式"""
+    base_url = (base_url or "").strip().rstrip("/")
+    if not base_url:
+        return base_url
+    # 去掉用户可能填写的 /chat/completions 后缀
+    if base_url.endswith("/chat/completions"):
+        base_url = base_url[:-len("/chat/completions")]
+    # 如果末尾没有 /v1，自动补上（除非设置了 LLM_KEEP_BASE_PATH=1）
+    keep_base_path = os.getenv("LLM_KEEP_BASE_PATH", "").lower() in {"1", "true", "yes"}
+    if not keep_base_path and not base_url.endswith("/v1"):
+        base_url = base_url + "/v1"
+    return base_url
+
+
+def model_endpoints(model_config: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """返回 model.endpoints 中有效的 endpoint（base_url 已规范化）"""
+    endpoints = model_config.get("endpoints")
+    if not isinstance(endpoints, list):
+        return []
+    result = []
+    for item in endpoints:
+        if isinstance(item, str):
+            item = {"base_url": item}
+        if isinstance(item, dict) and item.get("base_url") and float(item.get("weight", 1)) > 0:
+            result.append({**item, "base_url": normalize_base_url(item["base_url"])})
+    return result
+
+
+def _is_stream(body: bytes) -> bool:
+    try:
+        return bool(json.loads(body).get("stream")) if body else False
+    except (ValueError, AttributeError):
+        return False
+
+
+def _failed(status_code: int) -> bool:
+    return status_code == 429 or status_code >= 500
+
+
+class _Endpoint:
+    """单个 endpoint 的延迟样本与熔断状态（由 Gateway 的锁保护）"""
+
+    def __init__(self, spec: Dict[str, Any]) -> None:
+        self.base_url = spec["base_url"]
+        self.weight = float(spec.get("weight", 1))
+        self.headers = {str(k): str(v) for k, v in (spec.get("headers") or {}).items()}
+        # 是否流式 -> 最近的首字节延迟（秒）
+        self.latencies: Dict[bool, Deque[float]] = {False: deque(maxlen=_WINDOW), True: deque(maxlen=_WINDOW)}
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.requests = 0
+        self.failures = 0
+        self.wins = 0
+        self.cancelled = 0
+
+
+class Gateway:
+    """endpoint 选择、对冲延迟、熔断与重试预算；sync / async transport 共用"""
+
+    def __init__(self, endpoints: List[Dict[str, Any]], settings: Dict[str, Any]) -> None:
+        self.endpoints = [_Endpoint(spec) for spec in endpoints]
+        self.hedge = bool(settings["hedge"]) and len(self.endpoints) > 1
+        self.hedge_quantile = float(settings["hedge_quantile"])
+        self.hedge_initial_delay = float(settings["hedge_initial_delay"])
+        self.hedge_min_delay = float(settings["hedge_min_delay"])
+        self.hedge_max_delay = float(settings["hedge_max_delay"])
+        self.max_attempts = max(1, int(settings["max_attempts"]))
+        self.breaker_failures = max(1, int(settings["breaker_failures"]))
+        self.breaker_cooldown = float(settings["breaker_cooldown"])
+        self.retry_ratio = float(settings["retry_ratio"])
+        self.retry_burst = float(settings["retry_burst"])
+        self._budget = self.retry_burst
+        # 是否流式 -> 所有 endpoint 最近成功尝试的首字节延迟（对冲延迟按此计算）
+        self.latencies: Dict[bool, Deque[float]] = {False: deque(maxlen=_WINDOW), True: deque(maxlen=_WINDOW)}
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.budget_exhausted = 0
+
+    # ---------- 路由 ----------
+
+    def match(self, url: str) -> Optional[str]:
+        """返回 url 之后的路径部分（url 不属于任何 endpoint 时返回 None）"""
+        for endpoint in self.endpoints:
+            if url == endpoint.base_url or url.startswith(endpoint.base_url + "/") or url.startswith(endpoint.base_url + "?"):
+                return url[len(endpoint.base_url):]
+        return None
+
+    def rewrite(self, request: httpx.Request, endpoint: _Endpoint, suffix: str, body: bytes) -> httpx.Request:
+        headers = httpx.Headers(request.headers)
+        headers.update(endpoint.headers)
+        headers.pop("host", None)
+        return httpx.Request(
+            request.method,
+            endpoint.base_url + suffix,
+            headers=headers,
+            content=body,
+            # 每次尝试使用独立的 extensions（trace 回调由连接池 transport 各自包装）
+            extensions=dict(request.extensions),
+        )
+
+    def pick(self, exclude: List[_Endpoint]) -> Optional[_Endpoint]:
+        """按权重选择一个可用（未熔断）的 endpoint；全部熔断时仍选择最早熔断的那个，不整体拒绝"""
+        now = time.monotonic()
+        with self._lock:
+            candidates = [e for e in self.endpoints if e not in exclude]
+            if not candidates:
+                return None
+            available = [e for e in candidates if self._allow(e, now)]
+            if not available:
+                if exclude:
+                    return None
+                chosen = min(candidates, key=lambda e: e.opened_at)
+            else:
+                chosen = random.choices(available, weights=[e.weight for e in available])[0]
+            if chosen.state == "open":
+                # 冷却结束后的试探请求（half-open）
+                chosen.trial_in_flight = True
+            chosen.requests += 1
+            return chosen
+
+    def _allow(self, endpoint: _Endpoint, now: float) -> bool:
+        if endpoint.state == "closed":
+            return True
+        return now - endpoint.opened_at >= self.breaker_cooldown and not endpoint.trial_in_flight
+
+    # ---------- 结果 ----------
+
+    def succeeded(self, endpoint: _Endpoint, seconds: float, stream: bool, hedged: bool = False) -> None:
+        with self._lock:
+            endpoint.latencies[stream].append(seconds)
+            self.latencies[stream].append(seconds)
+            if hedged:
+                self.hedge_wins += 1
+            if endpoint.state == "open":
+                print(f"✅ LLM endpoint 恢复: {endpoint.base_url}")
+            endpoint.state = "closed"
+            endpoint.consecutive_failures = 0
+            endpoint.trial_in_flight = False
+            endpoint.wins += 1
+
+    def failed(self, endpoint: _Endpoint, reason: str) -> None:
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            trial = endpoint.trial_in_flight
+            endpoint.trial_in_flight = False
+            if trial or (endpoint.state == "closed" and endpoint.consecutive_failures >= self.breaker_failures):
+                endpoint.opened_at = time.monotonic()
+                if endpoint.state != "open":
+                    print(f"⚠️  LLM endpoint 熔断 {self.breaker_cooldown:.0f}s: {endpoint.base_url}（{reason}）")
+                endpoint.state = "open"
+
+    def cancelled(self, endpoint: _Endpoint) -> None:
+        """对冲中落败被取消；不计入延迟样本（被截断的耗时会让对冲延迟逐轮变大）"""
+        with self._lock:
+            endpoint.trial_in_flight = False
+            endpoint.cancelled += 1
+
+    # ---------- 对冲延迟与重试预算 ----------
+
+    def hedge_delay(self, stream: bool) -> float:
+        with self._lock:
+            return self._hedge_delay(stream)
+
+    def _hedge_delay(self, stream: bool) -> float:
+        samples = sorted(self.latencies[stream])
+        if len(samples) < _MIN_SAMPLES:
+            delay = self.hedge_initial_delay
+        else:
+            delay = samples[min(len(samples) - 1, int(len(samples) * self.hedge_quantile))]
+        return min(self.hedge_max_delay, max(self.hedge_min_delay, delay))
+
+    def deposit(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self._budget = min(self.retry_burst, self._budget + self.retry_ratio)
+
+    def withdraw(self, kind: str) -> bool:
+        """为一次对冲 / 故障转移扣除预算，预算不足时返回 False"""
+        with self._lock:
+            if self._budget < 1:
+                self.budget_exhausted += 1
+                return False
+            self._budget -= 1
+            if kind == "hedge":
+                self.hedges += 1
+            else:
+                self.failovers += 1
+            return True
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            endpoints = []
+            for e in self.endpoints:
+                item: Dict[str, Any] = {
+                    "base_url": e.base_url,
+                    "weight": e.weight,
+                    "state": e.state,
+                    "requests": e.requests,
+                    "wins": e.wins,
+                    "failures": e.failures,
+                    "cancelled": e.cancelled,
+                }
+                for stream, samples in e.latencies.items():
+                    ordered = sorted(samples)
+                    if ordered:
+                        prefix = "stream" if stream else "invoke"
+                        item[f"{prefix}_p50_ms"] = round(ordered[len(ordered) // 2] * 1000, 1)
+                        item[f"{prefix}_p95_ms"] = round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1)
+                endpoints.append(item)
+            return {
+                "enabled": True,
+                "hedge": self.hedge,
+                "hedge_delay_ms": {"invoke": round(self._hedge_delay(False) * 1000, 1), "stream": round(self._hedge_delay(True) * 1000, 1)},
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "failovers": self.failovers,
+                "budget_exhausted": self.budget_exhausted,
+                "retry_budget": round(self._budget, 2),
+                "endpoints": endpoints,
+            }
+
+
+class _PrefetchedStream(httpx.AsyncByteStream):
+    """已读出第一个数据块的流式响应 body"""
+
+    def __init__(self, first: bytes, iterator: Any, stream: Any) -> None:
+        self._first = first
+        self._iterator = iterator
+        self._stream = stream
+
+    async def __aiter__(self):
+        if self._first:
+            yield self._first
+        async for chunk in self._iterator:
+            yield chunk
+
+    async def aclose(self) -> None:
+        await self._stream.aclose()
+
+
+async def _attempt(transport: httpx.AsyncBaseTransport, request: httpx.Request, stream: bool) -> httpx.Response:
+    response = await transport.handle_async_request(request)
+    if not stream or _failed(response.status_code):
+        return response
+    iterator = response.stream.__aiter__()
+    try:
+        first = await iterator.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except BaseException:
+        await response.aclose()
+        raise
+    return httpx.Response(
+        response.status_code,
+        headers=response.headers,
+        stream=_PrefetchedStream(first, iterator, response.stream),
+        extensions=response.extensions,
+    )
+
+
+def _discard(task: "asyncio.Future[Any]") -> None:
+    """落败的尝试在取消前已拿到响应时关闭它，归还连接"""
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(task.result().aclose())
+
+
+async def send_async(gateway: Gateway, transport: httpx.AsyncBaseTransport, request: httpx.Request) -> httpx.Response:
+    suffix = gateway.match(str(request.url))
+    if suffix is None:
+        return await transport.handle_async_request(request)
+    body = await request.aread()
+    stream = _is_stream(body)
+    gateway.deposit()
+    tried: List[_Endpoint] = []
+    hedged: Optional[_Endpoint] = None
+    pending: Dict["asyncio.Future[Any]", Tuple[_Endpoint, float]] = {}
+    failed_response: Optional[httpx.Response] = None
+    last_error: Optional[BaseException] = None
+
+    def launch(endpoint: _Endpoint) -> None:
+        tried.append(endpoint)
+        task = asyncio.ensure_future(_attempt(transport, gateway.rewrite(request, endpoint, suffix, body), stream))
+        pending[task] = (endpoint, time.perf_counter())
+
+    launch(gateway.pick([]))
+    hedge_at = time.perf_counter() + gateway.hedge_delay(stream) if gateway.hedge else None
+    try:
+        while pending:
+            timeout = max(0.0, hedge_at - time.perf_counter()) if hedge_at is not None else None
+            done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                # 对冲：主请求超过对冲延迟仍没有响应头
+                hedge_at = None
+                if len(tried) < gateway.max_attempts:
+                    endpoint = gateway.pick(tried)
+                    if endpoint is not None and gateway.withdraw("hedge"):
+                        launch(endpoint)
+                        hedged = endpoint
+                continue
+            for task in done:
+                endpoint, started = pending.pop(task)
+                error = task.exception()
+                if error is None and not _failed(task.result().status_code):
+                    gateway.succeeded(endpoint, time.perf_counter() - started, stream, hedged=endpoint is hedged)
+                    if failed_response is not None:
+                        await failed_response.aclose()
+                    return task.result()
+                if error is None:
+                    response = task.result()
+                    gateway.failed(endpoint, f"HTTP {response.status_code}")
+                    if failed_response is not None:
+                        await failed_response.aclose()
+                    # 没有成功的尝试时把最后一个失败响应交给 SDK（由其决定是否重试 / 报错）
+                    failed_response = response
+                else:
+                    gateway.failed(endpoint, type(error).__name__)
+                    last_error = error
+            if not pending and len(tried) < gateway.max_attempts:
+                endpoint = gateway.pick(tried)
+                if endpoint is not None and gateway.withdraw("failover"):
+                    launch(endpoint)
+                    hedge_at = None
+    finally:
+        for task, (endpoint, _) in pending.items():
+            task.cancel()
+            task.add_done_callback(_discard)
+            gateway.cancelled(endpoint)
+    if failed_response is not None:
+        return failed_response
+    assert last_error is not None
+    raise last_error
+
+
+def send_sync(gateway: Gateway, transport: httpx.BaseTransport, request: httpx.Request) -> httpx.Response:
+    """同步请求：按权重选择 endpoint，失败时在重试预算内转移到下一个（不对冲）"""
+    suffix = gateway.match(str(request.url))
+    if suffix is None:
+        return transport.handle_request(request)
+    body = request.read()
+    stream = _is_stream(body)
+    gateway.deposit()
+    tried: List[_Endpoint] = []
+    endpoint: Optional[_Endpoint] = gateway.pick([])
+    while True:
+        assert endpoint is not None
+        tried.append(endpoint)
+        started = time.perf_counter()
+        try:
+            response = transport.handle_request(gateway.rewrite(request, endpoint, suffix, body))
+        except httpx.TransportError as e:
+            gateway.failed(endpoint, type(e).__name__)
+            response, error = None, e
+        else:
+            if not _failed(response.status_code):
+                gateway.succeeded(endpoint, time.perf_counter() - started, stream)
+                return response
+            gateway.failed(endpoint, f"HTTP {response.status_code}")
+            error = None
+        endpoint = gateway.pick(tried) if len(tried) < gateway.max_attempts else None
+        if endpoint is None or not gateway.withdraw("failover"):
+            if response is not None:
+                return response
+            raise error
+        if response is not None:
+            response.close()
+
+
+class GatewayTransport(httpx.BaseTransport):
+    def __init__(self, gateway: Gateway, transport: httpx.BaseTransport) -> None:
+        self.gateway = gateway
+        self.transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        return send_sync(self.gateway, self.transport, request)
+
+    def close(self) -> None:
+        self.transport.close()
+
+
+class AsyncGatewayTransport(httpx.AsyncBaseTransport):
+    def __init__(self, gateway: Gateway, transport: httpx.AsyncBaseTransport) -> None:
+        self.gateway = gateway
+        self.transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await send_async(self.gateway, self.transport, request)
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
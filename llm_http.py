@@ -0,0 +1,250 @@
+"""LLM HTTP 连接池 - 进程内共享的 httpx 客户端
+
+config.json 格式:
+{
+  "model": {
+    "http": {
+      "max_connections": 100,           # 连接池总上限
+      "max_keepalive_connections": 20,  # 保持空闲的长连接数
+      "keepalive_expiry": 30,           # 空闲连接保留秒数
+      "http2": false,                   # 需要 h2 包（pip install httpx[http2]）
+      "connect_timeout": 10,
+      "read_timeout": 600,
+      "write_timeout": 30,
+      "pool_timeout": 30                # 等待空闲连接的最长秒数
+    }
+  }
+}
+
+所有 Agent 重建共用同一组客户端，TCP/TLS 连接跨请求复用；配置变化时才创建新客户端。
+配置了 model.endpoints 时，客户端的 transport 外再包一层 LLM 网关（多 endpoint / 对冲 / 熔断，见 llm_gateway.py）。
+"""
+
+import json
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+
+from llm_gateway import AsyncGatewayTransport, Gateway, GatewayTransport, gateway_settings, model_endpoints
+
+try:
+    import h2  # noqa: F401
+    _HTTP2_AVAILABLE = True
+except ImportError:
+    _HTTP2_AVAILABLE = False
+
+
+class PoolStats:
+    """连接池等待时间统计（从发起请求到拿到连接开始发送的耗时）"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.in_flight = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.new_connections = 0
+
+    def begin(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+
+    def end(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def record_wait(self, seconds: float, new_connection: bool) -> None:
+        with self._lock:
+            self.total_wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+            if new_connection:
+                self.new_connections += 1
+
+
+def _wait_marker(stats: PoolStats, started: float):
+    """httpcore trace 事件处理：首次出现建连或发送请求头事件时即已拿到连接"""
+    marked = False
+
+    def _mark(name: str) -> None:
+        nonlocal marked
+        if marked:
+            return
+        connecting = name.startswith("connection.connect_tcp")
+        if connecting or name.endswith("send_request_headers.started"):
+            marked = True
+            stats.record_wait(time.perf_counter() - started, connecting)
+
+    return _mark
+
+
+class _InstrumentedTransport(httpx.HTTPTransport):
+    def __init__(self, stats: PoolStats, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._stats = stats
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        mark = _wait_marker(self._stats, time.perf_counter())
+        previous = request.extensions.get("trace")
+
+        def trace(name: str, info: Dict[str, Any]) -> None:
+            mark(name)
+            if previous is not None:
+                previous(name, info)
+
+        request.extensions["trace"] = trace
+        self._stats.begin()
+        try:
+            return super().handle_request(request)
+        finally:
+            self._stats.end()
+
+
+class _InstrumentedAsyncTransport(httpx.AsyncHTTPTransport):
+    def __init__(self, stats: PoolStats, **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        mark = _wait_marker(self._stats, time.perf_counter())
+        previous = request.extensions.get("trace")
+
+        async def trace(name: str, info: Dict[str, Any]) -> None:
+            mark(name)
+            if previous is not None:
+                await previous(name, info)
+
+        request.extensions["trace"] = trace
+        self._stats.begin()
+        try:
+            return await super().handle_async_request(request)
+        finally:
+            self._stats.end()
+
+
+def _pool_snapshot(transport: Any) -> Dict[str, int]:
+    """读取 httpcore 连接池的连接状态（属性缺失时返回 0，兼容不同版本）"""
+    pool = getattr(transport, "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for c in connections if c.is_idle())
+    closed = sum(1 for c in connections if c.is_closed())
+    pending = [r for r in (getattr(pool, "_requests", []) or []) if getattr(r, "connection", None) is None]
+    return {
+        "connections": len(connections) - closed,
+        "in_use": len(connections) - idle - closed,
+        "idle": idle,
+        "waiting": len(pending),
+    }
+
+
+class LLMHttpClients:
+    """一组共享的 sync/async httpx 客户端及其统计"""
+
+    def __init__(self, settings: Dict[str, Any], endpoints: Optional[List[Dict[str, Any]]] = None, gateway: Optional[Dict[str, Any]] = None) -> None:
+        self.settings = settings
+        http2 = bool(settings.get("http2", False))
+        if http2 and not _HTTP2_AVAILABLE:
+            print("⚠️  model.http.http2 已开启但未安装 h2，回退到 HTTP/1.1（pip install httpx[http2]）")
+            http2 = False
+        self.http2 = http2
+
+        limits = httpx.Limits(
+            max_connections=int(settings.get("max_connections", 100)),
+            max_keepalive_connections=int(settings.get("max_keepalive_connections", 20)),
+            keepalive_expiry=float(settings.get("keepalive_expiry", 30)),
+        )
+        timeout = httpx.Timeout(
+            connect=float(settings.get("connect_timeout", 10)),
+            read=float(settings.get("read_timeout", 600)),
+            write=float(settings.get("write_timeout", 30)),
+            pool=float(settings.get("pool_timeout", 30)),
+        )
+        self.sync_stats = PoolStats()
+        self.async_stats = PoolStats()
+        # 公司环境：网关证书不受信任，沿用原有的 verify=False
+        self._sync_transport = _InstrumentedTransport(self.sync_stats, verify=False, http2=http2, limits=limits)
+        self._async_transport = _InstrumentedAsyncTransport(self.async_stats, verify=False, http2=http2, limits=limits)
+        self.gateway: Optional[Gateway] = None
+        sync_transport: httpx.BaseTransport = self._sync_transport
+        async_transport: httpx.AsyncBaseTransport = self._async_transport
+        if endpoints:
+            self.gateway = Gateway(endpoints, gateway or {})
+            sync_transport = GatewayTransport(self.gateway, sync_transport)
+            async_transport = AsyncGatewayTransport(self.gateway, async_transport)
+            print(f"🌐 LLM 网关: {len(endpoints)} 个 endpoint（对冲{'开启' if self.gateway.hedge else '关闭'}）")
+        self.client = httpx.Client(transport=sync_transport, timeout=timeout)
+        self.async_client = httpx.AsyncClient(transport=async_transport, timeout=timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        result: Dict[str, Any] = {"http2": self.http2, "limits": self.settings}
+        for name, stats, transport in (
+            ("sync", self.sync_stats, self._sync_transport),
+            ("async", self.async_stats, self._async_transport),
+        ):
+            result[name] = {
+                **_pool_snapshot(transport),
+                "requests": stats.requests,
+                "in_flight": stats.in_flight,
+                "new_connections": stats.new_connections,
+                "avg_wait_ms": stats.total_wait_seconds / stats.requests * 1000 if stats.requests else 0.0,
+                "max_wait_ms": stats.max_wait_seconds * 1000,
+            }
+        return result
+
+    async def aclose(self) -> None:
+        self.client.close()
+        await self.async_client.aclose()
+
+
+_clients: Optional[LLMHttpClients] = None
+_clients_key: Optional[str] = None
+# 配置变化后被替换的客户端：旧 Agent 可能仍在处理请求，等到 shutdown 再关闭
+_retired: List[LLMHttpClients] = []
+_clients_lock = threading.Lock()
+
+
+def get_llm_http_clients(model_config: Optional[Dict[str, Any]] = None) -> Tuple[httpx.Client, httpx.AsyncClient]:
+    """返回进程级共享的 (httpx.Client, httpx.AsyncClient)"""
+    global _clients, _clients_key
+    model_config = model_config or {}
+    settings = model_config.get("http") if isinstance(model_config.get("http"), dict) else {}
+    endpoints = model_endpoints(model_config)
+    gateway = gateway_settings(model_config) if endpoints else {}
+    key = json.dumps([settings, endpoints, gateway], sort_keys=True, default=str)
+    with _clients_lock:
+        if _clients is None or _clients_key != key:
+            if _clients is not None:
+                _retired.append(_clients)
+            _clients = LLMHttpClients(settings, endpoints, gateway)
+            _clients_key = key
+        return _clients.client, _clients.async_client
+
+
+def llm_gateway_stats() -> Dict[str, Any]:
+    clients = _clients
+    if clients is None or clients.gateway is None:
+        return {"enabled": False}
+    return clients.gateway.stats()
+
+
+def llm_pool_stats() -> Dict[str, Any]:
+    clients = _clients
+    if clients is None:
+        return {"ready": False}
+    return {"ready": True, **clients.stats()}
+
+
+async def close_llm_http_clients() -> None:
+    """关闭所有 LLM HTTP 客户端（在应用 shutdown 时调用）"""
+    global _clients, _clients_key
+    with _clients_lock:
+        to_close = _retired[:] + ([_clients] if _clients is not None else [])
+        _retired.clear()
+        _clients, _clients_key = None, None
+    for clients in to_close:
+        try:
+            await clients.aclose()
+        except Exception as e:
+            print(f"⚠️  LLM HTTP 客户端关闭失败: {type(e).__name__}: {e}")
@@ -18,24 +18,63 @@ except Exception:
     pass
 
 # ============ 正常导入 ============
+import asyncio
 import json
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
 from pathlib import Path
 from typing import Any, Dict, List, Optional
 
-import httpx
 import urllib3
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-from fastapi import FastAPI
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
 from langchain.chat_models import init_chat_model
 from langchain_openai import ChatOpenAI
 from langchain.agents.structured_output import AutoStrategy, ProviderStrategy, ToolStrategy
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
 from deepagents import create_deep_agent
 from deepagents.backends import CompositeBackend, FilesystemBackend, StateBackend
 
-from mcp_tools import load_mcp_tools
+from admission import AdmissionController, AdmissionRejected, AdmissionSlot
+from checkpointer import close_checkpointer, get_checkpointer
+from config_service import (
+    ConfigError,
+    ConfigSource,
+    ConfigWatcher,
+    apply_env,
+    config_path,
+    fingerprint_of,
+    parse_config,
+    reload_settings,
+)
+from context_window import build_context_middleware
+from enrich import enrich_iocs, enrich_settings, normalize_iocs, summary_prompt
+from llm_cache import close_response_cache, get_response_cache, response_cache_stats
+from llm_gateway import model_endpoints, normalize_base_url
+from llm_http import close_llm_http_clients, get_llm_http_clients, llm_gateway_stats, llm_pool_stats
+from mcp_tools import close_mcp_connections, get_connection_manager, load_mcp_tools
+from memory_namespaces import NamespacedMemoryMiddleware, build_namespaced_memory, namespaced_memory_stats
+from memory_store import MemoryBackend, get_memory_store, memory_store_stats
+from model_routing import build_model_routing, model_routing_stats, routing_settings, tier_configs
+from relevance import RelevanceFilterMiddleware, build_relevance_filter, relevance_stats
+from result_files import build_result_spill
+from skills_index import IndexedSkillsMiddleware, get_skills_index, skills_index_stats
+from tracing import (
+    SSE_FLUSH_SECONDS,
+    MetricsMiddleware,
+    TracingCallbackHandler,
+    configure_tracing,
+    render_metrics,
+    span,
+    start_span,
+    use_span,
+)
 
 
 class Message(BaseModel):
@@ -45,40 +84,28 @@ class Message(BaseModel):
 
 class ChatRequest(BaseModel):
     messages: List[Message]
-    thread_id: Optional[str] = Field(default="default")
-
-
-app = FastAPI(title="deepagents-minimal", version="0.1.0")
-
-
-def _load_config() -> Dict[str, Any]:
-    config_path = os.getenv("DEEPAGENTS_CONFIG", "./config.json")
-    path = Path(config_path)
-    if not path.exists():
-        return {}
-
-    try:
-        data = json.loads(path.read_text(encoding="utf-8"))
-        return data if isinstance(data, dict) else {}
-    except Exception:
-        return {}
-
-
-def _apply_env_from_config(config: Dict[str, Any]) -> None:
-    env = config.get("env")
-    if not isinstance(env, dict):
-        return
-
-    for key, value in env.items():
-        if key and value is not None and key not in os.environ:
-            os.environ[str(key)] = str(value)
-
-
-def build_agent():
-    config = _load_config()
-    _apply_env_from_config(config)
-
-    model_config = config.get("model", {})
+    # 不传时由服务端生成并在响应中返回；后续请求携带同一 thread_id 即可只发送新消息
+    thread_id: Optional[str] = Field(default=None)
+    # 记忆命名空间（memory_namespaces.enabled 时生效）：/memories/user/ 与 /memories/team/ 按此隔离
+    user_id: Optional[str] = Field(default=None, max_length=64)
+    tenant_id: Optional[str] = Field(default=None, max_length=64)
+
+
+class EnrichRequest(BaseModel):
+    iocs: List[str]
+    asset_info: bool = True
+    reputation: bool = True
+    # 全部结果返回后再调用 LLM 生成一段总结
+    summary: bool = False
+    # 准入控制按用户限速与公平排队；不传时按客户端 IP 区分
+    user_id: Optional[str] = Field(default=None, max_length=64)
+    tenant_id: Optional[str] = Field(default=None, max_length=64)
+
+
+def build_model(config: Dict[str, Any], model_config: Optional[Dict[str, Any]] = None):
+    """按 config.model（或多模型路由中某个档位的配置）创建 chat model（调用前需已执行 apply_env）"""
+    if model_config is None:
+        model_config = config.get("model", {})
     model_name = os.getenv("DEEPAGENTS_MODEL", "gpt-5")
     model_name = model_config.get("name", model_name)
     
@@ -86,22 +113,13 @@ def build_agent():
     if model_name.startswith("openai:"):
         model_name = model_name.split(":", 1)[1]
     
-    api_key = os.environ.get("OPENAI_API_KEY", "")
-    base_url = os.environ.get("OPENAI_BASE_URL", "").strip().rstrip("/")
+    # 档位可单独指定 endpoint，未指定时使用 model.endpoints 的第一个（其余由 LLM 网关在 transport 层分流），最后是环境变量
+    endpoints = model_endpoints(model_config)
+    api_key = model_config.get("api_key") or os.environ.get("OPENAI_API_KEY", "")
+    base_url = model_config.get("base_url") or (endpoints[0]["base_url"] if endpoints else os.environ.get("OPENAI_BASE_URL", ""))
     
     # URL 规范化：ChatOpenAI 会自动在 base_url 后面拼接 /chat/completions
-    # 所以 base_url 应该是 https://xxx/v1 这种格式
-    if base_url:
-        # 去掉用户可能填写的 /chat/completions 后缀
-        if base_url.endswith("/v1/chat/completions"):
-            base_url = base_url[:-len("/chat/completions")]
-        elif base_url.endswith("/chat/completions"):
-            base_url = base_url[:-len("/chat/completions")]
-        
-        # 如果末尾没有 /v1，自动补上（除非设置了 LLM_KEEP_BASE_PATH=1）
-        keep_base_path = os.getenv("LLM_KEEP_BASE_PATH", "").lower() in {"1", "true", "yes"}
-        if not keep_base_path and not base_url.endswith("/v1"):
-            base_url = base_url + "/v1"
+    base_url = normalize_base_url(base_url)
     
     # 公司环境适配：只要配置了 OPENAI_BASE_URL，就使用自定义 ChatOpenAI（跳过 SSL 验证）
     if base_url:
@@ -115,9 +133,8 @@ def build_agent():
         if accesscode:
             default_headers["Authorization"] = accesscode
         
-        # 创建禁用 SSL 的 httpx 客户端
-        http_client = httpx.Client(verify=False)
-        http_async_client = httpx.AsyncClient(verify=False)
+        # 进程内共享的 httpx 客户端（禁用 SSL 验证，连接池参数见 model.http，多 endpoint 见 model.endpoints）
+        http_client, http_async_client = get_llm_http_clients(model_config)
         
         model = ChatOpenAI(
             model=model_name,
@@ -130,6 +147,18 @@ def build_agent():
     else:
         # 标准 OpenAI 或其他 provider 使用 init_chat_model
         model = init_chat_model(model=f"openai:{model_name}")
+    return model
+
+
+def build_agent(config: Optional[Dict[str, Any]] = None):
+    if config is None:
+        config = parse_config(config_path().read_text(encoding="utf-8")) if config_path().exists() else {}
+    apply_env(config)
+    configure_tracing(config)
+
+    # 多模型路由（opt-in）：主 Agent 每步先走 router 档，最终答案走 final 档；subagent 与默认模型用 worker 档
+    model_routing = build_model_routing(config, build_model)
+    model = model_routing.tiers.worker if model_routing is not None else build_model(config)
 
     skills_dir = os.getenv("DEEPAGENTS_SKILLS_DIR", "./skills")
     skills_dir = config.get("skills_dir", skills_dir)
@@ -143,23 +172,41 @@ def build_agent():
         
     skills_route = {}
     skills = None
+    skills_index = None
     
     if skills_path.is_dir():
-        skills = ["/skills/"]
+        # skills 索引（默认开启）：只解析 frontmatter 并按 mtime 增量更新；关闭时由 deepagents 每个会话扫描一次
+        skills_index = get_skills_index(skills_path, config)
+        if skills_index is None:
+            skills = ["/skills/"]
         # Enable virtual_mode=True to handle path resolution correctly (treating input paths as relative to root_dir)
         skills_route = {"/skills/": FilesystemBackend(root_dir=str(skills_path), virtual_mode=True)}
     else:
         print(f"Warning: Skills directory not found at {skills_path}")
 
-    mcp_tools = load_mcp_tools(config=config)
+    with span("mcp.load_tools"):
+        mcp_tools = load_mcp_tools(config=config)
 
     memories_dir = os.getenv("DEEPAGENTS_MEMORIES_DIR", "./memories")
     memories_dir = config.get("memories_dir", memories_dir)
     os.makedirs(memories_dir, exist_ok=True)
+    # 记忆文件读写：文件锁 + 原子替换 + mtime 失效的读缓存（跨 worker 安全）
+    memory_store = get_memory_store(config)
+    # 按租户 / 用户隔离的记忆（opt-in）：/memories/user/、/memories/team/ 路由 + 检索注入
+    namespaced_memory = build_namespaced_memory(config, memory_store, memories_dir)
     
+    # 大 tool 结果落盘（opt-in）：/results/ 路由 + 逐行写入的 middleware
+    result_spill = build_result_spill(config)
+
     def create_backend(rt):
-        routes = {"/memories/": FilesystemBackend(root_dir=memories_dir, virtual_mode=True)}
+        configurable = (getattr(rt, "config", None) or {}).get("configurable") or {}
+        routes = {"/memories/": MemoryBackend(root_dir=memories_dir, store=memory_store)}
         routes.update(skills_route)
+        # 按请求的 thread_id / user_id 选择目录：会话之间、用户之间互不可见
+        if result_spill is not None:
+            routes.update(result_spill.routes_for(configurable))
+        if namespaced_memory is not None:
+            routes.update(namespaced_memory.routes_for(configurable))
         return CompositeBackend(
             default=StateBackend(rt),
             routes=routes,
@@ -168,6 +215,9 @@ def build_agent():
     memory_files = config.get("memory_files")
     if not isinstance(memory_files, list):
         memory_files = ["/memories/AGENTS.md"]
+    if namespaced_memory is not None and namespaced_memory.global_dir is not None:
+        # include_global：全局记忆同样按片段检索注入，不再全文注入
+        memory_files = []
 
     response_format = None
     rf = config.get("response_format") if isinstance(config.get("response_format"), dict) else None
@@ -188,10 +238,33 @@ def build_agent():
 
     default_react_prompt = """Use ReAct-style reasoning for tool use. Internally follow Thought -> Action -> Observation.
 Return only the final answer to the user and do not reveal hidden reasoning. If a tool is needed, call it.
+When several tool calls do not depend on each other (e.g. one lookup per IOC), request them together in one turn so they run in parallel.
 """.strip()
     react_prompt = os.getenv("DEEPAGENTS_REACT_PROMPT", default_react_prompt)
     react_prompt = config.get("react_prompt", react_prompt)
 
+    # 上下文管理（opt-in）：大 tool 输出转存 + 超出 token 预算时摘要早期对话
+    summarizer = model_routing.tiers.summarizer if model_routing is not None else model
+    middleware = build_context_middleware(config, summarizer, create_backend)
+    # 相关性预筛（opt-in）：按用户消息只列出 top-k skills、只绑定 top-k MCP tools
+    relevance = build_relevance_filter(config, mcp_tools or [], skills=skills_index.skills if skills_index else None)
+    if relevance is not None:
+        middleware.insert(0, RelevanceFilterMiddleware(relevance))
+    if skills_index is not None:
+        middleware.insert(0, IndexedSkillsMiddleware(skills_index, selector=relevance.select_skills if relevance else None))
+    if namespaced_memory is not None:
+        middleware.append(NamespacedMemoryMiddleware(namespaced_memory))
+    # 路由在记忆注入之内：router 出错回退到 final 档时不重复检索
+    if model_routing is not None:
+        middleware.append(model_routing)
+    # 落盘在转存之内层：超大结果先写入 /results/，转存只处理剩余的中等输出
+    if result_spill is not None:
+        middleware.append(result_spill)
+    # 响应缓存（opt-in）：放在 middleware 最内层，key 包含 skills/memory 注入后的完整 system prompt
+    response_cache = get_response_cache(config)
+    if response_cache is not None:
+        middleware.append(response_cache)
+
     return create_deep_agent(
         model=model,
         skills=skills,
@@ -200,52 +273,562 @@ Return only the final answer to the user and do not reveal hidden reasoning. If
         memory=memory_files,
         response_format=response_format,
         system_prompt=react_prompt,
+        middleware=middleware,
+        checkpointer=get_checkpointer(config),
     )
 
 
+class AgentRegistry:
+    """
+    进程级 Agent：启动时构建一次；config.json 变化（由后台 ConfigWatcher 检测）或外部依赖过期时
+    在后台线程重建，构建成功后连同对应的配置一次性替换。
+
+    请求路径只读取内存中的 (Agent, 配置) 快照，不做文件 I/O；进行中的请求（包括 SSE 流）继续使用
+    开始时拿到的 Agent，旧 Agent 在最后一个引用释放后回收。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.source = ConfigSource()
+        # (agent, config)：单次赋值完成替换，请求读到的 Agent 与配置总是配套的
+        self._current: Optional[tuple] = None
+        # 外部依赖（如 MCP tool schema）变化时置位，由 watcher 线程触发重建
+        self._stale = False
+        self.watcher = ConfigWatcher(self.refresh, lambda: reload_settings(self.config)["interval"])
+        self.hits = 0
+        self.builds = 0
+        self.reloads = 0
+        self.last_build_seconds: Optional[float] = None
+        self.last_build_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def config(self) -> Dict[str, Any]:
+        """构建当前 Agent 所用的配置"""
+        current = self._current
+        return current[1] if current is not None else {}
+
+    def current(self) -> Optional[tuple]:
+        """当前 (Agent, 配置) 快照；尚未构建时返回 None"""
+        current = self._current
+        if current is not None:
+            self.hits += 1
+        return current
+
+    def get(self):
+        """返回当前 Agent；尚未构建（如启动时构建失败）时在调用线程中同步构建"""
+        current = self.current()
+        if current is not None:
+            return current[0]
+        with self._lock:
+            if self._current is None:
+                self._reload(read_file=True, rebuild=True)
+            return self._current[0]
+
+    def invalidate(self) -> None:
+        """标记当前 Agent 过期；不加锁，可在任意线程（包括 MCP 事件循环）中调用"""
+        self._stale = True
+        self.watcher.trigger()
+
+    def refresh(self) -> bool:
+        """watcher 线程定期调用：配置文件变化（watch 开启时）或 Agent 过期时重建"""
+        watch = bool(reload_settings(self.config)["watch"])
+        changed = watch and self.source.changed()
+        if not changed and not self._stale:
+            return False
+        with self._lock:
+            return self._reload(read_file=changed, rebuild=False)
+
+    def reload(self, rebuild: bool = False) -> bool:
+        """立即重新读取 config.json；内容未变化且 rebuild 为 False 时不重建。返回是否替换了 Agent"""
+        with self._lock:
+            return self._reload(read_file=True, rebuild=rebuild)
+
+    def rebuild(self):
+        """强制重建（忽略缓存）"""
+        self.reload(rebuild=True)
+        return self._current[0]
+
+    def _reload(self, read_file: bool, rebuild: bool) -> bool:
+        config, changed = self.source.config, False
+        if read_file:
+            try:
+                config, changed = self.source.load()
+            except ConfigError as e:
+                if self._current is None:
+                    raise
+                # 配置写错时保留当前版本；依赖过期仍按当前配置重建
+                print(f"❌ 配置无效，继续使用当前版本: {e}")
+                config = self.config
+        if self._current is not None and not (changed or rebuild or self._stale):
+            return False
+        return self._build(config)
+
+    def _build(self, config: Dict[str, Any]) -> bool:
+        started = time.perf_counter()
+        # 先清除标记：构建期间再次发生的变化会重新置位
+        self._stale = False
+        try:
+            with span("agent.build"):
+                agent = build_agent(config)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            # 重建失败时继续使用旧 Agent，避免配置写错导致服务不可用
+            if self._current is not None:
+                print(f"❌ Agent 重建失败，继续使用旧版本: {self.last_error}")
+                return False
+            raise
+
+        elapsed = time.perf_counter() - started
+        replaced = self._current is not None
+        self._current = (agent, config)
+        self.builds += 1
+        self.reloads += int(replaced)
+        self.last_build_seconds = elapsed
+        self.last_build_at = time.time()
+        self.last_error = None
+        if replaced:
+            print(f"🔄 Agent 已按新配置重建并替换，用时 {elapsed:.3f}s（第 {self.builds} 次）")
+        else:
+            print(f"🤖 Agent 构建完成，用时 {elapsed:.3f}s（第 {self.builds} 次）")
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        settings = reload_settings(self.config)
+        return {
+            "ready": self._current is not None,
+            "hits": self.hits,
+            "builds": self.builds,
+            "reloads": self.reloads,
+            "last_build_seconds": self.last_build_seconds,
+            "last_build_at": self.last_build_at,
+            "stale": self._stale,
+            "config_fingerprint": fingerprint_of(self.config) if self._current is not None else None,
+            "last_error": self.last_error,
+            "config": {
+                **self.source.stats(),
+                "watch": settings["watch"],
+                "interval": settings["interval"],
+                "watcher_running": self.watcher.running,
+            },
+        }
+
+
+agent_registry = AgentRegistry()
+# MCP server 的 tool schema 变化后（如从磁盘缓存启动后刷新到新版本），重建 Agent
+get_connection_manager().add_tools_listener(agent_registry.invalidate)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # MCP 常驻连接运行在独立线程的事件循环中；构建过程会同步等待连接，放到工作线程执行
+    get_connection_manager().start()
+    try:
+        await asyncio.to_thread(agent_registry.get)
+    except Exception as e:
+        print(f"❌ 启动时 Agent 构建失败，将在首个请求时重试: {type(e).__name__}: {e}")
+    # 后台监视 config.json：变化后重建并替换 Agent，请求路径不再读取配置文件
+    agent_registry.watcher.start()
+    yield
+    await asyncio.to_thread(agent_registry.watcher.stop)
+    await asyncio.to_thread(close_mcp_connections)
+    await asyncio.to_thread(close_checkpointer)
+    close_response_cache()
+    await close_llm_http_clients()
+
+
+app = FastAPI(title="deepagents-minimal", version="0.1.0", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)
+
+
+_ROLE_OF_TYPE = {"human": "user", "ai": "assistant", "system": "system"}
+
+
+def _transcript(messages: List[Any]) -> List[tuple]:
+    """会话中对用户可见的部分 (role, content)，忽略 tool 调用过程"""
+    transcript = []
+    for message in messages:
+        role = _ROLE_OF_TYPE.get(getattr(message, "type", None))
+        if role is None or getattr(message, "tool_calls", None):
+            continue
+        content = message.content if isinstance(message.content, str) else str(message.content)
+        if content:
+            transcript.append((role, content))
+    return transcript
+
+
+def _new_messages(stored: List[Any], messages: List[Message]) -> List[Dict[str, Any]]:
+    """
+    thread 已有 checkpoint 时只提交新增消息。
+
+    兼容仍然重发完整历史的客户端：请求消息以已保存的对话为前缀时去掉该前缀，
+    否则视为全部是新消息。
+    """
+    incoming = [m.model_dump() for m in messages]
+    history = _transcript(stored)
+    if history and len(incoming) > len(history):
+        if [(m["role"], m["content"]) for m in incoming[:len(history)]] == history:
+            return incoming[len(history):]
+    return incoming
+
+
+_tracing_callbacks = TracingCallbackHandler(server_of=get_connection_manager().server_of)
+
+
+def _run_config(thread_id: str, req: Optional[ChatRequest] = None) -> Dict[str, Any]:
+    configurable = {"thread_id": thread_id}
+    if req is not None:
+        configurable.update({k: v for k, v in (("user_id", req.user_id), ("tenant_id", req.tenant_id)) if v})
+    return {"configurable": configurable, "callbacks": [_tracing_callbacks]}
+
+
+admission = AdmissionController()
+
+
+async def _current_agent() -> tuple:
+    """当前 (Agent, 配置) 快照；尚未构建时在工作线程中同步构建"""
+    current = agent_registry.current()
+    if current is None:
+        await asyncio.to_thread(agent_registry.get)
+        current = agent_registry.current()
+    return current
+
+
+def _user_of(req: Any, request: Request) -> str:
+    """准入控制中的用户标识：优先取请求体的 user_id，否则按客户端 IP"""
+    if req.user_id:
+        return req.user_id
+    return f"ip:{request.client.host}" if request.client else "anonymous"
+
+
+async def _admit(user: str, cost: float = 1.0, config: Optional[Dict[str, Any]] = None) -> AdmissionSlot:
+    """获取执行名额；饱和或超出用户速率限制时返回 429 + Retry-After。config 为请求已取得的配置快照"""
+    config = agent_registry.config if config is None else config
+    admission.configure(config.get("concurrency"))
+    try:
+        return await admission.acquire(user, cost)
+    except AdmissionRejected as e:
+        raise HTTPException(status_code=429, detail=e.reason, headers={"Retry-After": str(e.retry_after)})
+
+
 @app.post("/chat")
-def chat(req: ChatRequest) -> Dict[str, Any]:
-    agent = build_agent()
-    result = agent.invoke(
-        {"messages": [m.model_dump() for m in req.messages]},
-        config={"configurable": {"thread_id": req.thread_id}},
-    )
+async def chat(req: ChatRequest, request: Request) -> Dict[str, Any]:
+    slot = await _admit(_user_of(req, request))
+    try:
+        agent, _ = await _current_agent()
+        thread_id = req.thread_id or uuid.uuid4().hex
+        run_config = _run_config(thread_id, req)
+        with span("chat", thread_id=thread_id):
+            stored = []
+            if agent.checkpointer:
+                stored = (await agent.aget_state(run_config)).values.get("messages", [])
+            result = await agent.ainvoke(
+                {"messages": _new_messages(stored, req.messages)},
+                config=run_config,
+            )
+    finally:
+        slot.release()
     last = result["messages"][-1]
-    return {"content": last.content}
+    return {"content": last.content, "thread_id": thread_id}
+
+
+def _text_of(content: Any) -> str:
+    """提取消息内容中的文本（content 可能是字符串或 content block 列表）"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for block in content:
+            if isinstance(block, str):
+                parts.append(block)
+            elif isinstance(block, dict) and block.get("type") == "text":
+                parts.append(block.get("text", ""))
+        return "".join(parts)
+    return ""
+
+
+def _sse(payload: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
+
+_STREAM_DONE = object()
+
+
+async def _stream_events(
+    agent: Any,
+    config: Dict[str, Any],
+    messages: List[Dict[str, Any]],
+    run_config: Dict[str, Any],
+    thread_id: str,
+    queue: asyncio.Queue,
+) -> None:
+    """
+    运行 Agent 并把事件写入 queue；config 是与 agent 配套的配置快照（流进行中热加载不影响本次输出）。
+
+    stream_mode="messages" 提供模型逐 token 输出；"updates" 提供每个节点完成后的
+    完整消息，用于产生 tool_start / tool_end 与最终答案。
+    """
+    stream_config = config.get("stream") if isinstance(config.get("stream"), dict) else {}
+    preview_chars = int(stream_config.get("tool_output_preview_chars", 500))
+    final = ""
+    structured = None
+    try:
+        async for mode, chunk in agent.astream(
+            {"messages": messages},
+            config=run_config,
+            stream_mode=["messages", "updates"],
+        ):
+            if mode == "messages":
+                message, metadata = chunk
+                # 只转发主 Agent 的模型输出；subagent（task tool）内部的 token 不下发
+                if not isinstance(message, AIMessageChunk) or metadata.get("langgraph_node") != "model":
+                    continue
+                if "|" in (metadata.get("langgraph_checkpoint_ns") or ""):
+                    continue
+                text = _text_of(message.content)
+                if text:
+                    await queue.put({"type": "token", "content": text})
+                continue
+
+            for update in chunk.values():
+                if not isinstance(update, dict):
+                    continue
+                if update.get("structured_response") is not None:
+                    structured = update["structured_response"]
+                node_messages = update.get("messages")
+                if not isinstance(node_messages, list):
+                    continue
+                for message in node_messages:
+                    if isinstance(message, AIMessage):
+                        for call in message.tool_calls:
+                            await queue.put({"type": "tool_start", "id": call.get("id"), "name": call.get("name"), "args": call.get("args")})
+                        if not message.tool_calls:
+                            final = _text_of(message.content)
+                    elif isinstance(message, ToolMessage):
+                        output = _text_of(message.content)
+                        await queue.put({
+                            "type": "tool_end",
+                            "id": message.tool_call_id,
+                            "name": message.name,
+                            "status": getattr(message, "status", "success"),
+                            "content": output[:preview_chars],
+                            "truncated": len(output) > preview_chars,
+                        })
+
+        payload: Dict[str, Any] = {"type": "final", "content": final, "thread_id": thread_id}
+        if structured is not None:
+            payload["structured_response"] = structured.model_dump() if hasattr(structured, "model_dump") else structured
+        await queue.put(payload)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        await queue.put({"type": "error", "message": f"{type(e).__name__}: {e}", "thread_id": thread_id})
+    finally:
+        await queue.put(_STREAM_DONE)
 
 
 @app.post("/chat/stream")
-async def chat_stream(req: ChatRequest) -> StreamingResponse:
-    async def event_stream():
-        agent = build_agent()
-        prev = ""
-        async for state in agent.astream(
-            {"messages": [m.model_dump() for m in req.messages]},
-            config={"configurable": {"thread_id": req.thread_id}},
-        ):
-            messages = None
-            if isinstance(state, dict):
-                messages = state.get("messages")
-            if not messages:
-                continue
+async def chat_stream(req: ChatRequest, request: Request) -> StreamingResponse:
+    thread_id = req.thread_id or uuid.uuid4().hex
+    # 在返回响应头之前获取名额，饱和时才能以 429 拒绝
+    slot = await _admit(_user_of(req, request))
 
-            last = messages[-1]
-            content = getattr(last, "content", None) or last.get("content")
-            if not content:
-                continue
+    async def event_stream():
+        root = start_span("chat.stream", thread_id=thread_id)
+        # 推送给客户端的耗时（yield 到恢复执行的间隔，反映网络与客户端读取的背压）
+        flush = start_span("sse.flush", parent=root)
+        producer: Optional[asyncio.Task] = None
+        events = 0
+        flush_seconds = 0.0
+        try:
+            try:
+                agent, config = await _current_agent()
+                stream_config = config.get("stream") if isinstance(config.get("stream"), dict) else {}
+                heartbeat = float(stream_config.get("heartbeat_interval", 15))
+
+                run_config = _run_config(thread_id, req)
+                with use_span(root):
+                    stored = []
+                    if agent.checkpointer:
+                        stored = (await agent.aget_state(run_config)).values.get("messages", [])
+
+                    queue: asyncio.Queue = asyncio.Queue()
+                    # create_task 复制当前上下文，Agent 内的 span 挂在 root 之下
+                    producer = asyncio.create_task(
+                        _stream_events(agent, config, _new_messages(stored, req.messages), run_config, thread_id, queue)
+                    )
+            except Exception as e:
+                # Agent 构建或读取会话状态失败：以 error 事件结束流，而不是截断响应
+                root.end(e)
+                yield _sse({"type": "error", "message": f"{type(e).__name__}: {e}", "thread_id": thread_id})
+                return
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), heartbeat)
+                except asyncio.TimeoutError:
+                    # 长时间无输出（如慢 tool）时发送 SSE 注释保活，并顺带检测客户端是否已断开
+                    if await request.is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                if item is _STREAM_DONE:
+                    break
+                started = time.perf_counter()
+                yield _sse(item)
+                elapsed = time.perf_counter() - started
+                SSE_FLUSH_SECONDS.observe(elapsed)
+                events += 1
+                flush_seconds += elapsed
+        finally:
+            # 客户端断开（生成器被关闭/取消）时停止 Agent，避免继续消耗模型与 tool 调用
+            if producer is not None and not producer.done():
+                producer.cancel()
+            slot.release()
+            flush.set(events=events, flush_ms=round(flush_seconds * 1000, 1))
+            flush.end()
+            root.end()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # 兜底：生成器未开始迭代就结束的响应也要归还名额
+        background=BackgroundTask(slot.release),
+    )
 
-            delta = content[len(prev):] if content.startswith(prev) else content
-            prev = content
 
-            payload = json.dumps({"type": "token", "content": delta}, ensure_ascii=False)
-            yield f"data: {payload}\n\n"
+@app.post("/enrich/batch")
+async def enrich_batch(req: EnrichRequest, request: Request) -> StreamingResponse:
+    """批量 IOC 富化：直接并发调用 MCP tools，按完成顺序以 NDJSON 逐行返回"""
+    # 取得配置快照（同时确保 MCP 配置已加载）：cost 与批次大小、上限都按同一份配置计算
+    _, config = await _current_agent()
+    settings = enrich_settings(config)
+    # 按 asset 批次数计 cost：大批量富化占用更多公平份额与令牌
+    batch_size = max(1, int(settings["asset_batch_size"]))
+    slot = await _admit(_user_of(req, request), max(1.0, len(req.iocs) / batch_size), config)
+    try:
+        iocs = normalize_iocs(req.iocs)
+        if len(iocs) > int(settings["max_iocs"]):
+            raise HTTPException(status_code=400, detail=f"IOC 数量超过上限 {settings['max_iocs']}")
+    except BaseException:
+        slot.release()
+        raise
+    tools = get_connection_manager().get_tools()
 
-        final_payload = json.dumps({"type": "final", "content": prev}, ensure_ascii=False)
-        yield f"data: {final_payload}\n\n"
+    def _line(payload: Dict[str, Any]) -> str:
+        return json.dumps(payload, ensure_ascii=False, default=str) + "\n"
 
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    async def event_stream():
+        started = time.perf_counter()
+        records: List[Dict[str, Any]] = []
+        try:
+            async for record in enrich_iocs(
+                iocs,
+                tools,
+                asset_batch_size=batch_size,
+                asset_info=req.asset_info,
+                reputation=req.reputation,
+            ):
+                if record["type"] != "error":
+                    records.append(record)
+                yield _line(record)
+            if req.summary and records:
+                try:
+                    # 开启多模型路由时使用 summarizer 档
+                    summary_config = tier_configs(config)["summarizer"] if routing_settings(config)["enabled"] else None
+                    reply = await build_model(config, summary_config).ainvoke(summary_prompt(records, int(settings["summary_max_chars"])))
+                    yield _line({"type": "summary", "content": _text_of(reply.content)})
+                except Exception as e:
+                    yield _line({"type": "error", "message": f"总结失败: {type(e).__name__}: {e}"})
+            yield _line({
+                "type": "done",
+                "iocs": len(iocs),
+                "results": len(records),
+                "errors": sum(1 for r in records if r["status"] == "error"),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+            })
+        finally:
+            slot.release()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(slot.release),
+    )
 
 
 @app.get("/health")
 def health() -> Dict[str, bool]:
     return {"ok": True}
+
+
+@app.get("/metrics")
+def metrics() -> PlainTextResponse:
+    """Prometheus 文本格式指标"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/mcp/status")
+def mcp_status() -> Dict[str, Any]:
+    return {"servers": get_connection_manager().status()}
+
+
+@app.get("/mcp/cache")
+def mcp_cache() -> Dict[str, Any]:
+    return get_connection_manager().result_cache_stats()
+
+
+@app.get("/llm/pool")
+def llm_pool() -> Dict[str, Any]:
+    return llm_pool_stats()
+
+
+@app.get("/llm/cache")
+def llm_cache() -> Dict[str, Any]:
+    return response_cache_stats()
+
+
+@app.get("/admission/stats")
+def admission_stats() -> Dict[str, Any]:
+    return admission.stats()
+
+
+@app.get("/agent/stats")
+def agent_stats() -> Dict[str, Any]:
+    return agent_registry.stats()
+
+
+@app.get("/skills/index")
+def skills_index() -> Dict[str, Any]:
+    return skills_index_stats()
+
+
+@app.get("/relevance/stats")
+def relevance_filter_stats() -> Dict[str, Any]:
+    return relevance_stats()
+
+
+@app.get("/memory/stats")
+def memory_stats() -> Dict[str, Any]:
+    return {**memory_store_stats(), "namespaces": namespaced_memory_stats()}
+
+
+@app.get("/llm/routing")
+def llm_routing_stats() -> Dict[str, Any]:
+    return model_routing_stats()
+
+
+@app.get("/llm/gateway")
+def llm_gateway() -> Dict[str, Any]:
+    return llm_gateway_stats()
+
+
+@app.post("/config/reload")
+async def config_reload(rebuild: bool = False) -> Dict[str, Any]:
+    """立即重新读取 config.json（不必等待 watcher）；内容未变化时只有 rebuild=true 才重建"""
+    try:
+        replaced = await asyncio.to_thread(agent_registry.reload, rebuild)
+    except ConfigError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"replaced": replaced, **agent_registry.stats()["config"]}
@@ -1,20 +1,40 @@
 """MCP Tools loader - 使用 langchain-mcp-adapters"""
 
 import asyncio
+import hashlib
 import json
 import os
+import random
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
+import anyio
+import httpx
 from langchain_core.tools import BaseTool
 
+from admission import TokenBucket
+from tracing import MCP_QUEUE_DEPTH, MCP_WAIT_SECONDS
+
 # 尝试导入 langchain-mcp-adapters
 try:
-    from langchain_mcp_adapters.client import MultiServerMCPClient
+    from langchain_mcp_adapters.sessions import create_session
+    from langchain_mcp_adapters.tools import convert_mcp_tool_to_langchain_tool
+    from mcp.shared.exceptions import McpError
+    from mcp.types import CONNECTION_CLOSED
+    from mcp.types import Tool as MCPTool
     _MCP_AVAILABLE = True
 except ImportError:
     _MCP_AVAILABLE = False
-    MultiServerMCPClient = None  # type: ignore
+    create_session = None  # type: ignore
+    convert_mcp_tool_to_langchain_tool = None  # type: ignore
+    MCPTool = None  # type: ignore
+    CONNECTION_CLOSED = -32000
+
+    class McpError(Exception):  # type: ignore
+        pass
 
 
 def load_mcp_tools(config: Optional[Dict[str, Any]] = None) -> List[BaseTool]:
@@ -25,17 +45,63 @@ def load_mcp_tools(config: Optional[Dict[str, Any]] = None) -> List[BaseTool]:
     {
       "mcp": {
         "disabled": false,
+        "reconnect_initial_delay": 1,
+        "reconnect_max_delay": 30,
+        "health_check_interval": 30,
+        "discovery_timeout": 10,
+        "max_concurrent_calls": 8,
+        "max_qps": 0,
+        "drain_timeout": 30,
+        "schema_cache": true,
+        "schema_cache_path": "./.cache/mcp_tools.json",
+        "result_cache": {
+          "enabled": false,
+          "default_ttl": 60,
+          "max_entries": 1000,
+          "tools": {"query_asset_info": 300, "get_indexes": 600},
+          "never_cache": []
+        },
         "servers": {
           "server_name": "http://localhost:3000/sse",
           "another": {
             "url": "http://localhost:3001/sse",
-            "transport": "sse"
+            "transport": "sse",
+            "discovery_timeout": 20,
+            "max_concurrent_calls": 4,
+            "max_qps": 5
           }
         }
       }
     }
     
     transport 支持: "sse" (Server-Sent Events), "http" (Streamable HTTP), "stdio" (本地进程)
+
+    连接由进程级 MCPConnectionManager 持有并复用：重复调用（如 Agent 重建）
+    不会重新握手，只有新增或配置变化的 server 才会建立新连接。
+
+    各 server 并发发现，互不影响：每个 server 有独立的 discovery_timeout，
+    超时或失败的 server 只影响自身，其余 server 的 tools 照常返回；
+    超时的 server 继续在后台重连。
+
+    同一轮模型输出中的多个 tool 调用由 Agent 并发执行；每个 server 同时
+    进行的调用数受 max_concurrent_calls 限制（server 级配置优先），超出的排队。
+    max_qps 大于 0 时每个 server 每秒最多发出 max_qps 个调用（令牌桶，允许 1 秒的突发），
+    超出的按到达顺序排队等待；排队中的调用数与等待时间见 /metrics 的 deepagents_mcp_queue_*。
+    限制在单个 worker 进程内生效。
+
+    配置重新加载时，被删除或连接配置变化的 server 的旧会话先摘除（新调用走新连接），
+    等进行中的调用结束后再关闭，最多等待 drain_timeout 秒。
+
+    发现到的 tool 定义会写入磁盘缓存（按 server 连接配置区分）。命中缓存的
+    server 直接用缓存的 schema 构建 tools、不等待连接，后台连接成功后若
+    server 返回的 schema 有变化再替换并通知监听方（如触发 Agent 重建）。
+
+    多 worker 模式（cluster.py）下，与主机共享进程命令一致的 stdio server 改为经前端转发的
+    Streamable HTTP 连接（见 DEEPAGENTS_MCP_SHARED），每台主机只运行一份 stdio 子进程。
+
+    result_cache 开启后，result_cache.tools 中列出的只读 tool 按各自 TTL（秒）
+    缓存调用结果，相同参数的并发调用合并为一次远端调用；waf_prod_op、
+    thehive_create_ioc 等写操作 tool 与 never_cache 中的 tool 永不缓存。
     """
     if not _MCP_AVAILABLE:
         print("⚠️  langchain-mcp-adapters 未安装，跳过 MCP tools 加载")
@@ -52,7 +118,45 @@ def load_mcp_tools(config: Optional[Dict[str, Any]] = None) -> List[BaseTool]:
     if str(disabled).lower() in {"1", "true", "yes"}:
         return []
 
-    # 收集所有 server 配置
+    servers = _collect_servers(mcp_config)
+    deadlines = _collect_discovery_timeouts(mcp_config, servers)
+    manager = get_connection_manager()
+    manager.apply_settings(mcp_config)
+
+    if not servers:
+        manager.configure({})
+        return []
+
+    print(f"🔌 正在连接 MCP servers: {list(servers.keys())}")
+    for name, cfg in servers.items():
+        print(f"   - {name}: {cfg.get('url') or cfg.get('command')} ({cfg.get('transport')})")
+    
+    tools: List[BaseTool] = []
+    
+    try:
+        manager.configure(servers, deadlines)
+        tools = manager.get_tools()
+        for name, report in manager.discovery_report().items():
+            if report["error"]:
+                print(f"   ❌ {name}: {report['error']}")
+            elif report["source"] == "cache":
+                print(f"   💾 {name}: {report['tools']} tools（来自 schema 缓存，后台刷新）")
+            else:
+                print(f"   ✅ {name}: {report['tools']} tools ({report['latency_ms']:.0f}ms)")
+        if tools:
+            print(f"✅ 已加载 {len(tools)} 个 MCP tools")
+        else:
+            print("⚠️  没有加载到任何 MCP tools")
+    except Exception as e:
+        print(f"❌ MCP tools 加载失败:")
+        _print_connection_error(e)
+        return []
+
+    return tools
+
+
+def _collect_servers(mcp_config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """从 config.mcp.servers 与 DEEPAGENTS_MCP_SERVERS 收集 server 连接配置"""
     servers: Dict[str, Dict[str, Any]] = {}
     
     # 从 config.mcp.servers 读取
@@ -87,11 +191,12 @@ def load_mcp_tools(config: Optional[Dict[str, Any]] = None) -> List[BaseTool]:
                         servers[name]["headers"] = value["headers"]
                 elif value.get("command"):
                     # stdio 模式
-                    servers[name] = {
+                    connection = {
                         "command": value["command"],
                         "args": value.get("args", []),
                         "transport": "stdio",
                     }
+                    servers[name] = _shared_stdio(name, connection) or connection
     
     # 从环境变量读取
     env_servers = os.getenv("DEEPAGENTS_MCP_SERVERS")
@@ -105,34 +210,77 @@ def load_mcp_tools(config: Optional[Dict[str, Any]] = None) -> List[BaseTool]:
         except Exception:
             pass
 
-    if not servers:
-        return []
+    return servers
 
-    print(f"🔌 正在连接 MCP servers: {list(servers.keys())}")
-    for name, cfg in servers.items():
-        print(f"   - {name}: {cfg.get('url') or cfg.get('command')} ({cfg.get('transport')})")
-    
-    tools: List[BaseTool] = []
-    
+
+def stdio_key(connection: Dict[str, Any]) -> str:
+    """stdio server 的命令指纹：多 worker 模式下判断 worker 的配置是否与主机共享的进程一致"""
+    raw = json.dumps([connection.get("command"), list(connection.get("args") or [])], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _shared_stdio(name: str, connection: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    多 worker 模式（cluster.py）下由主机进程共享的 stdio server：改连共享地址，不再自行启动子进程。
+
+    DEEPAGENTS_MCP_SHARED 由 cluster.py 设置：{"name": {"url": ..., "key": stdio_key, "headers": {...}}}；
+    命令与共享进程不一致（如热加载改了 args）的 server 仍由 worker 自行启动。
+    """
     try:
-        tools = asyncio.run(_load_tools_async(servers))
-        if tools:
-            print(f"✅ 已加载 {len(tools)} 个 MCP tools")
+        shared = json.loads(os.getenv("DEEPAGENTS_MCP_SHARED") or "{}").get(name)
+    except (ValueError, AttributeError):
+        return None
+    if not isinstance(shared, dict) or shared.get("key") != stdio_key(connection):
+        return None
+    return {
+        "url": shared["url"],
+        "transport": "http",
+        "timeout": 30,
+        "sse_read_timeout": 300,
+        "headers": shared.get("headers") or {},
+    }
+
+
+def start_shared_stdio(config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    多 worker 模式：在当前进程（cluster.py 前端）为 config 中的 stdio server 建立常驻会话，
+    返回 {name: 连接配置}。worker 经 cluster.py 转发调用这些会话，每台主机只有一份子进程。
+    """
+    if not _MCP_AVAILABLE:
+        return {}
+    mcp_config = config.get("mcp") if isinstance(config.get("mcp"), dict) else {}
+    if str(os.getenv("DEEPAGENTS_MCP_DISABLED", mcp_config.get("disabled", ""))).lower() in {"1", "true", "yes"}:
+        return {}
+    servers = {
+        name: connection
+        for name, connection in _collect_servers(mcp_config).items()
+        if connection.get("transport") == "stdio"
+    }
+    if not servers:
+        return {}
+    manager = get_connection_manager()
+    manager.apply_settings(mcp_config)
+    manager.configure(servers, _collect_discovery_timeouts(mcp_config, servers))
+    for name, report in manager.discovery_report().items():
+        if report["error"]:
+            print(f"   ❌ 共享 stdio MCP server {name}: {report['error']}")
         else:
-            print("⚠️  没有加载到任何 MCP tools")
-        
-    except ExceptionGroup as eg:
-        # Python 3.11+ TaskGroup 异常
-        print(f"❌ MCP 连接失败:")
-        for exc in eg.exceptions:
-            _print_connection_error(exc)
-        return []
-    except Exception as e:
-        print(f"❌ MCP tools 加载失败:")
-        _print_connection_error(e)
-        return []
+            print(f"   🔗 共享 stdio MCP server {name}: {report['tools']} tools")
+    return servers
 
-    return tools
+
+def _collect_discovery_timeouts(mcp_config: Dict[str, Any], servers: Dict[str, Dict[str, Any]]) -> Dict[str, float]:
+    """每个 server 的发现截止时间：server 级 discovery_timeout 优先，否则取 mcp.discovery_timeout"""
+    default = float(mcp_config.get("discovery_timeout", 10))
+    servers_config = mcp_config.get("servers") if isinstance(mcp_config.get("servers"), dict) else {}
+    deadlines: Dict[str, float] = {}
+    for name in servers:
+        value = servers_config.get(name)
+        if isinstance(value, dict) and value.get("discovery_timeout") is not None:
+            deadlines[name] = float(value["discovery_timeout"])
+        else:
+            deadlines[name] = default
+    return deadlines
 
 
 def _print_connection_error(e: Exception):
@@ -150,11 +298,703 @@ def _print_connection_error(e: Exception):
         print(f"   {error_type}: {error_msg}")
 
 
-async def _load_tools_async(servers_config: Dict[str, Dict[str, Any]]) -> List[BaseTool]:
-    """异步加载 MCP tools"""
-    client = MultiServerMCPClient(servers_config)
-    tools = await client.get_tools()
-    return tools
+async def _list_all_tools(session: Any) -> List[Any]:
+    """分页列出 server 上的全部 MCP tool 定义"""
+    tools: List[Any] = []
+    cursor = None
+    while True:
+        result = await session.list_tools(cursor=cursor)
+        tools.extend(result.tools or [])
+        cursor = getattr(result, "nextCursor", None)
+        if not cursor:
+            return tools
+
+
+class _SessionProxy:
+    """
+    交给 langchain-mcp-adapters 的 "session"。
+
+    每次 call_tool 都转发到 MCPConnectionManager 当前持有的活动会话，
+    因此断线重连后，已经绑定到 Agent 上的 tool 仍然可用。
+    """
+
+    def __init__(self, manager: "MCPConnectionManager", server_name: str) -> None:
+        self._manager = manager
+        self._server_name = server_name
+
+    async def call_tool(self, name: str, arguments: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
+        return await self._manager.call_tool(self._server_name, name, arguments, **kwargs)
+
+
+class _ServerConnection:
+    """单个 MCP server 的长连接状态（仅在 manager 的事件循环内访问）"""
+
+    def __init__(self, name: str, connection: Dict[str, Any], discovery_timeout: float) -> None:
+        self.name = name
+        self.connection = connection
+        self.discovery_timeout = discovery_timeout
+        self.discovery_ms: Optional[float] = None
+        self.discovery_error: Optional[str] = None
+        self.session: Any = None
+        self.tools: List[BaseTool] = []
+        # tools 对应的原始 MCP schema（规范化 JSON），用于判断 server 是否变更
+        self.schemas: Optional[List[Dict[str, Any]]] = None
+        self.source: Optional[str] = None
+        self.state = "connecting"
+        self.last_error: Optional[str] = None
+        self.connected_at: Optional[float] = None
+        self.last_health_check_at: Optional[float] = None
+        self.last_ping_ms: Optional[float] = None
+        self.reconnects = 0
+        self.calls = 0
+        self.call_slots: Optional[asyncio.Semaphore] = None
+        self.call_limit = 0
+        self.active_calls = 0
+        self.peak_active_calls = 0
+        self.queued_calls = 0
+        self.task: Optional[asyncio.Task] = None
+        self.ready = asyncio.Event()
+        self.first_attempt = asyncio.Event()
+        self.broken = asyncio.Event()
+        self.stop = asyncio.Event()
+
+    @property
+    def timeout(self) -> float:
+        return float(self.connection.get("timeout") or 30)
+
+
+_SCHEMA_CACHE_VERSION = 1
+
+
+def _dump_tool_schemas(mcp_tools: List[Any]) -> List[Dict[str, Any]]:
+    return [tool.model_dump(mode="json", by_alias=True, exclude_none=True) for tool in mcp_tools]
+
+
+class _ToolSchemaCache:
+    """
+    MCP tool schema 的磁盘缓存。
+
+    按 server 名称 + 连接配置哈希存储 tool 的 name / description / inputSchema，
+    文件带版本号，版本不一致时整体失效；写入采用临时文件 + rename 保证原子性。
+    连接配置只保存哈希，不会把 headers 等敏感信息落盘。
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._servers: Dict[str, Dict[str, Any]] = {}
+        self._load()
+
+    @staticmethod
+    def key_of(connection: Dict[str, Any]) -> str:
+        raw = json.dumps(connection, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _load(self) -> None:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            print(f"⚠️  MCP schema 缓存读取失败，忽略: {type(e).__name__}: {e}")
+            return
+        if isinstance(data, dict) and data.get("version") == _SCHEMA_CACHE_VERSION:
+            servers = data.get("servers")
+            self._servers = servers if isinstance(servers, dict) else {}
+
+    def get(self, name: str, connection: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        entry = self._servers.get(name)
+        if not isinstance(entry, dict) or entry.get("key") != self.key_of(connection):
+            return None
+        tools = entry.get("tools")
+        return tools if isinstance(tools, list) else None
+
+    def put(self, name: str, connection: Dict[str, Any], schemas: List[Dict[str, Any]]) -> None:
+        self._servers[name] = {
+            "key": self.key_of(connection),
+            "updated_at": time.time(),
+            "tools": schemas,
+        }
+        payload = {"version": _SCHEMA_CACHE_VERSION, "servers": self._servers}
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.path)
+        except Exception as e:
+            print(f"⚠️  MCP schema 缓存写入失败: {type(e).__name__}: {e}")
+
+
+# 写操作类 tool：无论配置如何都不缓存结果（MCP 结果缓存与模型响应缓存共用）
+NEVER_CACHE_TOOLS = frozenset({"waf_prod_op", "thehive_create_ioc"})
+
+
+class _ToolResultCache:
+    """
+    只读 MCP tool 的结果缓存（仅在 manager 的事件循环内访问）。
+
+    只缓存 allow-list（result_cache.tools）中配置了 TTL 的 tool，key 为
+    server + tool 名 + 规范化参数；isError 结果不缓存。相同 key 的并发调用
+    合并为一次远端调用（single-flight），所有调用方共享同一结果。
+    """
+
+    def __init__(self, settings: Dict[str, Any]) -> None:
+        self.default_ttl = float(settings.get("default_ttl", 60))
+        self.max_entries = int(settings.get("max_entries", 1000))
+        never = NEVER_CACHE_TOOLS | set(settings.get("never_cache") or [])
+        self.ttls: Dict[str, float] = {}
+        tools = settings.get("tools") or {}
+        if isinstance(tools, list):
+            tools = {name: None for name in tools}
+        for name, ttl in tools.items():
+            if name in never:
+                print(f"⚠️  MCP tool {name} 是写操作，忽略其结果缓存配置")
+                continue
+            self.ttls[name] = self.default_ttl if ttl is None else float(ttl)
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def ttl_of(self, name: str) -> float:
+        return self.ttls.get(name, 0.0)
+
+    @staticmethod
+    def key_of(server_name: str, name: str, arguments: Optional[Dict[str, Any]]) -> str:
+        raw = json.dumps(arguments or {}, sort_keys=True, ensure_ascii=False, default=str)
+        return f"{server_name}/{name}/{raw}"
+
+    def _count(self, name: str, field: str) -> None:
+        stats = self._stats.setdefault(name, {"hits": 0, "misses": 0, "coalesced": 0})
+        stats[field] += 1
+
+    async def get_or_call(self, server_name: str, name: str, arguments: Optional[Dict[str, Any]], call: Any) -> Any:
+        key = self.key_of(server_name, name, arguments)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self._count(name, "hits")
+                return entry[1]
+            del self._entries[key]
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self._count(name, "coalesced")
+        else:
+            self._count(name, "misses")
+            future = asyncio.ensure_future(call())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._finish(key, name, f))
+        # shield：某个调用方被取消时不影响共享的远端调用
+        return await asyncio.shield(future)
+
+    def _finish(self, key: str, name: str, future: asyncio.Future) -> None:
+        self._inflight.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            return
+        result = future.result()
+        if getattr(result, "isError", False):
+            return
+        self._entries[key] = (time.monotonic() + self.ttl_of(name), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        tools = {}
+        for name, stats in self._stats.items():
+            lookups = stats["hits"] + stats["misses"] + stats["coalesced"]
+            tools[name] = {
+                **stats,
+                "ttl": self.ttl_of(name),
+                "hit_ratio": (stats["hits"] + stats["coalesced"]) / lookups if lookups else 0.0,
+            }
+        return {"enabled": True, "entries": len(self._entries), "in_flight": len(self._inflight), "tools": tools}
+
+
+class MCPConnectionManager:
+    """
+    进程级 MCP 连接管理器。
+
+    在独立线程的事件循环中为每个 server 维护一个常驻会话（SSE / Streamable HTTP
+    连接或 stdio 子进程），tool 调用直接复用该会话，跳过每次调用的握手开销。
+    连接断开时按指数退避自动重连，并定期 ping 做健康检查。
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._servers: Dict[str, _ServerConnection] = {}
+        self._schema_cache: Optional[_ToolSchemaCache] = None
+        self._result_cache: Optional[_ToolResultCache] = None
+        self._result_cache_settings: Any = None
+        self._tools_listeners: List[Any] = []
+        self.reconnect_initial_delay = 1.0
+        self.reconnect_max_delay = 30.0
+        self.health_check_interval = 30.0
+        self.max_concurrent_calls = 8
+        self.drain_timeout = 30.0
+        self._call_limits: Dict[str, int] = {}
+        self.max_qps = 0.0
+        self._qps_limits: Dict[str, float] = {}
+        # 按 server 名保存令牌桶，重连 / 配置重新加载后保留已消耗的额度
+        self._qps_buckets: Dict[str, TokenBucket] = {}
+        # 已摘除、等待进行中调用结束后关闭的旧连接
+        self._draining: List[_ServerConnection] = []
+
+    def apply_settings(self, mcp_config: Dict[str, Any]) -> None:
+        self.reconnect_initial_delay = float(mcp_config.get("reconnect_initial_delay", 1.0))
+        self.reconnect_max_delay = float(mcp_config.get("reconnect_max_delay", 30.0))
+        self.health_check_interval = float(mcp_config.get("health_check_interval", 30.0))
+        self.max_concurrent_calls = max(1, int(mcp_config.get("max_concurrent_calls", 8)))
+        self.drain_timeout = max(0.0, float(mcp_config.get("drain_timeout", 30.0)))
+        servers_config = mcp_config.get("servers") if isinstance(mcp_config.get("servers"), dict) else {}
+        self._call_limits = {
+            name: max(1, int(value["max_concurrent_calls"]))
+            for name, value in servers_config.items()
+            if isinstance(value, dict) and value.get("max_concurrent_calls") is not None
+        }
+        self.max_qps = max(0.0, float(mcp_config.get("max_qps", 0)))
+        self._qps_limits = {
+            name: max(0.0, float(value["max_qps"]))
+            for name, value in servers_config.items()
+            if isinstance(value, dict) and value.get("max_qps") is not None
+        }
+
+        # 配置未变化时保留已有缓存条目（Agent 重建不清空）
+        result_cache = mcp_config.get("result_cache") if isinstance(mcp_config.get("result_cache"), dict) else {}
+        if result_cache != self._result_cache_settings:
+            self._result_cache_settings = result_cache
+            self._result_cache = _ToolResultCache(result_cache) if result_cache.get("enabled") else None
+
+        if str(mcp_config.get("schema_cache", True)).lower() in {"0", "false", "no"}:
+            self._schema_cache = None
+            return
+        cache_path = os.getenv("DEEPAGENTS_MCP_SCHEMA_CACHE") or mcp_config.get("schema_cache_path") or "./.cache/mcp_tools.json"
+        cache_path = Path(cache_path).resolve()
+        if self._schema_cache is None or self._schema_cache.path != cache_path:
+            self._schema_cache = _ToolSchemaCache(cache_path)
+
+    def add_tools_listener(self, callback: Any) -> None:
+        """
+        注册 tool 集合变化回调（server 返回的 schema 与已加载的不同时触发）。
+
+        回调在 manager 的事件循环线程中同步执行，必须快速返回且不能阻塞等待 manager。
+        """
+        self._tools_listeners.append(callback)
+
+    # ---------- 同步接口（可在任意线程调用，manager 自身的 loop 线程除外） ----------
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run_loop, name="mcp-connections", daemon=True)
+            self._thread.start()
+
+    def configure(self, servers: Dict[str, Dict[str, Any]], discovery_timeouts: Optional[Dict[str, float]] = None) -> None:
+        """
+        同步目标 server 集合：新增的建立连接，删除或配置变化的关闭后重连。
+
+        新 server 并发发现，最多等待各自的 discovery_timeout，
+        因此总耗时取决于最慢的 server 截止时间而不是所有 server 之和。
+        """
+        if not servers and not self._servers:
+            return
+        self.start()
+        self._run(self._configure(servers, discovery_timeouts or {}))
+
+    def get_tools(self) -> List[BaseTool]:
+        tools: List[BaseTool] = []
+        for conn in list(self._servers.values()):
+            tools.extend(conn.tools)
+        return tools
+
+    def tool_schemas(self, server_name: str) -> List[Dict[str, Any]]:
+        """server 当前的 MCP tool 定义（原始 schema），未发现时为空列表"""
+        conn = self._servers.get(server_name)
+        return list(conn.schemas or []) if conn is not None else []
+
+    def server_of(self, tool_name: str) -> Optional[str]:
+        """tool 所属的 server 名称（用于追踪与指标），不是 MCP tool 时返回 None"""
+        for name, conn in list(self._servers.items()):
+            if any(tool.name == tool_name for tool in conn.tools):
+                return name
+        return None
+
+    def discovery_report(self) -> Dict[str, Dict[str, Any]]:
+        """最近一次发现结果：耗时、tool 数量与错误"""
+        return {
+            name: {
+                "latency_ms": conn.discovery_ms,
+                "tools": len(conn.tools),
+                "source": conn.source,
+                "error": conn.discovery_error,
+            }
+            for name, conn in list(self._servers.items())
+        }
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            name: {
+                "transport": conn.connection.get("transport"),
+                "state": conn.state,
+                "tools": len(conn.tools),
+                "tools_source": conn.source,
+                "discovery_latency_ms": conn.discovery_ms,
+                "discovery_timeout": conn.discovery_timeout,
+                "discovery_error": conn.discovery_error,
+                "connected_at": conn.connected_at,
+                "last_health_check_at": conn.last_health_check_at,
+                "last_ping_ms": conn.last_ping_ms,
+                "reconnects": conn.reconnects,
+                "calls": conn.calls,
+                "active_calls": conn.active_calls,
+                "queued_calls": conn.queued_calls,
+                "peak_active_calls": conn.peak_active_calls,
+                "max_concurrent_calls": self._call_limits.get(name, self.max_concurrent_calls),
+                "max_qps": self._qps_limits.get(name, self.max_qps) or None,
+                "last_error": conn.last_error,
+            }
+            for name, conn in list(self._servers.items())
+        }
+
+    def result_cache_stats(self) -> Dict[str, Any]:
+        cache = self._result_cache
+        return cache.stats() if cache is not None else {"enabled": False}
+
+    def close(self, timeout: float = 10.0) -> None:
+        """关闭所有会话（stdio 子进程随之退出）并停止后台事件循环"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop, self._thread = None, None
+        if loop is None or thread is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout)
+        except Exception as e:
+            print(f"⚠️  MCP 连接关闭超时: {type(e).__name__}: {e}")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        if not thread.is_alive():
+            loop.close()
+        self._servers = {}
+
+    # ---------- tool 调用 ----------
+
+    async def call_tool(self, server_name: str, name: str, arguments: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
+        """在常驻会话上执行 tool；调用方可位于任意事件循环"""
+        loop = self._loop
+        if loop is None:
+            raise RuntimeError("MCP 连接管理器未启动")
+        coro = self._call_tool(server_name, name, arguments, **kwargs)
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is loop:
+            return await coro
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coro, loop))
+
+    # ---------- 以下均运行在 manager 的事件循环中 ----------
+
+    def _run_loop(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def _run(self, coro: Any) -> Any:
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def _configure(self, servers: Dict[str, Dict[str, Any]], discovery_timeouts: Dict[str, float]) -> None:
+        removed = [
+            self._servers.pop(name)
+            for name in list(self._servers)
+            if servers.get(name) != self._servers[name].connection
+        ]
+        for conn in removed:
+            self._draining.append(conn)
+            asyncio.create_task(self._drain_server(conn), name=f"mcp-drain:{conn.name}")
+
+        started: List[_ServerConnection] = []
+        for name, connection in servers.items():
+            deadline = float(discovery_timeouts.get(name, 10))
+            if name in self._servers:
+                self._servers[name].discovery_timeout = deadline
+                continue
+            conn = _ServerConnection(name, connection, deadline)
+            cached = self._schema_cache.get(name, connection) if self._schema_cache else None
+            if cached is not None:
+                try:
+                    self._set_tools(conn, [MCPTool.model_validate(item) for item in cached], cached)
+                    conn.source = "cache"
+                except Exception as e:
+                    print(f"⚠️  MCP server {name} 的 schema 缓存无效，重新发现: {type(e).__name__}: {e}")
+                    conn.tools, conn.schemas = [], None
+            conn.task = asyncio.create_task(self._maintain(conn), name=f"mcp:{name}")
+            self._servers[name] = conn
+            # 命中缓存的 server 不等待连接，后台刷新
+            if conn.schemas is None:
+                started.append(conn)
+
+        # 并发等待新连接完成首次尝试（成功或失败）；超过截止时间的 server
+        # 不再阻塞调用方，由后台任务继续重连
+        async def _wait_first(conn: _ServerConnection) -> None:
+            try:
+                await asyncio.wait_for(conn.first_attempt.wait(), conn.discovery_timeout)
+            except asyncio.TimeoutError:
+                conn.discovery_error = f"发现超时（>{conn.discovery_timeout:g}s）"
+
+        if started:
+            await asyncio.gather(*(_wait_first(conn) for conn in started))
+
+    async def _maintain(self, conn: _ServerConnection) -> None:
+        """保持单个 server 的会话：连接 -> 健康检查 -> 断线后退避重连"""
+        delay = self.reconnect_initial_delay
+        while not conn.stop.is_set():
+            attempt_started = time.perf_counter()
+            try:
+                async with create_session(conn.connection) as session:
+                    await asyncio.wait_for(session.initialize(), conn.timeout)
+                    mcp_tools = await asyncio.wait_for(_list_all_tools(session), conn.timeout)
+                    self._refresh_tools(conn, mcp_tools)
+                    conn.session = session
+                    conn.state = "connected"
+                    conn.connected_at = time.time()
+                    conn.last_error = None
+                    conn.discovery_ms = (time.perf_counter() - attempt_started) * 1000
+                    conn.discovery_error = None
+                    conn.broken.clear()
+                    conn.ready.set()
+                    conn.first_attempt.set()
+                    delay = self.reconnect_initial_delay
+                    await self._health_loop(conn, session)
+            except asyncio.CancelledError:
+                raise
+            except BaseException as e:
+                # anyio 的 TaskGroup 会把连接错误包装成 ExceptionGroup
+                if isinstance(e, (KeyboardInterrupt, SystemExit)):
+                    raise
+                conn.last_error = _describe_error(e)
+                if not conn.first_attempt.is_set():
+                    conn.discovery_error = conn.last_error
+            finally:
+                conn.session = None
+                conn.ready.clear()
+                conn.first_attempt.set()
+
+            if conn.stop.is_set():
+                break
+
+            conn.state = "reconnecting"
+            conn.reconnects += 1
+            wait = delay * random.uniform(0.8, 1.2)
+            print(f"⚠️  MCP server {conn.name} 连接断开，{wait:.1f}s 后重连: {conn.last_error}")
+            try:
+                await asyncio.wait_for(conn.stop.wait(), wait)
+            except asyncio.TimeoutError:
+                pass
+            delay = min(delay * 2, self.reconnect_max_delay)
+
+        conn.state = "closed"
+
+    def _set_tools(self, conn: _ServerConnection, mcp_tools: List[Any], schemas: List[Dict[str, Any]]) -> None:
+        proxy = _SessionProxy(self, conn.name)
+        conn.tools = [
+            convert_mcp_tool_to_langchain_tool(proxy, tool, server_name=conn.name)
+            for tool in mcp_tools
+        ]
+        conn.schemas = schemas
+
+    def _refresh_tools(self, conn: _ServerConnection, mcp_tools: List[Any]) -> None:
+        """用 server 返回的 tool 列表更新；schema 未变化时保留现有 tool 对象"""
+        schemas = _dump_tool_schemas(mcp_tools)
+        if schemas == conn.schemas:
+            conn.source = "live"
+            return
+
+        changed = conn.schemas is not None
+        self._set_tools(conn, mcp_tools, schemas)
+        conn.source = "live"
+        if self._schema_cache is not None:
+            self._schema_cache.put(conn.name, conn.connection, schemas)
+        if changed:
+            print(f"🔄 MCP server {conn.name} 的 tools 已变化，共 {len(conn.tools)} 个")
+            for callback in list(self._tools_listeners):
+                try:
+                    callback()
+                except Exception as e:
+                    print(f"⚠️  tools 变化回调失败: {type(e).__name__}: {e}")
+
+    async def _health_loop(self, conn: _ServerConnection, session: Any) -> None:
+        """定期 ping；收到停止信号或会话被标记为损坏时返回/抛出"""
+        while True:
+            waiters = [
+                asyncio.ensure_future(conn.stop.wait()),
+                asyncio.ensure_future(conn.broken.wait()),
+            ]
+            done, pending = await asyncio.wait(waiters, timeout=self.health_check_interval, return_when=asyncio.FIRST_COMPLETED)
+            for waiter in pending:
+                waiter.cancel()
+            if conn.stop.is_set():
+                return
+            if conn.broken.is_set():
+                raise ConnectionError(conn.last_error or "会话调用失败")
+
+            started = time.perf_counter()
+            await asyncio.wait_for(session.send_ping(), conn.timeout)
+            conn.last_ping_ms = (time.perf_counter() - started) * 1000
+            conn.last_health_check_at = time.time()
+
+    async def _call_tool(self, server_name: str, name: str, arguments: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
+        cache = self._result_cache
+        if cache is not None and cache.ttl_of(name) > 0:
+            return await cache.get_or_call(
+                server_name, name, arguments,
+                lambda: self._call_session(server_name, name, arguments, **kwargs),
+            )
+        return await self._call_session(server_name, name, arguments, **kwargs)
+
+    async def _call_session(self, server_name: str, name: str, arguments: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
+        conn = self._servers.get(server_name)
+        if conn is None:
+            raise RuntimeError(f"MCP server {server_name} 未配置")
+        if not conn.ready.is_set():
+            try:
+                await asyncio.wait_for(conn.ready.wait(), conn.timeout)
+            except asyncio.TimeoutError:
+                raise RuntimeError(f"MCP server {server_name} 不可用: {conn.last_error or conn.state}") from None
+
+        # 同一 server 先按 max_qps 限速，再受 max_concurrent_calls 限制，超出的排队等待
+        limit = self._call_limits.get(server_name, self.max_concurrent_calls)
+        if conn.call_slots is None or conn.call_limit != limit:
+            conn.call_slots = asyncio.Semaphore(limit)
+            conn.call_limit = limit
+        slots = conn.call_slots
+        conn.queued_calls += 1
+        MCP_QUEUE_DEPTH.set(conn.queued_calls, server=server_name)
+        started = time.perf_counter()
+        try:
+            delay = self._qps_delay(server_name)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await slots.acquire()
+        finally:
+            conn.queued_calls -= 1
+            MCP_QUEUE_DEPTH.set(conn.queued_calls, server=server_name)
+        MCP_WAIT_SECONDS.observe(time.perf_counter() - started, server=server_name)
+        conn.active_calls += 1
+        conn.peak_active_calls = max(conn.peak_active_calls, conn.active_calls)
+        try:
+            # 排队期间会话可能已断开重连，或连接已被摘除排空：重新读取当前会话
+            session = conn.session
+            if session is None and not conn.stop.is_set():
+                try:
+                    await asyncio.wait_for(conn.ready.wait(), conn.timeout)
+                except asyncio.TimeoutError:
+                    pass
+                session = conn.session
+            if session is None:
+                raise RuntimeError(f"MCP server {server_name} 不可用: {conn.last_error or conn.state}")
+            conn.calls += 1
+            return await session.call_tool(name, arguments, **kwargs)
+        except Exception as e:
+            # 只有连接层错误才需要重连；协议错误、调用超时、结果校验失败等会话本身仍然可用
+            if session is not None and _is_transport_error(e):
+                conn.last_error = _describe_error(e)
+                if conn.session is session:
+                    conn.broken.set()
+            raise
+        finally:
+            conn.active_calls -= 1
+            slots.release()
+
+    def _qps_delay(self, server_name: str) -> float:
+        """预约一个调用令牌，返回需要等待的秒数；未配置 max_qps 时为 0"""
+        qps = self._qps_limits.get(server_name, self.max_qps)
+        if qps <= 0:
+            self._qps_buckets.pop(server_name, None)
+            return 0.0
+        bucket = self._qps_buckets.get(server_name)
+        if bucket is None or bucket.rate != qps:
+            bucket = self._qps_buckets[server_name] = TokenBucket(qps, max(1.0, qps))
+        return bucket.reserve()
+
+    async def _stop_server(self, conn: _ServerConnection) -> None:
+        conn.stop.set()
+        if conn.task is None or conn.task.done():
+            return
+        # 已连接的会话优雅退出（关闭 stdio 子进程）；仍在握手的直接取消
+        if conn.session is None:
+            conn.task.cancel()
+        done, _ = await asyncio.wait({conn.task}, timeout=5)
+        if not done:
+            conn.task.cancel()
+            await asyncio.wait({conn.task}, timeout=5)
+
+    async def _drain_server(self, conn: _ServerConnection) -> None:
+        """旧连接已不再接收新调用；等进行中与排队的调用结束（最多 drain_timeout 秒）后关闭"""
+        deadline = time.monotonic() + self.drain_timeout
+        while (conn.active_calls or conn.queued_calls) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if conn.active_calls or conn.queued_calls:
+            print(f"⚠️  MCP server {conn.name} 的旧连接排空超时（{self.drain_timeout:g}s），仍有 {conn.active_calls} 个调用进行中")
+        try:
+            await self._stop_server(conn)
+        finally:
+            if conn in self._draining:
+                self._draining.remove(conn)
+
+    async def _shutdown(self) -> None:
+        servers = list(self._servers.values()) + self._draining
+        self._servers = {}
+        self._draining = []
+        await asyncio.gather(*(self._stop_server(conn) for conn in servers))
+
+
+# 连接 / 会话流已断开
+_TRANSPORT_ERRORS = (
+    OSError,
+    EOFError,
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+    httpx.TransportError,
+)
+
+
+def _is_transport_error(e: BaseException) -> bool:
+    if isinstance(e, BaseExceptionGroup):
+        return any(_is_transport_error(inner) for inner in e.exceptions)
+    if isinstance(e, McpError):
+        # 会话的读循环结束时，等待中的请求以 CONNECTION_CLOSED 错误返回
+        return getattr(getattr(e, "error", None), "code", None) == CONNECTION_CLOSED
+    return isinstance(e, _TRANSPORT_ERRORS)
+
+
+def _describe_error(e: BaseException) -> str:
+    if isinstance(e, BaseExceptionGroup) and e.exceptions:
+        return "; ".join(_describe_error(inner) for inner in e.exceptions)
+    return f"{type(e).__name__}: {e}"
+
+
+_manager: Optional[MCPConnectionManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_connection_manager() -> MCPConnectionManager:
+    """返回进程级 MCPConnectionManager 单例"""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = MCPConnectionManager()
+        return _manager
+
+
+def close_mcp_connections() -> None:
+    """关闭所有 MCP 常驻连接（在应用 shutdown 时调用）"""
+    if _manager is not None:
+        _manager.close()
 
 
 def _test_mcp():
@@ -190,6 +1030,7 @@ def _test_mcp():
             desc = tool.description[:60] + "..." if len(tool.description) > 60 else tool.description
             print(f"   - {tool.name}: {desc}")
     
+    close_mcp_connections()
     print("\n" + "=" * 50)
 
 
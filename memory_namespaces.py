@@ -0,0 +1,417 @@
+"""按租户 / 用户隔离的长期记忆 - 分块 + BM25 检索，只注入 token 预算内最相关的片段（默认关闭）
+
+config.json 格式:
+{
+  "memory_namespaces": {
+    "enabled": false,
+    "dir": "./memory_namespaces",   # 命名空间根目录（不要放在 memories_dir 内，否则会经 /memories/ 暴露给其他用户）
+    "budget_tokens": 1000,          # 每次模型调用注入的记忆片段 token 上限
+    "chunk_chars": 800,             # 单个片段的最大字符数
+    "max_file_chars": 20000,        # 单个记忆文件超过该长度时，把最早的片段移入 archive/
+    "max_archive_chars": 200000,    # archive 超过该长度时丢弃最早的片段
+    "include_global": false         # true 时 memory_files（如 AGENTS.md）也改为检索注入，而不是全文注入
+  }
+}
+
+- 命名空间由请求的 tenant_id / user_id 决定（未提供时为 default / anonymous）：
+  /memories/team/ → <dir>/<tenant>/shared/，/memories/user/ → <dir>/<tenant>/users/<user>/，
+  模型用普通的文件 tools 读写，读写同样经过 MemoryStore（文件锁 + 原子替换）。
+- 每次模型调用：按标题 / 空行 / 列表项把各命名空间的 .md 切成片段，用最近一条用户消息做 BM25 检索，
+  按得分把片段放入 system prompt，直到用完 budget_tokens；没有匹配时按时间取最近的片段。
+  用户 / 团队（/ 全局）片段合并成一个 BM25 语料，得分在命名空间之间可比；
+  片段索引按文件版本缓存，文件不变时不重建。prompt 中的记忆大小与记忆总量无关。
+- 命名空间 id 最长 64 个字符（超长直接报错）；只含 [A-Za-z0-9_-] 的 id 原样作为目录名，其他 id 的目录名为
+  替换后的可读前缀 + "." + 哈希后缀（"." 不会出现在原样目录名中），不同 id 不会落到同一目录。
+  旧版本把非法字符替换为 _（如 alice@corp.com → alice_corp_com/）：该 id 首次访问时，若新目录不存在而旧目录存在，
+  在锁内把旧目录改名为新目录名。迁移前旧目录仍可被同名的原样 id（alice_corp_com）访问，
+  升级后尽早让这类用户访问一次，或手动把旧目录改名为新目录名。
+- 压缩在写入路径上进行（检索只读不写）：写入 / 编辑命名空间中的文件后，文件超过 max_file_chars 时，
+  最早的片段（文件开头）移入 archive/<文件名>（仍参与检索），重复片段去重；archive 超过 max_archive_chars 时丢弃最早的片段。
+"""
+
+import asyncio
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain.agents.middleware import AgentMiddleware
+from langgraph.config import get_config
+from deepagents.backends.protocol import EditResult, WriteResult
+
+from memory_store import MemoryBackend, MemoryStore
+from relevance import BM25, last_user_text
+from skills_index import append_to_system_message
+
+_DEFAULTS: Dict[str, Any] = {
+    "enabled": False,
+    "dir": "./memory_namespaces",
+    "budget_tokens": 1000,
+    "chunk_chars": 800,
+    "max_file_chars": 20000,
+    "max_archive_chars": 200000,
+    "include_global": False,
+}
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_-]")
+_MAX_ID_CHARS = 64
+_CJK = re.compile(r"[一-鿿]")
+_BLOCK_START = re.compile(r"^(#{1,6}\s|[-*+]\s|\d+\.\s)")
+
+USER_ROUTE = "/memories/user/"
+TEAM_ROUTE = "/memories/team/"
+
+MEMORY_SECTION = """
+
+## Relevant Memories
+
+以下是与当前问题最相关的长期记忆片段（按相关性排序，并非全部记忆）。
+个人记忆写入 `{user_route}`，团队共享记忆写入 `{team_route}`（Markdown，一条记忆一个列表项或段落）。
+
+{snippets}
+"""
+
+
+def namespace_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    section = config.get("memory_namespaces") if isinstance(config.get("memory_namespaces"), dict) else {}
+    return {key: section.get(key, default) for key, default in _DEFAULTS.items()}
+
+
+def _safe(value: Optional[str], default: str) -> str:
+    """把 tenant_id / user_id 映射为目录名（单射：不同 id 得到不同目录）"""
+    value = str(value or default)
+    if len(value) > _MAX_ID_CHARS:
+        raise ValueError(f"命名空间 id 超过 {_MAX_ID_CHARS} 个字符: {value[:16]}...")
+    if not _UNSAFE.search(value):
+        return value
+    digest = hashlib.sha256(value.encode("utf-8")).hexdigest()[:16]
+    return f"{_UNSAFE.sub('_', value)}.{digest}"
+
+
+def _legacy_name(value: Optional[str], default: str) -> Optional[str]:
+    """旧版（有损）映射得到的目录名：非法字符替换为 _ 后截断到 64；与当前目录名相同时返回 None"""
+    value = str(value or default)
+    legacy = _UNSAFE.sub("_", value)[:_MAX_ID_CHARS]
+    return legacy if legacy != _safe(value, default) else None
+
+
+def estimate_tokens(text: str) -> int:
+    """中文约 1 字 1 token，其他约 4 字符 1 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def chunk_markdown(text: str, chunk_chars: int) -> List[str]:
+    """按标题 / 列表项 / 空行切分，片段带上所属标题，超长片段按字符切开"""
+    chunks: List[str] = []
+    heading = ""
+    block: List[str] = []
+
+    def flush() -> None:
+        body = "\n".join(block).strip()
+        block.clear()
+        if not body:
+            return
+        prefix = f"{heading}\n" if heading and not body.startswith("#") else ""
+        room = max(1, chunk_chars - len(prefix))
+        for i in range(0, len(body), room):
+            chunks.append(prefix + body[i:i + room])
+
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            flush()
+            continue
+        if stripped.startswith("#"):
+            flush()
+            heading = stripped
+            continue
+        if _BLOCK_START.match(stripped) and block:
+            flush()
+        block.append(line)
+    flush()
+    return chunks
+
+
+class _NamespaceIndex:
+    """一个命名空间目录的片段；签名（各文件版本）不变时复用"""
+
+    def __init__(self, signature: Tuple[Tuple[str, str], ...], chunks: List[Tuple[str, str]]) -> None:
+        self.signature = signature
+        # (来源路径, 片段)，同一文件内按出现顺序（越靠后越新）
+        self.chunks = chunks
+
+
+class _CombinedIndex:
+    """一次请求可见的全部命名空间（用户 + 团队 + 全局）合并后的 BM25，使各命名空间的得分可比"""
+
+    def __init__(self, signature: Tuple[Any, ...], chunks: List[Tuple[str, str]]) -> None:
+        self.signature = signature
+        # (虚拟路径, 片段)
+        self.chunks = chunks
+        self.bm25 = BM25([text for _, text in chunks])
+
+
+class NamespacedMemory:
+    """解析请求对应的命名空间、维护片段索引、压缩与检索"""
+
+    def __init__(self, root_dir: str, store: MemoryStore, settings: Dict[str, Any], global_dir: Optional[str] = None) -> None:
+        self.root_dir = Path(root_dir).resolve()
+        self.store = store
+        self.global_dir = Path(global_dir).resolve() if global_dir else None
+        self.budget_tokens = int(settings["budget_tokens"])
+        self.chunk_chars = int(settings["chunk_chars"])
+        self.max_file_chars = int(settings["max_file_chars"])
+        self.max_archive_chars = int(settings["max_archive_chars"])
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, _NamespaceIndex] = {}
+        self._combined: "OrderedDict[Tuple[str, ...], _CombinedIndex]" = OrderedDict()
+        self.retrievals = 0
+        self.rebuilds = 0
+        self.compactions = 0
+        self.migrations = 0
+        self._migrated: set = set()
+        self.injected_tokens_max = 0
+
+    def dirs_for(self, configurable: Dict[str, Any]) -> Dict[str, Path]:
+        tenant_id, user_id = configurable.get("tenant_id"), configurable.get("user_id")
+        tenant_dir = self.root_dir / _safe(tenant_id, "default")
+        user_dir = tenant_dir / "users" / _safe(user_id, "anonymous")
+        legacy_tenant = _legacy_name(tenant_id, "default")
+        if legacy_tenant is not None:
+            self._migrate(self.root_dir / legacy_tenant, tenant_dir)
+        legacy_user = _legacy_name(user_id, "anonymous")
+        if legacy_user is not None:
+            self._migrate(tenant_dir / "users" / legacy_user, user_dir)
+        return {USER_ROUTE: user_dir, TEAM_ROUTE: tenant_dir / "shared"}
+
+    def _migrate(self, legacy: Path, target: Path) -> None:
+        """把旧版有损映射的目录改名为当前目录名（新目录不存在时；跨进程加锁，只执行一次）"""
+        key = str(target)
+        if key in self._migrated:
+            return
+        try:
+            if not target.exists() and legacy.is_dir():
+                with self.store.lock(target):
+                    if not target.exists() and legacy.is_dir():
+                        target.parent.mkdir(parents=True, exist_ok=True)
+                        legacy.rename(target)
+                        self.migrations += 1
+                        print(f"📦 记忆命名空间迁移: {legacy} -> {target}")
+        except (OSError, TimeoutError) as e:
+            print(f"⚠️  记忆命名空间迁移失败: {legacy} -> {target}: {type(e).__name__}: {e}")
+            return
+        with self._lock:
+            self._migrated.add(key)
+
+    def routes_for(self, configurable: Dict[str, Any]) -> Dict[str, MemoryBackend]:
+        routes = {}
+        for route, path in self.dirs_for(configurable).items():
+            path.mkdir(parents=True, exist_ok=True)
+            routes[route] = _NamespaceBackend(path, self)
+        return routes
+
+    def compact_if_needed(self, path: Path, directory: Path) -> None:
+        """写入后检查：文件超过 max_file_chars 时压缩（archive/ 中的文件只在压缩时追加，不再检查）"""
+        try:
+            if "archive" in path.relative_to(directory).parts:
+                return
+            data, _ = self.store.read(path)
+            if data is not None and len(data) > self.max_file_chars:
+                self._compact(path, directory)
+        except (OSError, TimeoutError, ValueError) as e:
+            print(f"⚠️  记忆压缩失败: {path}: {type(e).__name__}: {e}")
+
+    def _files(self, directory: Path, recursive: bool = True) -> List[Path]:
+        if not directory.is_dir():
+            return []
+        pattern = "**/*.md" if recursive else "*.md"
+        return sorted(p for p in directory.glob(pattern) if p.is_file() and not p.name.startswith("."))
+
+    def _compact(self, path: Path, archive_root: Path) -> None:
+        """文件超过 max_file_chars 时把开头（最早）的片段移入 archive，并对片段去重"""
+        moved: List[str] = []
+
+        def shrink(current: Optional[str]) -> str:
+            chunks = list(dict.fromkeys(chunk_markdown(current or "", self.chunk_chars)))
+            total = sum(len(c) + 2 for c in chunks)
+            while chunks and total > self.max_file_chars // 2:
+                total -= len(chunks[0]) + 2
+                moved.append(chunks.pop(0))
+            return "\n\n".join(chunks) + "\n"
+
+        self.store.update(path, shrink)
+        if not moved:
+            return
+        archive = archive_root / "archive" / path.name
+
+        def extend(current: Optional[str]) -> str:
+            chunks = list(dict.fromkeys(chunk_markdown(current or "", self.chunk_chars) + moved))
+            total = sum(len(c) + 2 for c in chunks)
+            while len(chunks) > 1 and total > self.max_archive_chars:
+                total -= len(chunks[0]) + 2
+                chunks.pop(0)
+            return "\n\n".join(chunks) + "\n"
+
+        self.store.update(archive, extend)
+        self.compactions += 1
+        print(f"🗜️  记忆压缩: {path} 移出 {len(moved)} 个片段到 {archive}")
+
+    def _index(self, directory: Path, recursive: bool = True) -> _NamespaceIndex:
+        files = self._files(directory, recursive)
+        versions = []
+        for path in files:
+            data, version = self.store.read(path)
+            if data is None:
+                continue
+            versions.append((str(path), version or ""))
+        signature = tuple(versions)
+        key = str(directory)
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is not None and cached.signature == signature:
+                return cached
+        chunks: List[Tuple[str, str]] = []
+        for path_str, _ in versions:
+            data, _ = self.store.read(Path(path_str))
+            text = data.decode("utf-8", errors="replace") if data else ""
+            chunks.extend((path_str, chunk) for chunk in chunk_markdown(text, self.chunk_chars))
+        index = _NamespaceIndex(signature, chunks)
+        with self._lock:
+            self._indexes[key] = index
+            self.rebuilds += 1
+        return index
+
+    def retrieve(self, configurable: Dict[str, Any], query: str) -> List[Tuple[str, str]]:
+        """返回 [(虚拟路径, 片段)]，总 token 数不超过 budget_tokens"""
+        sources: List[Tuple[str, Path, bool]] = [(route, path, True) for route, path in self.dirs_for(configurable).items()]
+        if self.global_dir is not None:
+            sources.append(("/memories/", self.global_dir, False))
+        indexes = [(route, directory, self._index(directory, recursive)) for route, directory, recursive in sources]
+        key = tuple(str(directory) for _, directory, _ in indexes)
+        signature = tuple(index.signature for _, _, index in indexes)
+        with self._lock:
+            combined = self._combined.get(key)
+            if combined is not None:
+                self._combined.move_to_end(key)
+        if combined is None or combined.signature != signature:
+            chunks = [
+                (route + Path(path_str).relative_to(directory).as_posix(), text)
+                for route, directory, index in indexes
+                for path_str, text in index.chunks
+            ]
+            combined = _CombinedIndex(signature, chunks)
+            with self._lock:
+                self._combined[key] = combined
+                if len(self._combined) > 256:
+                    self._combined.popitem(last=False)
+        self.retrievals += 1
+        if not combined.chunks:
+            return []
+        scores = combined.bm25.scores(query) if query else [0.0] * len(combined.chunks)
+        candidates = [(score, position, virtual, text) for position, ((virtual, text), score) in enumerate(zip(combined.chunks, scores))]
+        if max(c[0] for c in candidates) <= 0:
+            # 没有相关片段：取最近写入的（同一目录中越靠后越新）
+            ranked = sorted(candidates, key=lambda c: -c[1])
+        else:
+            ranked = sorted((c for c in candidates if c[0] > 0), key=lambda c: (-c[0], -c[1]))
+        selected, used = [], 0
+        for _, _, virtual, text in ranked:
+            cost = estimate_tokens(text)
+            if used + cost > self.budget_tokens:
+                continue
+            selected.append((virtual, text))
+            used += cost
+        self.injected_tokens_max = max(self.injected_tokens_max, used)
+        return selected
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": True,
+            "root": str(self.root_dir),
+            "indexed_namespaces": len(self._indexes),
+            "cached_combined_indexes": len(self._combined),
+            "retrievals": self.retrievals,
+            "index_rebuilds": self.rebuilds,
+            "compactions": self.compactions,
+            "migrations": self.migrations,
+            "budget_tokens": self.budget_tokens,
+            "injected_tokens_max": self.injected_tokens_max,
+        }
+
+
+class _NamespaceBackend(MemoryBackend):
+    """/memories/user/ 与 /memories/team/ 路由：写入 / 编辑成功后在同一线程内检查是否需要压缩"""
+
+    def __init__(self, directory: Path, memory: NamespacedMemory) -> None:
+        super().__init__(root_dir=str(directory), store=memory.store)
+        self.directory = directory
+        self.memory = memory
+
+    def write(self, file_path: str, content: str) -> WriteResult:
+        result = super().write(file_path, content)
+        if not result.error:
+            self.memory.compact_if_needed(self._resolve_path(file_path), self.directory)
+        return result
+
+    def edit(self, file_path: str, old_string: str, new_string: str, replace_all: bool = False) -> EditResult:
+        result = super().edit(file_path, old_string, new_string, replace_all)
+        if not result.error:
+            self.memory.compact_if_needed(self._resolve_path(file_path), self.directory)
+        return result
+
+
+class NamespacedMemoryMiddleware(AgentMiddleware):
+    """每次模型调用检索当前用户 / 团队命名空间的记忆片段并追加到 system prompt"""
+
+    def __init__(self, memory: NamespacedMemory) -> None:
+        super().__init__()
+        self.memory = memory
+
+    @staticmethod
+    def _configurable() -> Dict[str, Any]:
+        try:
+            return get_config().get("configurable") or {}
+        except RuntimeError:
+            return {}
+
+    def _inject(self, request: Any, snippets: List[Tuple[str, str]]) -> Any:
+        body = "\n\n".join(f"[{path}]\n{text}" for path, text in snippets) or "（暂无记忆）"
+        section = MEMORY_SECTION.format(user_route=USER_ROUTE, team_route=TEAM_ROUTE, snippets=body)
+        return request.override(system_message=append_to_system_message(request.system_message, section))
+
+    def wrap_model_call(self, request, handler):
+        snippets = self.memory.retrieve(self._configurable(), last_user_text(request.messages))
+        return handler(self._inject(request, snippets))
+
+    async def awrap_model_call(self, request, handler):
+        # 检索会读文件、等待文件锁，放到线程中执行，不阻塞事件循环
+        snippets = await asyncio.to_thread(self.memory.retrieve, self._configurable(), last_user_text(request.messages))
+        return await handler(self._inject(request, snippets))
+
+
+_memory: Optional[NamespacedMemory] = None
+
+
+def build_namespaced_memory(config: Dict[str, Any], store: MemoryStore, memories_dir: str) -> Optional[NamespacedMemory]:
+    """按配置构建（随 Agent 重建），未启用时返回 None"""
+    global _memory
+    settings = namespace_settings(config)
+    if not settings["enabled"]:
+        _memory = None
+        return None
+    _memory = NamespacedMemory(
+        settings["dir"],
+        store,
+        settings,
+        global_dir=memories_dir if settings["include_global"] else None,
+    )
+    print(f"🗂️  记忆命名空间: {_memory.root_dir}（每次注入 ≤ {settings['budget_tokens']} tokens）")
+    return _memory
+
+
+def namespaced_memory_stats() -> Dict[str, Any]:
+    memory = _memory
+    return memory.stats() if memory is not None else {"enabled": False}
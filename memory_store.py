@@ -0,0 +1,294 @@
+"""长期记忆存储 - 文件锁 + 原子替换 + 版本化 CAS + 按 mtime 失效的进程内读缓存
+
+config.json 格式:
+{
+  "memory_store": {
+    "lock_dir": "/tmp/deepagents-memory-locks",   # 锁文件目录（同一主机的所有 worker 共用）
+    "lock_timeout": 10                              # 等待锁的最长秒数
+  }
+}
+
+/memories/ 路由的读写都经过 MemoryStore：
+- 写入 / 编辑 / 追加在文件锁（fcntl.flock，跨进程）内完成「读取 → 修改 → 写临时文件 → fsync → os.replace」，
+  多个请求或多个 uvicorn worker 同时编辑同一文件时不会互相覆盖；读方永远只看到完整的旧版本或新版本。
+- 每个文件的版本号是内容的 sha256 前 16 位；compare_and_swap 只在当前版本与预期一致时写入，否则抛出 MemoryConflict。
+- 读取走进程内缓存，每次只做一次 stat（mtime / size / inode 不变则直接返回缓存内容），
+  其他 worker 的写入会改变 inode/mtime，下一次读取即可看到。
+锁文件放在 lock_dir 而不是记忆目录内（避免出现在 ls 结果中）；跨主机共享目录（NFS 等）不在保证范围内。
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from deepagents.backends import FilesystemBackend
+from deepagents.backends.protocol import EditResult, FileDownloadResponse, WriteResult
+from deepagents.backends.utils import check_empty_content, format_content_with_line_numbers, perform_string_replacement
+
+from tracing import span
+
+try:
+    import fcntl
+
+    _HAS_FCNTL = True
+except ImportError:  # Windows：只有进程内的锁
+    _HAS_FCNTL = False
+
+
+class MemoryConflict(Exception):
+    """compare_and_swap 时文件版本已被其他写入者修改"""
+
+    def __init__(self, path: str, expected: Optional[str], current: Optional[str]) -> None:
+        super().__init__(f"{path} 版本冲突: 预期 {expected}，当前 {current}")
+        self.expected = expected
+        self.current = current
+
+
+def content_version(data: Optional[bytes]) -> Optional[str]:
+    return hashlib.sha256(data).hexdigest()[:16] if data is not None else None
+
+
+class MemoryStore:
+    """按真实路径读写记忆文件；线程安全、跨进程安全（同一主机）"""
+
+    def __init__(self, lock_dir: Optional[str] = None, lock_timeout: float = 10.0) -> None:
+        self.lock_dir = Path(lock_dir or os.path.join(tempfile.gettempdir(), "deepagents-memory-locks"))
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        self.lock_timeout = float(lock_timeout)
+        self._guard = threading.Lock()
+        self._thread_locks: Dict[str, threading.Lock] = {}
+        # 真实路径 -> ((mtime_ns, size, inode), 内容, 版本)
+        self._cache: Dict[str, Tuple[Tuple[int, int, int], bytes, str]] = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.writes = 0
+        self.conflicts = 0
+        self.lock_wait_ms_max = 0.0
+        if not _HAS_FCNTL:
+            print("⚠️  当前平台不支持 fcntl，记忆文件只在进程内加锁")
+
+    def _thread_lock(self, key: str) -> threading.Lock:
+        with self._guard:
+            return self._thread_locks.setdefault(key, threading.Lock())
+
+    @contextmanager
+    def lock(self, path: Path) -> Iterator[None]:
+        """对单个记忆文件加排他锁（进程内线程锁 + 跨进程 flock）"""
+        key = hashlib.sha256(str(path).encode("utf-8")).hexdigest()[:32]
+        started = time.monotonic()
+        thread_lock = self._thread_lock(key)
+        if not thread_lock.acquire(timeout=self.lock_timeout):
+            raise TimeoutError(f"等待记忆文件锁超时: {path}")
+        try:
+            if not _HAS_FCNTL:
+                self._record_wait(started)
+                yield
+                return
+            with open(self.lock_dir / f"{key}.lock", "a") as lock_file:
+                while True:
+                    try:
+                        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        if time.monotonic() - started > self.lock_timeout:
+                            raise TimeoutError(f"等待记忆文件锁超时: {path}")
+                        time.sleep(0.01)
+                self._record_wait(started)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+        finally:
+            thread_lock.release()
+
+    def _record_wait(self, started: float) -> None:
+        waited = (time.monotonic() - started) * 1000
+        if waited > self.lock_wait_ms_max:
+            self.lock_wait_ms_max = round(waited, 2)
+
+    def read(self, path: Path) -> Tuple[Optional[bytes], Optional[str]]:
+        """返回 (内容, 版本)；文件不存在时为 (None, None)"""
+        key = str(path)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self._cache.pop(key, None)
+            return None, None
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] == stamp:
+            self.cache_hits += 1
+            return cached[1], cached[2]
+        self.cache_misses += 1
+        with open(path, "rb") as f:
+            data = f.read()
+        version = content_version(data)
+        self._cache[key] = (stamp, data, version)
+        return data, version
+
+    def _write(self, path: Path, data: bytes) -> str:
+        """写临时文件 + fsync + os.replace（调用方需持有锁）"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with open(tmp, "wb") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        finally:
+            if tmp.exists():
+                tmp.unlink()
+        st = os.stat(path)
+        version = content_version(data)
+        self._cache[str(path)] = ((st.st_mtime_ns, st.st_size, st.st_ino), data, version)
+        self.writes += 1
+        return version
+
+    def compare_and_swap(self, path: Path, expected_version: Optional[str], data: bytes) -> str:
+        """当前版本等于 expected_version（None 表示文件必须不存在）时写入，返回新版本"""
+        with self.lock(path):
+            _, current = self.read(path)
+            if current != expected_version:
+                self.conflicts += 1
+                raise MemoryConflict(str(path), expected_version, current)
+            return self._write(path, data)
+
+    def update(self, path: Path, change: Callable[[Optional[str]], str]) -> str:
+        """在锁内读取当前文本、调用 change 生成新文本并原子写入，返回新版本"""
+        with self.lock(path):
+            data, _ = self.read(path)
+            text = change(data.decode("utf-8") if data is not None else None)
+            return self._write(path, text.encode("utf-8"))
+
+    def append(self, path: Path, text: str) -> str:
+        def _append(current: Optional[str]) -> str:
+            if not current:
+                return text
+            return current + ("" if current.endswith("\n") else "\n") + text
+
+        return self.update(path, _append)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.cache_hits + self.cache_misses
+        return {
+            "cross_process_lock": _HAS_FCNTL,
+            "cached_files": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "hit_ratio": round(self.cache_hits / lookups, 3) if lookups else None,
+            "writes": self.writes,
+            "conflicts": self.conflicts,
+            "lock_wait_ms_max": self.lock_wait_ms_max,
+        }
+
+
+class _EditFailed(Exception):
+    pass
+
+
+class MemoryBackend(FilesystemBackend):
+    """/memories/ 路由：读走 MemoryStore 缓存，写 / 编辑在锁内原子完成（异步接口经 to_thread 调用同步方法，同样覆盖）"""
+
+    def __init__(self, root_dir: str, store: "MemoryStore") -> None:
+        super().__init__(root_dir=root_dir, virtual_mode=True)
+        self.store = store
+
+    def read(self, file_path: str, offset: int = 0, limit: int = 2000) -> str:
+        with span("memory.read", path=file_path):
+            try:
+                data, _ = self.store.read(self._resolve_path(file_path))
+                if data is None:
+                    return f"Error: File '{file_path}' not found"
+                content = data.decode("utf-8")
+            except (OSError, UnicodeDecodeError) as e:
+                return f"Error reading file '{file_path}': {e}"
+            empty_msg = check_empty_content(content)
+            if empty_msg:
+                return empty_msg
+            lines = content.splitlines()
+            if offset >= len(lines):
+                return f"Error: Line offset {offset} exceeds file length ({len(lines)} lines)"
+            return format_content_with_line_numbers(lines[offset:offset + limit], start_line=offset + 1)
+
+    def download_files(self, paths: List[str]) -> List[FileDownloadResponse]:
+        with span("memory.read", path=",".join(paths)):
+            responses = []
+            for path in paths:
+                try:
+                    data, _ = self.store.read(self._resolve_path(path))
+                except IsADirectoryError:
+                    responses.append(FileDownloadResponse(path=path, content=None, error="is_directory"))
+                    continue
+                except PermissionError:
+                    responses.append(FileDownloadResponse(path=path, content=None, error="permission_denied"))
+                    continue
+                except ValueError:
+                    responses.append(FileDownloadResponse(path=path, content=None, error="invalid_path"))
+                    continue
+                if data is None:
+                    responses.append(FileDownloadResponse(path=path, content=None, error="file_not_found"))
+                else:
+                    responses.append(FileDownloadResponse(path=path, content=data, error=None))
+            return responses
+
+    def write(self, file_path: str, content: str) -> WriteResult:
+        with span("memory.write", path=file_path):
+            try:
+                self.store.compare_and_swap(self._resolve_path(file_path), None, content.encode("utf-8"))
+            except MemoryConflict:
+                return WriteResult(error=f"Cannot write to {file_path} because it already exists. Read and then make an edit, or write to a new path.")
+            except (OSError, TimeoutError, UnicodeEncodeError, ValueError) as e:
+                return WriteResult(error=f"Error writing file '{file_path}': {e}")
+            return WriteResult(path=file_path, files_update=None)
+
+    def edit(self, file_path: str, old_string: str, new_string: str, replace_all: bool = False) -> EditResult:
+        occurrences = [0]
+
+        def _replace(current: Optional[str]) -> str:
+            if current is None:
+                raise _EditFailed(f"Error: File '{file_path}' not found")
+            result = perform_string_replacement(current, old_string, new_string, replace_all)
+            if isinstance(result, str):
+                raise _EditFailed(result)
+            occurrences[0] = int(result[1])
+            return result[0]
+
+        with span("memory.write", path=file_path):
+            try:
+                # 读取与替换都在锁内：并发编辑串行执行，后到的编辑基于最新内容（旧内容已不存在时报错而不是覆盖）
+                self.store.update(self._resolve_path(file_path), _replace)
+            except _EditFailed as e:
+                return EditResult(error=str(e))
+            except (OSError, TimeoutError, UnicodeDecodeError, UnicodeEncodeError, ValueError) as e:
+                return EditResult(error=f"Error editing file '{file_path}': {e}")
+            return EditResult(path=file_path, files_update=None, occurrences=occurrences[0])
+
+
+_store: Optional[MemoryStore] = None
+_store_key: Optional[Tuple[Any, ...]] = None
+_store_lock = threading.Lock()
+
+
+def get_memory_store(config: Optional[Dict[str, Any]] = None) -> MemoryStore:
+    """返回进程级 MemoryStore（读缓存在 Agent 重建之间保留）"""
+    global _store, _store_key
+    config = config or {}
+    settings = config.get("memory_store") if isinstance(config.get("memory_store"), dict) else {}
+    key = (settings.get("lock_dir"), float(settings.get("lock_timeout", 10)))
+    with _store_lock:
+        if _store is None or _store_key != key:
+            _store = MemoryStore(lock_dir=key[0], lock_timeout=key[1])
+            _store_key = key
+        return _store
+
+
+def memory_store_stats() -> Dict[str, Any]:
+    store = _store
+    return store.stats() if store is not None else {"enabled": False}
@@ -0,0 +1,343 @@
+"""多模型路由 - 按步骤选择模型档位：ReAct 的 tool 选择轮走低延迟模型，最终答案走大模型（默认关闭）
+
+config.json 格式:
+{
+  "model_routing": {
+    "enabled": false,
+    "escalate_final": false,    # 为 true 时，router 档走满 router_steps 步后，拿到 tool 结果的下一步直接交给 final 档
+    "router_steps": 1,          # 每条用户消息之后由 router 档完成的步骤数（escalate_final 为 true 时生效）
+    "log": true,                # 每次路由决策打印一行（档位 / 模型 / 耗时 / tokens）
+    "tiers": {
+      "router": {"name": "doubao-seed-1-6-flash-250828"},
+      "worker": {"name": "doubao-seed-1-6-flash-250828"},
+      "summarizer": {"name": "doubao-seed-1-6-flash-250828"},
+      "final": {"name": "doubao-seed-1-8-251228", "base_url": "https://ark.cn-beijing.volces.com/api/v3", "api_key": "..."}
+    }
+  }
+}
+
+档位:
+- router：主 Agent 的步骤默认由 router 生成（选择 / 调用 tools，或直接回答）；
+- final：开启 escalate_final 时，每条用户消息之后的前 router_steps 步走 router，此后最后一条消息为 tool 结果的步骤
+  （汇总结果 / 继续调查）在调用前就交给 final；档位在调用前决定，每一步只生成一次，router 出错时该步回退到 final；
+- worker：subagent（task tool）与 deepagents 内置的默认模型；
+- summarizer：上下文摘要（context.enabled）与 /enrich/batch 的总结。
+每个档位可以只写模型名（字符串），也可以写 name / base_url / api_key / accesscode；
+未写的字段继承 config.model，base_url / api_key 未写时使用 OPENAI_BASE_URL / OPENAI_API_KEY。
+所有档位共用 model.http 连接池。未配置的档位依次回退: router → final，worker → router，summarizer → worker，final → config.model。
+"""
+
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from langchain.agents.middleware import AgentMiddleware, ModelResponse
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.errors import GraphBubbleUp
+
+from tracing import LLM_ROUTES, LLM_TIER_SECONDS, LLM_TIER_TOKENS, span, usage_of
+
+TIERS = ("router", "worker", "summarizer", "final")
+# 未配置的档位回退到的档位（final 回退到 config.model）
+_FALLBACK = {"router": "final", "worker": "router", "summarizer": "worker"}
+
+_DEFAULTS: Dict[str, Any] = {
+    "enabled": False,
+    "escalate_final": False,
+    "router_steps": 1,
+    "log": True,
+    "tiers": {},
+}
+
+
+def routing_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    section = config.get("model_routing") if isinstance(config.get("model_routing"), dict) else {}
+    return {key: section.get(key, default) for key, default in _DEFAULTS.items()}
+
+
+def tier_configs(config: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """返回各档位的完整模型配置（已继承 config.model 并按回退规则补齐）"""
+    base = config.get("model") if isinstance(config.get("model"), dict) else {}
+    tiers = routing_settings(config)["tiers"]
+    tiers = tiers if isinstance(tiers, dict) else {}
+    resolved: Dict[str, Dict[str, Any]] = {}
+    for tier in ("final", "router", "worker", "summarizer"):
+        spec = tiers.get(tier)
+        if isinstance(spec, str):
+            spec = {"name": spec}
+        if isinstance(spec, dict) and spec.get("name"):
+            # 连接池 / 网关是进程级单例，各档位不能各自指定 http / endpoints 参数（可用 base_url 绕过网关）
+            resolved[tier] = {**base, **{k: v for k, v in spec.items() if k not in ("http", "endpoints", "gateway")}}
+        elif tier in _FALLBACK:
+            resolved[tier] = resolved[_FALLBACK[tier]]
+        else:
+            resolved[tier] = dict(base)
+    return resolved
+
+
+class _TierStats(BaseCallbackHandler):
+    """挂在各档位模型上的回调：统计该档位所有调用（含 subagent / 摘要）的耗时与 tokens"""
+
+    run_inline = True
+
+    def __init__(self, tier: str, model_name: str) -> None:
+        self.tier = tier
+        self.model_name = model_name
+        self._lock = threading.Lock()
+        self._started: Dict[Any, float] = {}
+        self.calls = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: Any, **kwargs: Any) -> None:
+        self._started[run_id] = time.perf_counter()
+
+    def on_llm_end(self, response: Any, *, run_id: Any, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        usage = usage_of(response)
+        with self._lock:
+            self.calls += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+            self.input_tokens += usage["input_tokens"]
+            self.output_tokens += usage["output_tokens"]
+        LLM_TIER_SECONDS.observe(seconds, tier=self.tier, status="ok")
+        for kind in ("input_tokens", "output_tokens"):
+            if usage[kind]:
+                LLM_TIER_TOKENS.inc(usage[kind], tier=self.tier, type=kind.split("_")[0])
+
+    def on_llm_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        started = self._started.pop(run_id, None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        with self._lock:
+            self.calls += 1
+            self.errors += 1
+            self.total_seconds += seconds
+            self.max_seconds = max(self.max_seconds, seconds)
+        LLM_TIER_SECONDS.observe(seconds, tier=self.tier, status="error")
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "calls": self.calls,
+                "errors": self.errors,
+                "avg_ms": round(self.total_seconds / self.calls * 1000, 1) if self.calls else None,
+                "max_ms": round(self.max_seconds * 1000, 1),
+                "input_tokens": self.input_tokens,
+                "output_tokens": self.output_tokens,
+            }
+
+
+class ModelTiers:
+    """按档位构建的 chat model；配置相同的档位共用底层客户端，各档位是带独立统计回调的副本"""
+
+    def __init__(self, config: Dict[str, Any], factory: Callable[[Dict[str, Any], Dict[str, Any]], Any]) -> None:
+        self.configs = tier_configs(config)
+        self._keys = {tier: json.dumps(self.configs[tier], sort_keys=True, default=str) for tier in TIERS}
+        built: Dict[str, Any] = {}
+        self.models: Dict[str, Any] = {}
+        self.stats: Dict[str, _TierStats] = {}
+        for tier in TIERS:
+            key = self._keys[tier]
+            if key not in built:
+                built[key] = factory(config, self.configs[tier])
+            base = built[key]
+            name = str(getattr(base, "model_name", None) or getattr(base, "model", None) or self.configs[tier].get("name") or tier)
+            self.stats[tier] = _TierStats(tier, name)
+            self.models[tier] = base.model_copy(update={"callbacks": [*(base.callbacks or []), self.stats[tier]]})
+
+    def same(self, a: str, b: str) -> bool:
+        return self._keys[a] == self._keys[b]
+
+    def model_name(self, tier: str) -> str:
+        return self.stats[tier].model_name
+
+    @property
+    def router(self) -> Any:
+        return self.models["router"]
+
+    @property
+    def worker(self) -> Any:
+        return self.models["worker"]
+
+    @property
+    def summarizer(self) -> Any:
+        return self.models["summarizer"]
+
+    @property
+    def final(self) -> Any:
+        return self.models["final"]
+
+
+def _is_final(response: Any) -> bool:
+    """本步是否给出了最终答案（没有 tool call，或已得到结构化输出）"""
+    if isinstance(response, ModelResponse):
+        if response.structured_response is not None:
+            return True
+        messages = response.result
+    else:
+        messages = [response]
+    return not any(isinstance(m, AIMessage) and m.tool_calls for m in messages)
+
+
+def _last_ai(response: Any) -> Optional[AIMessage]:
+    messages = response.result if isinstance(response, ModelResponse) else [response]
+    for message in reversed(messages):
+        if isinstance(message, AIMessage):
+            return message
+    return None
+
+
+class ModelRoutingMiddleware(AgentMiddleware):
+    """主 Agent 的每一步在调用前选择档位：默认走 router 档，开启 escalate_final 时 tool 结果之后的步骤走 final 档"""
+
+    def __init__(self, tiers: ModelTiers, escalate_final: bool = False, router_steps: int = 1, log: bool = True) -> None:
+        super().__init__()
+        self.tiers = tiers
+        # router 与 final 是同一模型时不需要升级，每一步直接由 final 档完成
+        self.single = tiers.same("router", "final")
+        self.escalate_final = escalate_final and not self.single
+        self.router_steps = max(0, int(router_steps))
+        self.log = log
+        self._lock = threading.Lock()
+        self.decisions: Dict[str, int] = {"tool_calls": 0, "answer": 0, "escalated": 0, "router_error": 0}
+
+    def _decide(self, tier: str, decision: str, seconds: float, response: Any = None, detail: str = "") -> None:
+        with self._lock:
+            self.decisions[decision] += 1
+        LLM_ROUTES.inc(tier=tier, decision=decision)
+        self._log(tier, decision, seconds, response, detail)
+
+    def _log(self, tier: str, decision: str, seconds: float, response: Any = None, detail: str = "") -> None:
+        if not self.log:
+            return
+        ai = _last_ai(response) if response is not None else None
+        usage = (ai.usage_metadata if ai is not None else None) or {}
+        print(
+            f"🔀 {tier}({self.tiers.model_name(tier)}) → {decision}{detail}"
+            f"（{seconds * 1000:.0f}ms，{usage.get('input_tokens', 0)}/{usage.get('output_tokens', 0)} tokens）"
+        )
+
+    def _tier_for(self, messages: Any) -> str:
+        """调用前决定本步的档位：前 router_steps 步走 router，此后紧跟 tool 结果的步骤升级到 final"""
+        if self.single:
+            return "final"
+        if not self.escalate_final or not messages or not isinstance(messages[-1], ToolMessage):
+            return "router"
+        steps = 0
+        for message in reversed(messages):
+            if isinstance(message, HumanMessage):
+                break
+            if isinstance(message, AIMessage):
+                steps += 1
+        return "final" if steps >= self.router_steps else "router"
+
+    def _after_call(self, tier: str, response: Any, seconds: float) -> None:
+        if tier == "final" and not self.single:
+            self._decide("final", "escalated", seconds, response)
+            return
+        ai = _last_ai(response)
+        if _is_final(response):
+            self._decide(tier, "answer", seconds, response)
+        else:
+            names = ", ".join(call["name"] for call in ai.tool_calls) if ai is not None else ""
+            self._decide(tier, "tool_calls", seconds, response, f": {names}")
+
+    def wrap_model_call(self, request, handler):
+        tier = self._tier_for(request.messages)
+        if tier == "router":
+            started = time.perf_counter()
+            try:
+                with span("llm.route", tier="router", model=self.tiers.model_name("router")):
+                    response = handler(request.override(model=self.tiers.router))
+                self._after_call("router", response, time.perf_counter() - started)
+                return response
+            except GraphBubbleUp:
+                raise
+            except Exception as e:
+                # router 档不可用时本步直接由 final 档完成
+                self._decide("router", "router_error", time.perf_counter() - started, detail=f": {type(e).__name__}: {e}")
+        started = time.perf_counter()
+        with span("llm.route", tier="final", model=self.tiers.model_name("final")):
+            response = handler(request.override(model=self.tiers.final))
+        if tier == "final":
+            self._after_call("final", response, time.perf_counter() - started)
+        else:
+            self._log("final", "fallback", time.perf_counter() - started, response)
+        return response
+
+    async def awrap_model_call(self, request, handler):
+        tier = self._tier_for(request.messages)
+        if tier == "router":
+            started = time.perf_counter()
+            try:
+                with span("llm.route", tier="router", model=self.tiers.model_name("router")):
+                    response = await handler(request.override(model=self.tiers.router))
+                self._after_call("router", response, time.perf_counter() - started)
+                return response
+            except GraphBubbleUp:
+                raise
+            except Exception as e:
+                self._decide("router", "router_error", time.perf_counter() - started, detail=f": {type(e).__name__}: {e}")
+        started = time.perf_counter()
+        with span("llm.route", tier="final", model=self.tiers.model_name("final")):
+            response = await handler(request.override(model=self.tiers.final))
+        if tier == "final":
+            self._after_call("final", response, time.perf_counter() - started)
+        else:
+            self._log("final", "fallback", time.perf_counter() - started, response)
+        return response
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            decisions = dict(self.decisions)
+        steps = decisions["tool_calls"] + decisions["answer"] + decisions["escalated"]
+        return {
+            "enabled": True,
+            "escalate_final": self.escalate_final,
+            "router_steps": self.router_steps,
+            "decisions": decisions,
+            # 主 Agent 的步骤中由 router 档直接完成（未升级）的比例
+            "router_share": round((decisions["tool_calls"] + decisions["answer"]) / steps, 3) if steps and not self.single else None,
+            "tiers": {tier: self.tiers.stats[tier].as_dict() for tier in TIERS},
+        }
+
+
+_routing: Optional[ModelRoutingMiddleware] = None
+
+
+def build_model_routing(
+    config: Dict[str, Any],
+    factory: Callable[[Dict[str, Any], Dict[str, Any]], Any],
+) -> Optional[ModelRoutingMiddleware]:
+    """按配置构建各档位模型与路由 middleware（随 Agent 重建），未启用时返回 None"""
+    global _routing
+    settings = routing_settings(config)
+    if not settings["enabled"]:
+        _routing = None
+        return None
+    tiers = ModelTiers(config, factory)
+    _routing = ModelRoutingMiddleware(
+        tiers,
+        escalate_final=bool(settings["escalate_final"]),
+        router_steps=int(settings["router_steps"]),
+        log=bool(settings["log"]),
+    )
+    print("🔀 多模型路由: " + "，".join(f"{tier}={tiers.model_name(tier)}" for tier in TIERS))
+    return _routing
+
+
+def model_routing_stats() -> Dict[str, Any]:
+    routing = _routing
+    return routing.stats() if routing is not None else {"enabled": False}
@@ -0,0 +1,251 @@
+"""Skills / MCP tools 相关性预筛 - 按当前用户消息只列出最相关的 skills 和 tools（默认关闭）
+
+config.json 格式:
+{
+  "relevance": {
+    "enabled": false,
+    "top_k_skills": 3,
+    "top_k_tools": 8,
+    "min_score": 1.0,           # 最高分低于该值时视为没有把握，回退到完整列表
+    "always_tools": []          # 始终绑定的 MCP tools
+  }
+}
+
+- 离线的 BM25 词法检索：skill 文档 = name + frontmatter description，tool 文档 = 名称（按 _ 拆词）+ description；
+  中文按字的 bigram 切分，英文 / 数字按词切分，不需要任何模型或网络。
+- 每次模型调用用最近一条用户消息检索：system prompt 的 skills 列表只保留 top_k_skills 个，
+  MCP tools 只绑定 top_k_tools 个 + always_tools + 本会话已经调用过的 tools；deepagents 内置 tools（文件 / todo / task）不受影响。
+- 没有用户消息、最高分低于 min_score 或 tool_choice 指定了 tool 时回退到完整列表。
+"""
+
+import math
+import re
+import threading
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from langchain.agents.middleware import AgentMiddleware, ModelRequest
+from langchain_core.messages import AIMessage, HumanMessage
+
+_WORD = re.compile(r"[a-z0-9]+|[一-鿿]+")
+_CJK = re.compile(r"[一-鿿]")
+
+_DEFAULTS: Dict[str, Any] = {
+    "enabled": False,
+    "top_k_skills": 3,
+    "top_k_tools": 8,
+    "min_score": 1.0,
+    "always_tools": [],
+}
+
+
+def relevance_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    section = config.get("relevance") if isinstance(config.get("relevance"), dict) else {}
+    return {key: section.get(key, default) for key, default in _DEFAULTS.items()}
+
+
+def tokenize(text: str) -> List[str]:
+    """英文 / 数字按词（snake_case、kebab-case 拆开），中文按字 bigram（单字词保留原字）"""
+    tokens: List[str] = []
+    for word in _WORD.findall((text or "").lower()):
+        if _CJK.match(word):
+            if len(word) == 1:
+                tokens.append(word)
+            else:
+                tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+class BM25:
+    """最小 BM25 实现（Okapi，k1=1.5，b=0.75）"""
+
+    def __init__(self, documents: Sequence[str], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1, self.b = k1, b
+        self._docs = [Counter(tokenize(doc)) for doc in documents]
+        self._lengths = [sum(doc.values()) for doc in self._docs]
+        self._avg = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        df: Counter = Counter()
+        for doc in self._docs:
+            df.update(doc.keys())
+        n = len(self._docs)
+        self._idf = {term: math.log(1 + (n - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+
+    def scores(self, query: str) -> List[float]:
+        terms = [t for t in set(tokenize(query)) if t in self._idf]
+        result = []
+        for doc, length in zip(self._docs, self._lengths):
+            score = 0.0
+            norm = self.k1 * (1 - self.b + self.b * length / self._avg) if self._avg else self.k1
+            for term in terms:
+                tf = doc.get(term)
+                if tf:
+                    score += self._idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            result.append(score)
+        return result
+
+
+def _top(names: Sequence[str], scores: Sequence[float], k: int, min_score: float) -> Optional[List[str]]:
+    """返回得分最高的 k 个名称；最高分低于 min_score 时返回 None（表示回退）"""
+    if not names or max(scores) < min_score:
+        return None
+    ranked = sorted(zip(scores, range(len(names))), key=lambda item: (-item[0], item[1]))
+    return [names[i] for score, i in ranked[:k] if score > 0]
+
+
+class RelevanceFilter:
+    """skills 与 MCP tools 的检索器；skills 索引变化时重建"""
+
+    def __init__(
+        self,
+        tools: Iterable[Any],
+        skills: Optional[Callable[[], List[Dict[str, Any]]]] = None,
+        top_k_skills: int = 3,
+        top_k_tools: int = 8,
+        min_score: float = 1.0,
+        always_tools: Iterable[str] = (),
+    ) -> None:
+        tools = list(tools)
+        self.tool_names = [t.name for t in tools]
+        self._tool_index = BM25([f"{t.name.replace('_', ' ')} {t.description or ''}" for t in tools])
+        self._skills = skills
+        self._skill_source: Optional[List[Dict[str, Any]]] = None
+        self._skill_names: List[str] = []
+        self._skill_index = BM25([])
+        self.top_k_skills = int(top_k_skills)
+        self.top_k_tools = int(top_k_tools)
+        self.min_score = float(min_score)
+        self.always_tools = set(always_tools)
+        self._lock = threading.Lock()
+        self._recent: "OrderedDict[str, Tuple[Optional[List[str]], Optional[List[str]]]]" = OrderedDict()
+        self.queries = 0
+        self.skill_fallbacks = 0
+        self.tool_fallbacks = 0
+        self.kept_skills = 0
+        self.kept_tools = 0
+
+    def _skill_state(self, skills: List[Dict[str, Any]]) -> None:
+        # SkillsIndex 在内容变化时才替换列表对象，按对象身份判断是否需要重建
+        if skills is not self._skill_source:
+            self._skill_names = [s["name"] for s in skills]
+            self._skill_index = BM25([f"{s['name'].replace('-', ' ')} {s['description']}" for s in skills])
+            self._skill_source = skills
+            self._recent.clear()
+
+    def select(self, query: str) -> Tuple[Optional[List[str]], Optional[List[str]]]:
+        """返回 (skill 名称列表, MCP tool 名称列表)；None 表示回退到完整列表"""
+        with self._lock:
+            if self._skills is not None:
+                self._skill_state(self._skills())
+            cached = self._recent.get(query)
+            if cached is not None:
+                self._recent.move_to_end(query)
+                return cached
+            skills = _top(self._skill_names, self._skill_index.scores(query), self.top_k_skills, self.min_score) if self._skill_names else None
+            tools = _top(self.tool_names, self._tool_index.scores(query), self.top_k_tools, self.min_score)
+            self.queries += 1
+            if skills is None:
+                self.skill_fallbacks += 1
+            else:
+                self.kept_skills += len(skills)
+            if tools is None:
+                self.tool_fallbacks += 1
+            else:
+                self.kept_tools += len(tools)
+            self._recent[query] = (skills, tools)
+            if len(self._recent) > 256:
+                self._recent.popitem(last=False)
+            return skills, tools
+
+    def select_skills(self, messages: Sequence[Any]) -> Optional[List[str]]:
+        """供 IndexedSkillsMiddleware 使用：按最近一条用户消息选择 skills"""
+        query = last_user_text(messages)
+        return self.select(query)[0] if query else None
+
+    def stats(self) -> Dict[str, Any]:
+        filtered_skills = self.queries - self.skill_fallbacks
+        filtered_tools = self.queries - self.tool_fallbacks
+        return {
+            "enabled": True,
+            "skills": len(self._skill_names),
+            "tools": len(self.tool_names),
+            "queries": self.queries,
+            "skill_fallbacks": self.skill_fallbacks,
+            "tool_fallbacks": self.tool_fallbacks,
+            "avg_skills_kept": round(self.kept_skills / filtered_skills, 2) if filtered_skills else None,
+            "avg_tools_kept": round(self.kept_tools / filtered_tools, 2) if filtered_tools else None,
+        }
+
+
+def last_user_text(messages: Sequence[Any]) -> str:
+    for message in reversed(messages):
+        if isinstance(message, HumanMessage):
+            content = message.content
+            if isinstance(content, list):
+                return " ".join(b.get("text", "") if isinstance(b, dict) else str(b) for b in content)
+            return str(content)
+    return ""
+
+
+def _called_tools(messages: Sequence[Any]) -> Set[str]:
+    return {call["name"] for m in messages if isinstance(m, AIMessage) for call in m.tool_calls}
+
+
+class RelevanceFilterMiddleware(AgentMiddleware):
+    """每次模型调用只绑定与当前用户消息相关的 MCP tools（skills 列表由 IndexedSkillsMiddleware 按同一检索结果过滤）"""
+
+    def __init__(self, relevance: RelevanceFilter) -> None:
+        super().__init__()
+        self.relevance = relevance
+        self._mcp_tools = set(relevance.tool_names)
+
+    def _filter(self, request: ModelRequest) -> ModelRequest:
+        if request.tool_choice not in (None, "auto"):
+            return request
+        query = last_user_text(request.messages)
+        if not query:
+            return request
+        _, selected = self.relevance.select(query)
+        if selected is None:
+            return request
+        keep = set(selected) | self.relevance.always_tools | _called_tools(request.messages)
+        tools = [t for t in request.tools if getattr(t, "name", None) not in self._mcp_tools or t.name in keep]
+        return request.override(tools=tools)
+
+    def wrap_model_call(self, request, handler):
+        return handler(self._filter(request))
+
+    async def awrap_model_call(self, request, handler):
+        return await handler(self._filter(request))
+
+
+_filter: Optional[RelevanceFilter] = None
+
+
+def build_relevance_filter(
+    config: Dict[str, Any],
+    tools: Iterable[Any],
+    skills: Optional[Callable[[], List[Dict[str, Any]]]] = None,
+) -> Optional[RelevanceFilter]:
+    """按配置构建检索器（随 Agent 重建），未启用时返回 None"""
+    global _filter
+    settings = relevance_settings(config)
+    if not settings["enabled"]:
+        _filter = None
+        return None
+    _filter = RelevanceFilter(
+        tools,
+        skills=skills,
+        top_k_skills=settings["top_k_skills"],
+        top_k_tools=settings["top_k_tools"],
+        min_score=settings["min_score"],
+        always_tools=settings["always_tools"] or [],
+    )
+    print(f"🎯 相关性预筛: top {settings['top_k_skills']} skills / top {settings['top_k_tools']} tools（{len(_filter.tool_names)} 个 MCP tools）")
+    return _filter
+
+
+def relevance_stats() -> Dict[str, Any]:
+    relevance = _filter
+    return relevance.stats() if relevance is not None else {"enabled": False}
@@ -0,0 +1,269 @@
+"""大 tool 结果落盘 - 超过阈值的结果按行写入 /results/，消息中只保留结构与行数预览（默认关闭）
+
+config.json 格式:
+{
+  "results": {
+    "enabled": false,
+    "dir": "./.cache/results",      # /results/ 路由对应的本地目录
+    "min_chars": 50000,             # tool 输出超过该字符数时落盘
+    "preview_rows": 5,              # 预览中展示的记录数
+    "retention_hours": 24           # 构建 Agent 时清理超过该时长未写入也未读取的会话目录
+  }
+}
+
+- 落盘路径: <dir>/<thread_id>/<tool_call_id>.jsonl，模型看到的是 /results/<tool_call_id>.jsonl：
+  /results/ 路由按请求的 thread_id 只指向当前会话的目录，其他会话的结果不可见（ls / read / grep 都一样）。
+  JSON 输出中的记录列表（顶层数组，或对象中最长的数组字段，如 run_splunk_query 的 results）
+  逐条写成一行 JSON，其余字段放在预览的 meta 中；非 JSON 输出按原文逐行写入 .txt。
+- 写入是逐行流式进行的，结果不会进入消息列表 / checkpoint；
+  /results/ 路由的 read_file 也按行流式读取，分页查看时只读取请求的行。
+- 模型拿到的是字段 schema（字段名与类型）、总行数、前几条记录和分页方式，
+  之后用 read_file(path, offset, limit) / grep 按需查看。
+"""
+
+import asyncio
+import hashlib
+import itertools
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from langchain.agents.middleware import AgentMiddleware
+from langchain_core.messages import ToolMessage
+from deepagents.backends import FilesystemBackend
+from deepagents.backends.utils import format_content_with_line_numbers, sanitize_tool_call_id
+
+from context_window import TOOLS_EXCLUDED_FROM_EVICTION, content_text
+
+ROUTE = "/results/"
+
+_DEFAULTS: Dict[str, Any] = {
+    "enabled": False,
+    "dir": "./.cache/results",
+    "min_chars": 50000,
+    "preview_rows": 5,
+    "retention_hours": 24,
+}
+
+_UNSAFE = re.compile(r"[^A-Za-z0-9_-]")
+
+
+def result_settings(config: Dict[str, Any]) -> Dict[str, Any]:
+    section = config.get("results") if isinstance(config.get("results"), dict) else {}
+    return {key: section.get(key, default) for key, default in _DEFAULTS.items()}
+
+
+def _thread_dir(configurable: Dict[str, Any]) -> str:
+    """会话目录名：只含 [A-Za-z0-9_-] 且不超过 64 字符的 thread_id 原样使用，其他加哈希后缀（不同会话不会共用目录）"""
+    thread = str(configurable.get("thread_id") or "default")
+    if len(thread) <= 64 and not _UNSAFE.search(thread):
+        return thread
+    digest = hashlib.sha256(thread.encode("utf-8")).hexdigest()[:16]
+    return f"{_UNSAFE.sub('_', thread)[:64]}.{digest}"
+
+
+def _type_name(value: Any) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, (int, float)):
+        return "number"
+    if isinstance(value, str):
+        return "string"
+    return "array" if isinstance(value, list) else "object"
+
+
+def _split_records(data: Any) -> Tuple[Optional[str], List[Any], Dict[str, Any]]:
+    """返回 (记录所在字段, 记录列表, 其余字段)；顶层数组的字段名为 None"""
+    if isinstance(data, list):
+        return None, data, {}
+    if isinstance(data, dict):
+        lists = [(k, v) for k, v in data.items() if isinstance(v, list)]
+        if lists:
+            key, records = max(lists, key=lambda item: len(item[1]))
+            return key, records, {k: v for k, v in data.items() if k != key}
+    return None, [], {}
+
+
+class _ResultFilesBackend(FilesystemBackend):
+    """/results/ 路由：read 按行流式读取，不把整个结果文件载入内存"""
+
+    def read(self, file_path: str, offset: int = 0, limit: int = 2000) -> str:
+        resolved_path = self._resolve_path(file_path)
+        if not resolved_path.is_file():
+            return f"Error: File '{file_path}' not found"
+        try:
+            with open(resolved_path, "r", encoding="utf-8") as f:
+                lines = [line.rstrip("\n") for line in itertools.islice(f, offset, offset + limit)]
+        except (OSError, UnicodeDecodeError) as e:
+            return f"Error reading file '{file_path}': {e}"
+        if not lines:
+            return f"Error: Line offset {offset} exceeds file length"
+        try:
+            # 刷新访问时间：正在分页查看的结果不会被 sweep_results 当作过期清理（atime 可能因 noatime 不更新）
+            os.utime(resolved_path)
+        except OSError:
+            pass
+        return format_content_with_line_numbers(lines, start_line=offset + 1)
+
+
+class ResultSpillMiddleware(AgentMiddleware):
+    """超过 min_chars 的 tool 输出逐行写入 <dir>/<thread>/<call>.jsonl（/results/<call>.jsonl），返回 schema + 行数预览"""
+
+    def __init__(self, root_dir: str, min_chars: int = 50000, preview_rows: int = 5) -> None:
+        super().__init__()
+        self.root_dir = Path(root_dir)
+        self.min_chars = int(min_chars)
+        self.preview_rows = int(preview_rows)
+        self.spilled = 0
+        self.spilled_rows = 0
+        self.spilled_bytes = 0
+
+    def routes_for(self, configurable: Dict[str, Any]) -> Dict[str, FilesystemBackend]:
+        """/results/ 路由只指向当前会话的目录"""
+        directory = self.root_dir / _thread_dir(configurable)
+        return {ROUTE: _ResultFilesBackend(root_dir=str(directory), virtual_mode=True)}
+
+    def _target(self, request: Any, result: ToolMessage, suffix: str) -> Tuple[str, Path]:
+        configurable = (getattr(request.runtime, "config", None) or {}).get("configurable") or {}
+        call = f"{sanitize_tool_call_id(result.tool_call_id)}-{uuid.uuid4().hex[:6]}{suffix}"
+        return f"{ROUTE}{call}", self.root_dir / _thread_dir(configurable) / call
+
+    def _write_lines(self, path: Path, lines: Iterable[str]) -> Tuple[int, int]:
+        """逐行写入临时文件后 rename，返回 (行数, 字节数)"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(path.name + ".tmp")
+        count = 0
+        with open(tmp, "w", encoding="utf-8") as f:
+            for line in lines:
+                f.write(line)
+                f.write("\n")
+                count += 1
+            size = f.tell()
+        os.replace(tmp, path)
+        return count, size
+
+    def _spill(self, request: Any, result: Any) -> Any:
+        if not isinstance(result, ToolMessage) or result.name in TOOLS_EXCLUDED_FROM_EVICTION:
+            return result
+        text = content_text(result.content)
+        if len(text) <= self.min_chars:
+            return result
+        try:
+            data = json.loads(text)
+        except ValueError:
+            data = None
+        field, records, meta = _split_records(data)
+        del text
+        try:
+            if records:
+                virtual_path, real_path = self._target(request, result, ".jsonl")
+                schema: Dict[str, set] = {}
+
+                def rows() -> Iterable[str]:
+                    for record in records:
+                        if isinstance(record, dict):
+                            for key, value in record.items():
+                                schema.setdefault(key, set()).add(_type_name(value))
+                        yield json.dumps(record, ensure_ascii=False, default=str)
+
+                count, size = self._write_lines(real_path, rows())
+                preview = self._describe_records(virtual_path, field, count, size, schema, records, meta)
+            else:
+                virtual_path, real_path = self._target(request, result, ".txt")
+                count, size = self._write_lines(real_path, content_text(result.content).splitlines())
+                preview = self._describe_text(virtual_path, count, size, result)
+        except OSError as e:
+            print(f"⚠️  tool 结果落盘失败（{e}），保留原始输出")
+            return result
+        self.spilled += 1
+        self.spilled_rows += count
+        self.spilled_bytes += size
+        return ToolMessage(content=preview, tool_call_id=result.tool_call_id, name=result.name, status=result.status)
+
+    def _describe_records(
+        self,
+        path: str,
+        field: Optional[str],
+        count: int,
+        size: int,
+        schema: Dict[str, set],
+        records: List[Any],
+        meta: Dict[str, Any],
+    ) -> str:
+        source = f"字段 {field} 中的 " if field else ""
+        lines = [f"[结果较大（{size} 字节），{source}{count} 条记录已写入 {path}，每行一条 JSON 记录]"]
+        if schema:
+            lines.append("schema: " + ", ".join(f"{k}: {'|'.join(sorted(v))}" for k, v in schema.items()))
+        if meta:
+            lines.append("meta: " + json.dumps(meta, ensure_ascii=False, default=str)[:1000])
+        lines.append(f"用 read_file(\"{path}\", offset=N, limit=M) 分页查看第 N+1 行起的 M 条记录，或用 grep 搜索。")
+        lines.append(f"前 {min(count, self.preview_rows)} 条:")
+        for record in records[: self.preview_rows]:
+            lines.append(json.dumps(record, ensure_ascii=False, default=str)[:500])
+        return "\n".join(lines)
+
+    def _describe_text(self, path: str, count: int, size: int, result: ToolMessage) -> str:
+        head = content_text(result.content).splitlines()[: self.preview_rows]
+        lines = [f"[结果较大（{size} 字节，{count} 行），已写入 {path}]"]
+        lines.append(f"用 read_file(\"{path}\", offset=N, limit=M) 分页查看，或用 grep 搜索。")
+        lines.append(f"前 {len(head)} 行:")
+        lines.extend(line[:500] for line in head)
+        return "\n".join(lines)
+
+    def wrap_tool_call(self, request, handler):
+        return self._spill(request, handler(request))
+
+    async def awrap_tool_call(self, request, handler):
+        result = await handler(request)
+        if not isinstance(result, ToolMessage) or len(content_text(result.content)) <= self.min_chars:
+            return result
+        # 解析与写文件放到线程池，避免大结果阻塞事件循环
+        return await asyncio.to_thread(self._spill, request, result)
+
+
+def _last_used(directory: Path) -> float:
+    """会话目录最近一次写入或读取的时间：目录本身与其中每个文件的 max(st_mtime, st_atime)"""
+    latest = directory.stat().st_mtime
+    for path in directory.iterdir():
+        try:
+            st = path.stat()
+        except OSError:
+            continue
+        latest = max(latest, st.st_mtime, st.st_atime)
+    return latest
+
+
+def sweep_results(root_dir: str, retention_hours: float) -> int:
+    """删除超过 retention_hours 未写入也未读取的会话目录，返回删除数"""
+    root = Path(root_dir)
+    if not root.is_dir() or retention_hours <= 0:
+        return 0
+    cutoff = time.time() - retention_hours * 3600
+    removed = 0
+    for entry in root.iterdir():
+        try:
+            if entry.is_dir() and _last_used(entry) < cutoff:
+                shutil.rmtree(entry, ignore_errors=True)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+def build_result_spill(config: Dict[str, Any]) -> Optional[ResultSpillMiddleware]:
+    """返回 middleware（其 routes_for() 按会话生成 /results/ 路由）；未开启时为 None"""
+    settings = result_settings(config)
+    if not settings["enabled"]:
+        return None
+    root_dir = os.path.abspath(settings["dir"])
+    os.makedirs(root_dir, exist_ok=True)
+    removed = sweep_results(root_dir, float(settings["retention_hours"]))
+    print(f"📦 大结果落盘: > {settings['min_chars']} 字符写入 {root_dir}" + (f"（清理过期会话目录 {removed} 个）" if removed else ""))
+    return ResultSpillMiddleware(root_dir, min_chars=settings["min_chars"], preview_rows=settings["preview_rows"])
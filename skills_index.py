@@ -0,0 +1,277 @@
+"""Skills 索引 - 只解析 SKILL.md frontmatter，缓存到索引文件，按 mtime 增量更新
+
+config.json 格式:
+{
+  "skills_index": {
+    "enabled": true,
+    "cache_path": "./.cache/skills_index.json",
+    "check_interval": 5                 # 两次 mtime 检查的最小间隔（秒）
+  }
+}
+
+deepagents 自带的 SkillsMiddleware 在每个新会话开始时下载并解析全部 SKILL.md；
+这里改为进程级索引：
+- 每个 skill 只读取 frontmatter（name / description 等），正文不读；
+- 索引（含每个 SKILL.md 的 mtime / size）写入 cache_path，进程重启后只重新解析有变化的文件；
+- 请求路径上最多每 check_interval 秒 stat 一次各 SKILL.md，新增 / 修改 / 删除的 skill 随后生效；
+- skill 正文仍通过 /skills/ 路由由模型按需 read_file，只有被选中的 skill 才会加载正文。
+"""
+
+import json
+import os
+import threading
+import time
+from pathlib import Path, PurePosixPath
+from typing import Any, Callable, Dict, List, Optional
+
+import yaml
+from deepagents.middleware.skills import SkillMetadata, SkillsMiddleware
+from langchain_core.messages import SystemMessage
+
+_INDEX_VERSION = 1
+# frontmatter 之外的内容不读；超过该行数仍未结束的 frontmatter 视为无效
+_MAX_FRONTMATTER_LINES = 200
+# 与 Agent Skills 规范（deepagents 的 MAX_SKILL_DESCRIPTION_LENGTH）一致
+_MAX_DESCRIPTION_CHARS = 1024
+
+
+def append_to_system_message(system_message: Optional[SystemMessage], text: str) -> SystemMessage:
+    """在 system message 末尾追加一段文本（保留原有 content blocks）"""
+    blocks: List[Any] = list(system_message.content_blocks) if system_message else []
+    if blocks:
+        text = f"\n\n{text}"
+    blocks.append({"type": "text", "text": text})
+    return SystemMessage(content=blocks)
+
+
+def _read_frontmatter(path: Path) -> Optional[str]:
+    """只读取 SKILL.md 开头的 --- frontmatter --- 块"""
+    with open(path, "r", encoding="utf-8") as f:
+        if f.readline().strip() != "---":
+            return None
+        lines = []
+        for _ in range(_MAX_FRONTMATTER_LINES):
+            line = f.readline()
+            if not line:
+                return None
+            if line.strip() == "---":
+                return "---\n" + "".join(lines) + "---\n"
+            lines.append(line)
+    return None
+
+
+def _parse_frontmatter(frontmatter: str, skill_path: str) -> Optional[SkillMetadata]:
+    """解析 --- frontmatter --- 为 SkillMetadata；缺少 name / description 或 YAML 无效时返回 None"""
+    try:
+        data = yaml.safe_load(frontmatter.split("\n", 1)[1].rsplit("---", 1)[0])
+    except yaml.YAMLError as e:
+        print(f"⚠️  跳过 {skill_path}: frontmatter 不是有效的 YAML: {e}")
+        return None
+    if not isinstance(data, dict) or not data.get("name") or not data.get("description"):
+        print(f"⚠️  跳过 {skill_path}: frontmatter 缺少 name 或 description")
+        return None
+    allowed_tools = data.get("allowed-tools")
+    return SkillMetadata(
+        name=str(data["name"]),
+        description=str(data["description"]).strip()[:_MAX_DESCRIPTION_CHARS],
+        path=skill_path,
+        metadata=data.get("metadata") or {},
+        license=str(data.get("license") or "").strip() or None,
+        compatibility=str(data.get("compatibility") or "").strip() or None,
+        allowed_tools=str(allowed_tools).split() if allowed_tools else [],
+    )
+
+
+class SkillsIndex:
+    """skills 目录的 frontmatter 索引（线程安全）"""
+
+    def __init__(self, root_dir: str, route: str = "/skills/", cache_path: Optional[str] = None, check_interval: float = 5.0) -> None:
+        self.root_dir = Path(root_dir)
+        self.route = "/" + route.strip("/") + "/"
+        self.cache_path = Path(cache_path) if cache_path else None
+        self.check_interval = float(check_interval)
+        self._lock = threading.Lock()
+        # 目录名 -> {"mtime_ns", "size", "meta"}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._skills: List[SkillMetadata] = []
+        self._checked_at = 0.0
+        self.generation = 0
+        self.parsed = 0
+        self.scans = 0
+        self.last_scan_ms = 0.0
+        self._load_cache()
+        self.refresh(force=True)
+
+    def _load_cache(self) -> None:
+        if self.cache_path is None or not self.cache_path.is_file():
+            return
+        try:
+            data = json.loads(self.cache_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError) as e:
+            print(f"⚠️  skills 索引缓存读取失败，重新构建: {e}")
+            return
+        if data.get("version") == _INDEX_VERSION and data.get("root") == str(self.root_dir) and data.get("route") == self.route:
+            self._entries = data.get("entries") or {}
+
+    def _save_cache(self) -> None:
+        if self.cache_path is None:
+            return
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.cache_path.with_name(f"{self.cache_path.name}.{os.getpid()}.tmp")
+            payload = {"version": _INDEX_VERSION, "root": str(self.root_dir), "route": self.route, "entries": self._entries}
+            tmp.write_text(json.dumps(payload, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.cache_path)
+        except OSError as e:
+            print(f"⚠️  skills 索引缓存写入失败: {e}")
+
+    def _parse(self, name: str, path: Path) -> Optional[SkillMetadata]:
+        try:
+            frontmatter = _read_frontmatter(path)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"⚠️  读取 {path} 失败: {e}")
+            return None
+        if frontmatter is None:
+            print(f"⚠️  跳过 {path}: 没有有效的 frontmatter")
+            return None
+        self.parsed += 1
+        return _parse_frontmatter(frontmatter, f"{self.route}{name}/SKILL.md")
+
+    def refresh(self, force: bool = False) -> bool:
+        """按 mtime/size 检查 SKILL.md 变化，返回索引是否有更新"""
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.check_interval:
+            return False
+        with self._lock:
+            if not force and now - self._checked_at < self.check_interval:
+                return False
+            started = time.perf_counter()
+            entries: Dict[str, Dict[str, Any]] = {}
+            changed = False
+            try:
+                dirs = sorted(entry.name for entry in os.scandir(self.root_dir) if entry.is_dir())
+            except OSError:
+                dirs = []
+            for name in dirs:
+                path = self.root_dir / name / "SKILL.md"
+                try:
+                    st = path.stat()
+                except OSError:
+                    continue
+                cached = self._entries.get(name)
+                if cached and cached.get("mtime_ns") == st.st_mtime_ns and cached.get("size") == st.st_size:
+                    entries[name] = cached
+                    continue
+                entries[name] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "meta": self._parse(name, path)}
+                changed = True
+            if changed or set(entries) != set(self._entries) or self.generation == 0:
+                self._entries = entries
+                # 同名 skill 以目录顺序中最后一个为准（与 deepagents 一致）
+                by_name: Dict[str, SkillMetadata] = {}
+                for entry in entries.values():
+                    if entry.get("meta"):
+                        by_name[entry["meta"]["name"]] = entry["meta"]
+                self._skills = list(by_name.values())
+                self.generation += 1
+                self._save_cache()
+                changed = True
+            self._checked_at = time.monotonic()
+            self.scans += 1
+            self.last_scan_ms = round((time.perf_counter() - started) * 1000, 2)
+            return changed
+
+    def skills(self) -> List[SkillMetadata]:
+        self.refresh()
+        return self._skills
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": True,
+            "root": str(self.root_dir),
+            "skills": len(self._skills),
+            "generation": self.generation,
+            "scans": self.scans,
+            "parsed_frontmatter": self.parsed,
+            "last_scan_ms": self.last_scan_ms,
+            "cache_path": str(self.cache_path) if self.cache_path else None,
+        }
+
+
+class IndexedSkillsMiddleware(SkillsMiddleware):
+    """
+    skills 列表来自 SkillsIndex，不在每个会话开始时扫描 / 下载 SKILL.md，也不写入会话状态。
+
+    只使用 SkillsMiddleware 的公开接口（构造参数、system_prompt_template、modify_request），
+    frontmatter 解析与 prompt 中的列表格式在本模块实现，不依赖 deepagents 的私有函数。
+    """
+
+    def __init__(self, index: SkillsIndex, selector: Optional[Callable[[List[Any]], Optional[List[str]]]] = None) -> None:
+        super().__init__(backend=None, sources=[index.route])
+        self.index = index
+        # 可选：按消息选出相关 skill 名称（relevance.py），返回 None 时列出全部
+        self.selector = selector
+
+    def modify_request(self, request):
+        skills = self.index.skills()
+        if self.selector is not None:
+            names = self.selector(request.messages)
+            if names is not None:
+                skills = [s for s in skills if s["name"] in names]
+        skills_section = self.system_prompt_template.format(
+            skills_locations=self._locations(),
+            skills_list=self._skills_list(skills),
+        )
+        return request.override(system_message=append_to_system_message(request.system_message, skills_section))
+
+    def _locations(self) -> str:
+        name = PurePosixPath(self.index.route.rstrip("/")).name.capitalize()
+        # 与 deepagents 的格式保持一致（单一来源也标注 higher priority），system prompt 不因替换而变化
+        return f"**{name} Skills**: `{self.index.route}` (higher priority)"
+
+    def _skills_list(self, skills: List[SkillMetadata]) -> str:
+        if not skills:
+            return f"(No skills available yet. You can create skills in {self.index.route})"
+        lines = []
+        for skill in skills:
+            lines.append(f"- **{skill['name']}**: {skill['description']}")
+            if skill["allowed_tools"]:
+                lines.append(f"  -> Allowed tools: {', '.join(skill['allowed_tools'])}")
+            lines.append(f"  -> Read `{skill['path']}` for full instructions")
+        return "\n".join(lines)
+
+    def before_agent(self, state, runtime, config):
+        return None
+
+    async def abefore_agent(self, state, runtime, config):
+        return None
+
+
+_index: Optional[SkillsIndex] = None
+_index_key: Optional[str] = None
+_index_lock = threading.Lock()
+
+
+def get_skills_index(skills_path: Path, config: Optional[Dict[str, Any]] = None) -> Optional[SkillsIndex]:
+    """返回进程级 skills 索引；未启用时返回 None。目录与配置不变时 Agent 重建复用同一索引"""
+    global _index, _index_key
+    config = config or {}
+    settings = config.get("skills_index") if isinstance(config.get("skills_index"), dict) else {}
+    if not settings.get("enabled", True):
+        return None
+    key = json.dumps([str(skills_path), settings], sort_keys=True, default=str)
+    with _index_lock:
+        if _index_key != key:
+            started = time.perf_counter()
+            _index = SkillsIndex(
+                str(skills_path),
+                cache_path=settings.get("cache_path", "./.cache/skills_index.json"),
+                check_interval=settings.get("check_interval", 5),
+            )
+            _index_key = key
+            print(f"📚 skills 索引: {len(_index.skills())} 个 skill（解析 {_index.parsed} 个 frontmatter，{(time.perf_counter() - started) * 1000:.1f}ms）")
+        return _index
+
+
+def skills_index_stats() -> Dict[str, Any]:
+    index = _index
+    return index.stats() if index is not None else {"enabled": False}
@@ -0,0 +1,8 @@
+"""测试公共设置：仓库根目录加入 sys.path（模块均为顶层平铺）"""
+
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
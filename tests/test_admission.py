@@ -0,0 +1,154 @@
+"""admission：加权公平排队的放行顺序、用户令牌桶、拒绝时不消耗令牌"""
+
+import asyncio
+import time
+
+import pytest
+
+from admission import AdmissionController, AdmissionRejected, TokenBucket
+
+
+def _controller(**settings):
+    controller = AdmissionController()
+    controller.configure({"max_concurrent": 1, "max_queue": 64, "queue_timeout": 5, **settings})
+    return controller
+
+
+async def _admission_order(controller, requests):
+    """占住唯一的名额后按顺序提交 requests（[(user, cost), ...]），逐个释放，返回放行顺序"""
+    holder = await controller.acquire("holder")
+    order = []
+
+    async def run(label, user, cost):
+        slot = await controller.acquire(user, cost)
+        order.append(label)
+        await asyncio.sleep(0)
+        slot.release()
+
+    tasks = []
+    for label, (user, cost) in enumerate(requests):
+        tasks.append(asyncio.create_task(run(label, user, cost)))
+        await asyncio.sleep(0)
+    holder.release()
+    await asyncio.gather(*tasks)
+    return [requests[label][0] for label in order]
+
+
+def test_single_user_is_fifo():
+    controller = _controller()
+    order = asyncio.run(_admission_order(controller, [("alice", 1)] * 4))
+    assert order == ["alice"] * 4
+    assert controller.stats()["active"] == 0
+
+
+def test_batch_user_does_not_starve_later_user():
+    controller = _controller()
+    order = asyncio.run(_admission_order(controller, [("batch", 1)] * 6 + [("oncall", 1)]))
+    # oncall 最后提交，但只排在 batch 已分得的一个份额之后
+    assert order.index("oncall") <= 2
+
+
+def test_weights_and_cost_share_admissions():
+    controller = _controller(per_user={"weights": {"oncall": 4}})
+    order = asyncio.run(_admission_order(controller, [("bot", 1)] * 8 + [("oncall", 1)] * 8))
+    assert order[:5].count("oncall") >= 3
+
+    controller = _controller()
+    order = asyncio.run(_admission_order(controller, [("enrich", 5), ("chat", 1), ("chat", 1), ("chat", 1)]))
+    assert order == ["chat", "chat", "chat", "enrich"]
+
+
+def test_queue_full_and_timeout_rejections():
+    controller = _controller(max_queue=1, queue_timeout=0.1)
+
+    async def run():
+        holder = await controller.acquire("a")
+        waiting = asyncio.create_task(controller.acquire("b"))
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await controller.acquire("c")
+        assert "队列已满" in rejected.value.reason
+        with pytest.raises(AdmissionRejected) as timed_out:
+            await waiting
+        assert "超时" in timed_out.value.reason
+        holder.release()
+
+    asyncio.run(run())
+    stats = controller.stats()
+    assert (stats["rejected_queue_full"], stats["rejected_timeout"], stats["active"], stats["queued"]) == (1, 1, 0, 0)
+
+
+def test_token_bucket_try_take_and_reserve():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.try_take() == 0 and bucket.try_take() == 0
+    wait = bucket.try_take()
+    assert 0 < wait <= 0.1
+    # try_take 不足时不扣减；reserve 允许透支并按顺序排出等待时间
+    first, second = bucket.reserve(), bucket.reserve()
+    assert 0 < first < second <= 0.2 + 1e-6
+    # 透支的 2 个令牌补回后才能再取
+    time.sleep(0.35)
+    assert bucket.try_take() == 0
+
+    assert TokenBucket(rate=0, burst=1).reserve() == 0
+    empty = TokenBucket(rate=0, burst=1)
+    empty.try_take()
+    assert empty.try_take() == float("inf")
+
+
+def test_per_user_rate_limit():
+    controller = _controller(max_concurrent=8, per_user={"rate": 1, "burst": 2})
+
+    async def run():
+        for _ in range(2):
+            (await controller.acquire("alice")).release()
+        with pytest.raises(AdmissionRejected) as limited:
+            await controller.acquire("alice")
+        assert limited.value.retry_after >= 1
+        # 其他用户不受影响
+        (await controller.acquire("bob")).release()
+
+    asyncio.run(run())
+    assert controller.stats()["rate_limited"] == 1
+
+
+def test_rejected_requests_do_not_consume_tokens():
+    controller = _controller(max_queue=0, queue_timeout=0.05, per_user={"rate": 0.01, "burst": 2})
+
+    async def run():
+        holder = await controller.acquire("holder")
+        for _ in range(5):
+            with pytest.raises(AdmissionRejected, match="队列已满"):
+                await controller.acquire("alice")
+        holder.release()
+        (await controller.acquire("alice")).release()
+        (await controller.acquire("alice")).release()
+
+    asyncio.run(run())
+
+    controller = _controller(max_queue=4, queue_timeout=0.05, per_user={"rate": 0.01, "burst": 1})
+
+    async def timed_out():
+        holder = await controller.acquire("holder")
+        with pytest.raises(AdmissionRejected, match="超时"):
+            await controller.acquire("alice")
+        holder.release()
+        (await controller.acquire("alice")).release()
+
+    asyncio.run(timed_out())
+
+
+def test_reconfigure_keeps_buckets_unless_rate_changes():
+    settings = {"max_concurrent": 8, "per_user": {"rate": 0.01, "burst": 1}}
+    controller = _controller(**settings)
+
+    async def take():
+        (await controller.acquire("alice")).release()
+
+    asyncio.run(take())
+    controller.configure({**settings, "max_queue": 32})
+    with pytest.raises(AdmissionRejected, match="速率"):
+        asyncio.run(take())
+
+    controller.configure({**settings, "per_user": {"rate": 0.01, "burst": 2}})
+    asyncio.run(take())
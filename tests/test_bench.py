@@ -0,0 +1,38 @@
+"""bench/：用 stub LLM 与 stub MCP server 端到端跑一轮小规模压测（冒烟测试）"""
+
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+BENCH = Path(__file__).resolve().parent.parent / "bench"
+
+
+def _run(*args: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *args], capture_output=True, text=True, timeout=240)
+
+
+def test_run_bench_and_compare(tmp_path):
+    output = tmp_path / "result.json"
+    scenarios = json.loads((BENCH / "scenarios.json").read_text(encoding="utf-8"))
+    run = _run(
+        str(BENCH / "run_bench.py"),
+        "--concurrency", "2", "--iterations", str(len(scenarios)),
+        "--llm-ttft", "0", "--llm-tps", "1000", "--reply-tokens", "5", "--tool-latency", "0",
+        "--output", str(output),
+    )
+    assert run.returncode == 0, run.stdout[-2000:] + run.stderr[-2000:]
+
+    result = json.loads(output.read_text(encoding="utf-8"))
+    summary = result["summary"]
+    # 每个场景执行一次，所有轮次（含 [[tool:...]] 触发的 MCP 调用）都成功
+    assert summary["errors"] == 0, summary["error_samples"]
+    assert summary["turns"] == sum(len(s["turns"]) for s in scenarios)
+    assert set(summary["scenarios"]) == {s["name"] for s in scenarios}
+    assert summary["ttft_ms"]["p50"] > 0
+    assert result["meta"]["params"]["concurrency"] == 2
+    assert result["server"]["admission"]["admitted"] >= summary["turns"]
+
+    compare = _run(str(BENCH / "compare.py"), str(output), str(output))
+    assert compare.returncode == 0, compare.stderr
+    assert "latency p95 ms" in compare.stdout
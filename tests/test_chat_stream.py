@@ -0,0 +1,33 @@
+"""main._stream_events：流式输出按请求开始时的配置快照进行，进行中的热加载不影响本次输出"""
+
+import asyncio
+
+from langchain_core.messages import AIMessage, ToolMessage
+
+import main
+
+
+class _FakeAgent:
+    async def astream(self, inputs, config=None, stream_mode=None):
+        # 模拟流进行中配置被热加载替换
+        main.agent_registry._current = (self, {"stream": {"tool_output_preview_chars": 1000}})
+        yield "updates", {"tools": {"messages": [ToolMessage(content="x" * 50, name="get_indexes", tool_call_id="c1")]}}
+        yield "updates", {"model": {"messages": [AIMessage(content="完成")]}}
+
+
+def test_stream_uses_snapshot_config(monkeypatch):
+    monkeypatch.setattr(main.agent_registry, "_current", None)
+    snapshot = {"stream": {"tool_output_preview_chars": 10}}
+
+    async def run():
+        queue: asyncio.Queue = asyncio.Queue()
+        await main._stream_events(_FakeAgent(), snapshot, [], {}, "t1", queue)
+        items = []
+        while not queue.empty():
+            items.append(await queue.get())
+        return items
+
+    items = asyncio.run(run())
+    tool_end = next(item for item in items if isinstance(item, dict) and item["type"] == "tool_end")
+    assert (len(tool_end["content"]), tool_end["truncated"]) == (10, True)
+    assert {"type": "final", "content": "完成", "thread_id": "t1"} in items
@@ -0,0 +1,131 @@
+"""checkpointer：RedisSaver 在 fakeredis 上的读写往返，以及配置切换时旧实例的生命周期"""
+
+import asyncio
+import operator
+from datetime import datetime, timezone
+from typing import Annotated, List, TypedDict
+
+import fakeredis
+import pytest
+from langgraph.checkpoint.base import empty_checkpoint
+from langgraph.graph import END, START, StateGraph
+
+import checkpointer
+from checkpointer import LRUMemorySaver, RedisSaver
+
+
+@pytest.fixture
+def saver():
+    return RedisSaver(fakeredis.FakeRedis(), prefix="test:ckpt")
+
+
+def _config(thread_id, checkpoint_id=None, ns=""):
+    configurable = {"thread_id": thread_id, "checkpoint_ns": ns}
+    if checkpoint_id:
+        configurable["checkpoint_id"] = checkpoint_id
+    return {"configurable": configurable}
+
+
+def _put(saver, thread_id, parent=None, **metadata):
+    checkpoint = empty_checkpoint()
+    checkpoint["channel_values"] = {"messages": [f"{thread_id}:{checkpoint['id']}"]}
+    saved = saver.put(_config(thread_id, parent), checkpoint, metadata, {})
+    return checkpoint, saved
+
+
+def test_put_get_roundtrip_keeps_checkpoint_and_metadata(saver):
+    created = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+    checkpoint, saved = _put(saver, "t1", source="input", step=-1, created=created)
+
+    item = saver.get_tuple(_config("t1"))
+    assert item.config == saved
+    assert item.checkpoint["id"] == checkpoint["id"]
+    assert item.checkpoint["channel_values"] == checkpoint["channel_values"]
+    assert item.metadata["source"] == "input"
+    # 非 JSON 值经 serde 往返后类型不变
+    assert item.metadata["created"] == created
+    assert item.parent_config is None
+
+
+def test_latest_parent_and_list(saver):
+    first, first_config = _put(saver, "t1", step=0)
+    second, _ = _put(saver, "t1", parent=first["id"], step=1)
+    _put(saver, "t2", step=0)
+
+    latest = saver.get_tuple(_config("t1"))
+    assert latest.checkpoint["id"] == second["id"]
+    assert latest.parent_config == first_config
+
+    assert [c.checkpoint["id"] for c in saver.list(_config("t1"))] == [second["id"], first["id"]]
+    assert [c.checkpoint["id"] for c in saver.list(_config("t1"), filter={"step": 0})] == [first["id"]]
+    assert [c.checkpoint["id"] for c in saver.list(_config("t1"), before=_config("t1", second["id"]))] == [first["id"]]
+    assert len(list(saver.list(None))) == 3
+    assert len(list(saver.list(None, limit=2))) == 2
+
+
+def test_put_writes_and_delete_thread(saver):
+    checkpoint, saved = _put(saver, "t1")
+    saver.put_writes(saved, [("messages", "a"), ("files", {"/x": 1})], task_id="task-1")
+    # 普通 channel 只写一次
+    saver.put_writes(saved, [("messages", "b")], task_id="task-1")
+
+    item = saver.get_tuple(saved)
+    assert item.pending_writes == [("task-1", "messages", "a"), ("task-1", "files", {"/x": 1})]
+
+    saver.delete_thread("t1")
+    assert saver.get_tuple(_config("t1")) is None
+    assert list(saver.list(None)) == []
+    assert saver.client.keys("test:ckpt:*") == []
+
+
+def test_legacy_json_metadata_still_readable(saver):
+    checkpoint, saved = _put(saver, "t1", step=3)
+    key = saver._k_cp("t1", "", checkpoint["id"])
+    saver.client.hdel(key, "metadata_type")
+    saver.client.hset(key, "metadata", '{"step": 3, "source": "loop"}')
+
+    assert saver.get_tuple(saved).metadata == {"step": 3, "source": "loop"}
+
+
+class _State(TypedDict):
+    items: Annotated[List[str], operator.add]
+
+
+def _graph(saver):
+    builder = StateGraph(_State)
+    builder.add_node("echo", lambda state: {"items": [f"seen {len(state['items'])}"]})
+    builder.add_edge(START, "echo")
+    builder.add_edge("echo", END)
+    return builder.compile(checkpointer=saver)
+
+
+def test_graph_state_survives_across_invocations(saver):
+    graph = _graph(saver)
+    config = {"configurable": {"thread_id": "conv-1"}}
+
+    async def run():
+        await graph.ainvoke({"items": ["hello"]}, config)
+        return await graph.ainvoke({"items": ["again"]}, config)
+
+    result = asyncio.run(run())
+    assert result["items"] == ["hello", "seen 1", "again", "seen 3"]
+    # 另一个 saver 实例连同一个 Redis 也能读到（多 worker 共享）
+    other = RedisSaver(saver.client, prefix="test:ckpt")
+    state = asyncio.run(_graph(other).aget_state(config))
+    assert state.values["items"] == result["items"]
+
+
+def test_replaced_checkpointer_stays_open_until_shutdown(monkeypatch):
+    monkeypatch.delenv("DEEPAGENTS_SHARED_CHECKPOINTER", raising=False)
+    closed = []
+    monkeypatch.setattr(LRUMemorySaver, "close", lambda self: closed.append(self), raising=False)
+    checkpointer.close_checkpointer()
+
+    first = checkpointer.get_checkpointer({"checkpointer": {"backend": "memory", "max_threads": 10}})
+    assert checkpointer.get_checkpointer({"checkpointer": {"backend": "memory", "max_threads": 10}}) is first
+    second = checkpointer.get_checkpointer({"checkpointer": {"backend": "memory", "max_threads": 20}})
+    assert second is not first
+    assert closed == []
+
+    checkpointer.close_checkpointer()
+    assert closed == [first, second]
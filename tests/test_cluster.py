@@ -0,0 +1,151 @@
+"""cluster：thread_id 亲和路由、worker 启动超时重启、转发时进行中计数的归还"""
+
+import asyncio
+import json
+import sys
+import subprocess
+from collections import Counter
+
+import httpx
+import pytest
+
+from cluster import Cluster, Worker, _with_thread_id, cluster_settings, create_app, rendezvous
+
+
+def _workers(count):
+    return [Worker(i, 9000 + i, {}, "warning") for i in range(count)]
+
+
+def test_rendezvous_is_deterministic_and_spreads_keys():
+    workers = _workers(4)
+    keys = [f"thread-{i}" for i in range(400)]
+    first = {key: rendezvous(key, workers)[0].index for key in keys}
+    assert first == {key: rendezvous(key, list(reversed(workers)))[0].index for key in keys}
+    assert all(count > 50 for count in Counter(first.values()).values())
+
+
+def test_rendezvous_only_moves_keys_of_removed_worker():
+    workers = _workers(4)
+    keys = [f"thread-{i}" for i in range(400)]
+    before = {key: rendezvous(key, workers)[0].index for key in keys}
+    remaining = [w for w in workers if w.index != 2]
+    after = {key: rendezvous(key, remaining)[0].index for key in keys}
+
+    moved = {key for key in keys if before[key] != after[key]}
+    assert moved == {key for key in keys if before[key] == 2}
+    # 换到的是原哈希顺序中的下一个 worker
+    assert all(after[key] == rendezvous(key, workers)[1].index for key in moved)
+
+
+def test_with_thread_id_keeps_or_injects_thread_id():
+    body, thread_id = _with_thread_id(json.dumps({"message": "hi", "thread_id": "t-1"}).encode())
+    assert thread_id == "t-1"
+    assert json.loads(body)["thread_id"] == "t-1"
+
+    body, thread_id = _with_thread_id(json.dumps({"message": "你好"}).encode())
+    payload = json.loads(body)
+    assert thread_id and payload == {"message": "你好", "thread_id": thread_id}
+    # 写回的请求体再次经过前端时路由不变
+    assert _with_thread_id(body)[1] == thread_id
+
+    assert _with_thread_id(b"not json") == (b"not json", None)
+    assert _with_thread_id(b"[1, 2]") == (b"[1, 2]", None)
+
+
+def _cluster(monkeypatch, tmp_path, workers=2, **settings):
+    monkeypatch.setenv("DEEPAGENTS_CONFIG", str(tmp_path / "config.json"))
+    settings = {**cluster_settings({}), "workers": workers, "share_stdio_mcp": False, **settings}
+    return Cluster({}, settings)
+
+
+class _HangingWorker(Worker):
+    """进程一直存活但从不监听端口，模拟卡在启动阶段的 worker"""
+
+    def spawn(self) -> None:
+        self.ready = False
+        self.proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+
+
+def test_worker_stuck_in_startup_is_killed_and_respawned(monkeypatch, tmp_path):
+    cluster = _cluster(monkeypatch, tmp_path, workers=1, startup_timeout=0.5, restart_delay=0.05)
+    worker = _HangingWorker(0, cluster.workers[0].port, {}, "warning")
+    spawned = []
+
+    async def run():
+        task = asyncio.create_task(cluster._supervise(worker))
+        try:
+            while worker.restarts < 2:
+                if worker.proc is not None and worker.proc not in spawned:
+                    spawned.append(worker.proc)
+                await asyncio.sleep(0.05)
+        finally:
+            cluster._stopping = True
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            worker.stop()
+            await cluster.client.aclose()
+
+    asyncio.run(asyncio.wait_for(run(), 10))
+    assert len(spawned) >= 2
+    # 超时的进程已被杀掉，而不是继续占着 worker 位置
+    assert all(proc.poll() is not None for proc in spawned)
+    assert not worker.ready
+
+
+class _Stream(httpx.AsyncByteStream):
+    """模拟 worker 的流式响应体；fail 为真时发出第一块后连接中断"""
+
+    def __init__(self, data: bytes, fail: bool = False) -> None:
+        self.data = data
+        self.fail = fail
+
+    async def __aiter__(self):
+        yield self.data
+        if self.fail:
+            raise httpx.ReadError("worker connection reset")
+
+
+def _upstream(request: httpx.Request) -> httpx.Response:
+    if request.url.path == "/chat/stream":
+        return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                              stream=_Stream(b'data: {"type": "token"}\n\n', fail=True))
+    body = json.dumps({"path": request.url.path, "body": json.loads(request.content or b"null")}).encode()
+    return httpx.Response(200, headers={"content-type": "application/json"}, stream=_Stream(body))
+
+
+@pytest.fixture
+def proxied(monkeypatch, tmp_path):
+    cluster = _cluster(monkeypatch, tmp_path)
+    for worker in cluster.workers:
+        worker.ready = True
+    cluster.client = httpx.AsyncClient(transport=httpx.MockTransport(_upstream))
+    yield cluster
+
+
+def test_proxy_routes_by_thread_id_and_releases_active(proxied):
+    app = create_app(proxied)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://front") as client:
+            first = await client.post("/chat", json={"message": "hi"})
+            thread_id = first.json()["body"]["thread_id"]
+            again = await client.post("/chat", json={"message": "again", "thread_id": thread_id})
+            return thread_id, first, again
+
+    thread_id, first, again = asyncio.run(run())
+    expected = rendezvous(thread_id, proxied.workers)[0].index
+    assert first.headers["x-deepagents-worker"] == again.headers["x-deepagents-worker"] == str(expected)
+    assert [w.active for w in proxied.workers] == [0, 0]
+    assert sum(w.routed for w in proxied.workers) == 2
+
+
+def test_proxy_releases_active_when_upstream_stream_fails(proxied):
+    app = create_app(proxied)
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://front") as client:
+            with pytest.raises(httpx.ReadError):
+                await client.post("/chat/stream", json={"message": "hi", "thread_id": "t-1"})
+
+    asyncio.run(run())
+    assert [w.active for w in proxied.workers] == [0, 0]
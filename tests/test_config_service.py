@@ -0,0 +1,92 @@
+"""config_service：重新加载时文件无效 / 缺失保留旧配置、config.env 的归属、AgentRegistry 的快照替换"""
+
+import json
+import os
+
+import pytest
+
+import config_service
+import main
+from config_service import ConfigError, ConfigSource, apply_env
+
+
+def _write(path, config):
+    path.write_text(json.dumps(config), encoding="utf-8")
+
+
+def test_missing_file_is_empty_only_on_first_load(tmp_path):
+    path = tmp_path / "config.json"
+    source = ConfigSource(lambda: path)
+    assert source.load() == ({}, True)
+
+    _write(path, {"model": {"name": "a"}})
+    assert source.load() == ({"model": {"name": "a"}}, True)
+
+    path.unlink()
+    assert source.changed()
+    with pytest.raises(ConfigError, match="不存在"):
+        source.load()
+    assert source.config == {"model": {"name": "a"}}
+    # 同一状态不再重复读取，直到文件再次出现
+    assert not source.changed()
+
+
+def test_invalid_file_keeps_previous_config(tmp_path):
+    path = tmp_path / "config.json"
+    _write(path, {"model": {"name": "a"}})
+    source = ConfigSource(lambda: path)
+    source.load()
+
+    path.write_text("{not json", encoding="utf-8")
+    with pytest.raises(ConfigError, match="JSON"):
+        source.load()
+    _write(path, {"mcp": {"servers": ["not", "a", "dict"]}})
+    with pytest.raises(ConfigError, match="mcp.servers"):
+        source.load()
+    assert source.config == {"model": {"name": "a"}}
+    assert source.stats()["rejected"] == 2
+
+
+def test_apply_env_ownership(monkeypatch):
+    monkeypatch.setattr(config_service, "_env_owned", set())
+    monkeypatch.setenv("TEST_CFG_PROCESS", "from-process")
+    monkeypatch.delenv("TEST_CFG_OWNED", raising=False)
+
+    apply_env({"env": {"TEST_CFG_PROCESS": "from-config", "TEST_CFG_OWNED": "1"}})
+    assert os.environ["TEST_CFG_PROCESS"] == "from-process"
+    assert os.environ["TEST_CFG_OWNED"] == "1"
+
+    apply_env({"env": {"TEST_CFG_OWNED": "2"}})
+    assert os.environ["TEST_CFG_OWNED"] == "2"
+
+    # 从配置中删除后同步从 os.environ 删除；进程原有的变量不受影响
+    apply_env({})
+    assert "TEST_CFG_OWNED" not in os.environ
+    assert os.environ["TEST_CFG_PROCESS"] == "from-process"
+
+
+def test_registry_refresh_swaps_snapshot(tmp_path, monkeypatch):
+    path = tmp_path / "config.json"
+    _write(path, {"model": {"name": "a"}})
+    monkeypatch.setattr(main, "build_agent", lambda config: f"agent-{config['model']['name']}")
+    registry = main.AgentRegistry()
+    registry.source = ConfigSource(lambda: path)
+
+    assert registry.get() == "agent-a"
+    snapshot = registry.current()
+    assert not registry.refresh()
+
+    _write(path, {"model": {"name": "bb"}})
+    assert registry.refresh()
+    assert registry.current() == ("agent-bb", {"model": {"name": "bb"}})
+    # 进行中的请求持有的旧快照不受影响
+    assert snapshot == ("agent-a", {"model": {"name": "a"}})
+
+    # 文件写坏或被删除：不替换，继续使用当前 Agent 与配置
+    path.write_text("{", encoding="utf-8")
+    assert not registry.refresh()
+    path.unlink()
+    assert not registry.refresh()
+    assert registry.current() == ("agent-bb", {"model": {"name": "bb"}})
+    assert registry.stats()["builds"] == 2
+    assert "不存在" in registry.stats()["config"]["last_error"]
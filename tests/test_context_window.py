@@ -0,0 +1,90 @@
+"""context_window：用假模型跑完整的 deep agent，验证转存 / 摘要与 deepagents 内置 middleware 的配合"""
+
+import json
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import tool
+
+from deepagents import create_deep_agent
+from deepagents.backends import StateBackend
+
+from context_window import build_context_middleware
+
+
+class FakeToolModel(GenericFakeChatModel):
+    """按顺序返回预设消息；bind_tools 原样返回，供 create_agent 绑定 tools"""
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+
+@tool
+def big_query(query: str) -> str:
+    """返回大量记录的查询"""
+    return json.dumps({"results": [{"host": f"h{i}", "count": i} for i in range(3000)]})
+
+
+def _backend(rt):
+    return StateBackend(rt)
+
+
+def _agent(model, context):
+    middleware = build_context_middleware({"context": {"enabled": True, **context}}, model, _backend)
+    return create_deep_agent(model=model, tools=[big_query], backend=_backend, middleware=middleware)
+
+
+def test_large_tool_output_offloaded_before_builtin_eviction():
+    model = FakeToolModel(messages=iter([
+        AIMessage(content="", tool_calls=[{"name": "big_query", "args": {"query": "x"}, "id": "call_1"}]),
+        AIMessage(content="done"),
+    ]))
+    agent = _agent(model, {"tool_output_max_tokens": 1000, "tool_output_preview_lines": 1})
+
+    out = agent.invoke({"messages": [HumanMessage("go")]})
+
+    tool_message = next(m for m in out["messages"] if m.type == "tool")
+    assert "完整内容已保存到 /tool_outputs/call_1-" in tool_message.content
+    assert "results: 3000 条" in tool_message.content
+    # 预算转存在内层先生效，deepagents 内置的 20k token 驱逐（/large_tool_results/）不再触发
+    assert [path for path in out["files"]] == [path for path in out["files"] if path.startswith("/tool_outputs/")]
+    assert len(out["files"]) == 1
+    assert out["messages"][-1].content == "done"
+
+
+def test_builtin_eviction_applies_above_its_limit():
+    # 阈值高于 deepagents 内置的 20k token 驱逐时，由内置 FilesystemMiddleware 转存到 /large_tool_results/
+    model = FakeToolModel(messages=iter([
+        AIMessage(content="", tool_calls=[{"name": "big_query", "args": {"query": "x"}, "id": "call_1"}]),
+        AIMessage(content="done"),
+    ]))
+    agent = _agent(model, {"tool_output_max_tokens": 100000})
+
+    out = agent.invoke({"messages": [HumanMessage("go")]})
+
+    tool_message = next(m for m in out["messages"] if m.type == "tool")
+    assert "/tool_outputs/" not in tool_message.content
+    assert "/large_tool_results/" in tool_message.content
+
+
+def test_history_summarized_at_budget():
+    # 20 条约 100 token 的消息 ≈ 2000 tokens，超过 2000 × 0.5 的摘要阈值；内置摘要（170k tokens）不会触发
+    history = []
+    for i in range(10):
+        history.append(HumanMessage(f"question {i} " + "x" * 400))
+        history.append(AIMessage(f"answer {i} " + "y" * 400))
+    model = FakeToolModel(messages=iter([
+        AIMessage(content="SUMMARY: earlier questions about x"),
+        AIMessage(content="final"),
+    ]))
+    agent = _agent(model, {"max_input_tokens": 2000, "summarize_at": 0.5, "keep_messages": 4})
+
+    out = agent.invoke({"messages": history + [HumanMessage("next")]})
+
+    contents = [m.content if isinstance(m.content, str) else str(m.content) for m in out["messages"]]
+    assert any("SUMMARY: earlier questions about x" in c for c in contents)
+    assert not any(c.startswith("question 0 ") for c in contents)
+    assert contents[-1] == "final"
+    # 摘要消息 + 保留的 4 条 + 最终回答
+    assert len(out["messages"]) <= 6
+    assert "/conversation_history/" in contents[0]
@@ -0,0 +1,91 @@
+"""enrich：用 stub MCP tools 验证 asset 分批、每个 IOC 的信誉查询、按完成顺序产出与提前关闭时取消"""
+
+import asyncio
+
+from langchain_core.tools import StructuredTool
+
+from enrich import ASSET_TOOL, REPUTATION_TOOL, enrich_iocs, enrich_settings, normalize_iocs
+
+
+class _StubTools:
+    """记录调用参数；delays 指定某个参数值的延迟，被取消的调用记入 cancelled"""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.asset_calls = []
+        self.reputation_calls = []
+        self.cancelled = []
+
+    async def _run(self, calls, value):
+        calls.append(value)
+        try:
+            await asyncio.sleep(self.delays.get(value, 0))
+        except asyncio.CancelledError:
+            self.cancelled.append(value)
+            raise
+        return f"ok:{value}"
+
+    def tools(self):
+        async def asset(domainOrip: str) -> str:
+            return await self._run(self.asset_calls, domainOrip)
+
+        async def reputation(ioc: str) -> str:
+            return await self._run(self.reputation_calls, ioc)
+
+        return [
+            StructuredTool.from_function(coroutine=asset, name=ASSET_TOOL, description="资产归属"),
+            StructuredTool.from_function(coroutine=reputation, name=REPUTATION_TOOL, description="IOC 信誉"),
+        ]
+
+
+async def _collect(iterator):
+    return [record async for record in iterator]
+
+
+def test_settings_defaults_and_overrides():
+    assert enrich_settings({}) == {"asset_batch_size": 20, "max_iocs": 1000, "summary_max_chars": 20000}
+    assert enrich_settings({"enrich": {"max_iocs": 5}})["max_iocs"] == 5
+    assert normalize_iocs([" a.com", "a.com", "", "1.2.3.4"]) == ["a.com", "1.2.3.4"]
+
+
+def test_assets_batched_and_every_ioc_checked():
+    stub = _StubTools()
+    hosts = [f"host{i}.example.com" for i in range(45)]
+    iocs = hosts + ["10.0.0.0/24", "d41d8cd98f00b204e9800998ecf8427e"]
+
+    records = asyncio.run(_collect(enrich_iocs(iocs, stub.tools(), asset_batch_size=20)))
+
+    # 哈希不查资产；域名与网段按 20 个一批逗号拼接
+    assert sorted(len(call.split(",")) for call in stub.asset_calls) == [6, 20, 20]
+    assert sorted(",".join(stub.asset_calls).split(",")) == sorted(hosts + ["10.0.0.0/24"])
+    assert sorted(stub.reputation_calls) == sorted(iocs)
+    assert len(records) == 3 + len(iocs)
+    assert all(r["status"] == "success" for r in records)
+
+
+def test_results_in_completion_order():
+    stub = _StubTools(delays={"slow.com": 0.2, "fast.com": 0})
+    records = asyncio.run(_collect(enrich_iocs(["slow.com", "fast.com"], stub.tools(), asset_info=False)))
+    assert [r["ioc"] for r in records] == ["fast.com", "slow.com"]
+
+
+def test_missing_tool_reported():
+    stub = _StubTools()
+    records = asyncio.run(_collect(enrich_iocs(["a.com"], stub.tools()[1:])))
+    assert records[0] == {"type": "error", "message": f"MCP tool {ASSET_TOOL} 未加载"}
+    assert [r["type"] for r in records[1:]] == ["reputation"]
+
+
+def test_early_close_cancels_pending_calls():
+    stub = _StubTools(delays={"slow-1.com": 5, "slow-2.com": 5})
+
+    async def run():
+        iterator = enrich_iocs(["fast.com", "slow-1.com", "slow-2.com"], stub.tools(), asset_info=False)
+        first = await iterator.__anext__()
+        await iterator.aclose()
+        await asyncio.sleep(0)
+        return first
+
+    first = asyncio.run(run())
+    assert first["ioc"] == "fast.com"
+    assert sorted(stub.cancelled) == ["slow-1.com", "slow-2.com"]
@@ -0,0 +1,147 @@
+"""llm_cache：ResponseCacheMiddleware 的命中 / 未命中条件、TTL 与容量淘汰、SQLite 持久化、写操作 tool 不缓存"""
+
+import asyncio
+import time
+
+from langchain.agents.middleware import ModelRequest, ModelResponse
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage, ToolMessage
+from langchain_core.tools import tool
+
+from llm_cache import ResponseCacheMiddleware, _MemoryStore, _SqliteStore
+from mcp_tools import NEVER_CACHE_TOOLS
+
+
+class NamedFakeModel(GenericFakeChatModel):
+    model_name: str = "flash"
+
+
+@tool
+def query_ioc_reputation(ioc: str) -> str:
+    """查询 IOC 信誉"""
+    return "malicious"
+
+
+@tool
+def waf_prod_op(ip: str) -> str:
+    """在生产 WAF 上封禁 IP"""
+    return "blocked"
+
+
+def _request(text="研判 1.2.3.4", system="你是 SOC 分析师", model="flash", tools=(query_ioc_reputation,), messages=None):
+    return ModelRequest(
+        model=NamedFakeModel(messages=iter([]), model_name=model),
+        messages=messages or [HumanMessage(text)],
+        system_message=SystemMessage(system),
+        tools=list(tools),
+    )
+
+
+class _Handler:
+    """记录调用次数的模型 handler"""
+
+    def __init__(self, reply=None):
+        self.calls = 0
+        self.reply = reply or AIMessage(content="结论：恶意")
+
+    def __call__(self, request):
+        self.calls += 1
+        return ModelResponse(result=[self.reply])
+
+
+def _cache(store=None):
+    return ResponseCacheMiddleware(store or _MemoryStore(100, 3600), set(NEVER_CACHE_TOOLS))
+
+
+def test_identical_request_is_a_hit():
+    cache, handler = _cache(), _Handler()
+    first = cache.wrap_model_call(_request(), handler)
+    # 多余的空白不影响 key
+    second = cache.wrap_model_call(_request(text="研判   1.2.3.4"), handler)
+
+    assert handler.calls == 1
+    assert second.result[0].content == first.result[0].content == "结论：恶意"
+    assert (cache.hits, cache.misses, cache.stores) == (1, 1, 1)
+
+
+def test_changed_context_is_a_miss():
+    cache, handler = _cache(), _Handler()
+    cache.wrap_model_call(_request(), handler)
+    cache.wrap_model_call(_request(system="你是 SOC 值班主管"), handler)
+    cache.wrap_model_call(_request(model="pro"), handler)
+    cache.wrap_model_call(_request(tools=(query_ioc_reputation, waf_prod_op)), handler)
+    cache.wrap_model_call(_request(text="研判 5.6.7.8"), handler)
+    assert handler.calls == 5
+    assert cache.hits == 0
+
+
+def test_async_hit_assigns_fresh_tool_call_ids():
+    reply = AIMessage(content="", tool_calls=[{"name": "query_ioc_reputation", "args": {"ioc": "1.2.3.4"}, "id": "call_a"}])
+    cache, handler = _cache(), _Handler(reply)
+
+    async def handle(request):
+        return handler(request)
+
+    async def run():
+        await cache.awrap_model_call(_request(), handle)
+        return await cache.awrap_model_call(_request(), handle)
+
+    cached = asyncio.run(run())
+    assert handler.calls == 1
+    assert cached.result[0].tool_calls[0]["name"] == "query_ioc_reputation"
+    assert cached.result[0].tool_calls[0]["id"] != "call_a"
+
+
+def test_ttl_and_capacity_evict():
+    cache, handler = _cache(_MemoryStore(2, ttl_seconds=0.05)), _Handler()
+    cache.wrap_model_call(_request("a"), handler)
+    time.sleep(0.1)
+    cache.wrap_model_call(_request("a"), handler)
+    assert handler.calls == 2
+    cache.store.ttl_seconds = 3600
+
+    # 容量 2：访问过的 a 保留，最久未访问的 b 被淘汰
+    cache.wrap_model_call(_request("b"), handler)
+    cache.wrap_model_call(_request("a"), handler)
+    cache.wrap_model_call(_request("c"), handler)
+    assert handler.calls == 4
+    cache.wrap_model_call(_request("a"), handler)
+    assert handler.calls == 4
+    cache.wrap_model_call(_request("b"), handler)
+    assert handler.calls == 5
+    assert cache.store.evictions == 2
+
+
+def test_sqlite_store_survives_restart(tmp_path):
+    path = str(tmp_path / "responses.sqlite")
+    store = _SqliteStore(path, 100, 3600)
+    handler = _Handler()
+    _cache(store).wrap_model_call(_request(), handler)
+    store.close()
+
+    reopened = _SqliteStore(path, 100, 3600)
+    cache = _cache(reopened)
+    assert cache.wrap_model_call(_request(), handler).result[0].content == "结论：恶意"
+    assert (handler.calls, cache.hits, reopened.size()) == (1, 1, 1)
+    reopened.close()
+
+
+def test_bypass_tool_is_never_stored_or_served():
+    assert "waf_prod_op" in NEVER_CACHE_TOOLS
+    call = AIMessage(content="", tool_calls=[{"name": "waf_prod_op", "args": {"ip": "1.2.3.4"}, "id": "call_w"}])
+    cache, handler = _cache(), _Handler(call)
+
+    # 模型响应调用了写操作 tool：不写入缓存，再次请求仍调用模型
+    cache.wrap_model_call(_request("封禁 1.2.3.4"), handler)
+    cache.wrap_model_call(_request("封禁 1.2.3.4"), handler)
+    assert handler.calls == 2
+    assert cache.store.size() == 0
+
+    # 会话中已经执行过写操作 tool：不读也不写缓存
+    history = [HumanMessage("封禁 1.2.3.4"), call, ToolMessage(content="blocked", name="waf_prod_op", tool_call_id="call_w")]
+    after = _Handler()
+    cache.wrap_model_call(_request(messages=history), after)
+    cache.wrap_model_call(_request(messages=history), after)
+    assert after.calls == 2
+    assert cache.store.size() == 0
+    assert cache.stats()["bypassed"] == 4
@@ -0,0 +1,149 @@
+"""LLM 网关：对两个 bench/stub_llm.py 实例验证故障转移、对冲与重试预算"""
+
+import asyncio
+import socket
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+import llm_gateway
+from llm_gateway import AsyncGatewayTransport, Gateway, GatewayTransport, gateway_settings
+
+STUB_LLM = Path(__file__).resolve().parent.parent / "bench" / "stub_llm.py"
+REQUEST = {"model": "stub", "messages": [{"role": "user", "content": "ping"}]}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def stub_llm():
+    """启动 stub LLM 子进程，返回其 base_url（…/v1）"""
+    procs = []
+
+    def start(*args: str) -> str:
+        port = _free_port()
+        procs.append(subprocess.Popen([
+            sys.executable, str(STUB_LLM), "--port", str(port),
+            "--reply-tokens", "3", "--tokens-per-second", "1000", *args,
+        ]))
+        base_url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 15
+        while time.monotonic() < deadline:
+            try:
+                httpx.get(f"{base_url}/stats", timeout=0.5)
+                return f"{base_url}/v1"
+            except httpx.HTTPError:
+                time.sleep(0.1)
+        raise RuntimeError("stub LLM 未能启动")
+
+    yield start
+    for proc in procs:
+        proc.terminate()
+        proc.wait(10)
+
+
+@pytest.fixture(autouse=True)
+def primary_first(monkeypatch):
+    """主请求固定发往第一个可用 endpoint，使测试与随机加权选择无关"""
+    monkeypatch.setattr(llm_gateway.random, "choices", lambda population, weights=None: [population[0]])
+
+
+def _stats(base_url: str) -> dict:
+    return httpx.get(base_url[: -len("/v1")] + "/stats").json()
+
+
+def _gateway(endpoints, **settings) -> Gateway:
+    return Gateway([{"base_url": url} for url in endpoints], {**gateway_settings({}), **settings})
+
+
+def _post(gateway: Gateway, body: dict) -> httpx.Response:
+    async def run():
+        transport = AsyncGatewayTransport(gateway, httpx.AsyncHTTPTransport())
+        async with httpx.AsyncClient(transport=transport, timeout=30) as client:
+            response = await client.post(f"{gateway.endpoints[0].base_url}/chat/completions", json=body)
+            await response.aread()
+            return response
+
+    return asyncio.run(run())
+
+
+def test_failover_when_endpoint_is_down(stub_llm):
+    healthy = stub_llm("--ttft", "0")
+    down = f"http://127.0.0.1:{_free_port()}/v1"
+    gateway = _gateway([down, healthy], hedge=False, breaker_failures=2)
+
+    for _ in range(3):
+        response = _post(gateway, REQUEST)
+        assert response.status_code == 200
+        assert response.json()["choices"][0]["message"]["content"]
+
+    down_stats, healthy_stats = gateway.stats()["endpoints"]
+    # 连续 2 次连接失败后熔断，第 3 个请求直接发往健康的 endpoint
+    assert (down_stats["failures"], down_stats["state"]) == (2, "open")
+    assert healthy_stats["wins"] == 3
+    assert gateway.failovers == 2
+    assert _stats(healthy)["requests"] == 3
+
+
+def test_failover_on_5xx_sync_and_async(stub_llm):
+    erroring = stub_llm("--ttft", "0", "--error-rate", "1")
+    healthy = stub_llm("--ttft", "0")
+    gateway = _gateway([erroring, healthy], hedge=False)
+
+    assert _post(gateway, REQUEST).status_code == 200
+    with httpx.Client(transport=GatewayTransport(gateway, httpx.HTTPTransport()), timeout=30) as client:
+        assert client.post(f"{erroring}/chat/completions", json=REQUEST).status_code == 200
+
+    assert _stats(erroring)["errors"] == 2
+    assert _stats(healthy)["requests"] == 2
+    assert gateway.failovers == 2
+
+
+def test_exhausted_retry_budget_returns_upstream_error(stub_llm):
+    erroring = stub_llm("--ttft", "0", "--error-rate", "1")
+    healthy = stub_llm("--ttft", "0")
+    gateway = _gateway([erroring, healthy], hedge=False, retry_burst=0, retry_ratio=0)
+
+    # 没有预算时不转移，把失败响应交给 SDK 决定是否重试
+    assert _post(gateway, REQUEST).status_code == 503
+    assert gateway.budget_exhausted == 1
+    assert _stats(healthy)["requests"] == 0
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_hedge_to_fast_endpoint_when_primary_is_slow(stub_llm, stream):
+    slow = stub_llm("--ttft", "3")
+    fast = stub_llm("--ttft", "0")
+    gateway = _gateway([slow, fast], hedge_initial_delay=0.3, hedge_min_delay=0.05)
+
+    started = time.perf_counter()
+    response = _post(gateway, {**REQUEST, "stream": stream})
+    elapsed = time.perf_counter() - started
+
+    assert response.status_code == 200
+    if stream:
+        assert response.text.rstrip().endswith("data: [DONE]")
+    assert 0.3 <= elapsed < 2
+    assert (gateway.hedges, gateway.hedge_wins) == (1, 1)
+    slow_stats, fast_stats = gateway.stats()["endpoints"]
+    assert (slow_stats["cancelled"], fast_stats["wins"]) == (1, 1)
+    assert _stats(slow)["requests"] == _stats(fast)["requests"] == 1
+
+
+def test_no_hedge_when_primary_answers_in_time(stub_llm):
+    primary = stub_llm("--ttft", "0")
+    secondary = stub_llm("--ttft", "0")
+    gateway = _gateway([primary, secondary], hedge_initial_delay=1)
+
+    for _ in range(3):
+        assert _post(gateway, REQUEST).status_code == 200
+    assert gateway.hedges == 0
+    assert _stats(secondary)["requests"] == 0
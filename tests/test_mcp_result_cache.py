@@ -0,0 +1,130 @@
+"""MCP tool 结果缓存：single-flight 合并、TTL 命中、写操作 tool 永不缓存"""
+
+import asyncio
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from mcp_tools import MCPConnectionManager, _ToolResultCache
+
+STUB_MCP = Path(__file__).resolve().parent.parent / "bench" / "stub_mcp.py"
+
+
+def _counting_call(calls, result="ok", delay=0.05):
+    async def call():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return SimpleNamespace(isError=False, content=result)
+
+    return call
+
+
+def test_concurrent_identical_calls_are_coalesced():
+    cache = _ToolResultCache({"enabled": True, "tools": {"query_ioc_reputation": 60}})
+    calls = []
+
+    async def run():
+        call = _counting_call(calls)
+        return await asyncio.gather(*(
+            cache.get_or_call("intel", "query_ioc_reputation", {"ioc": "1.2.3.4"}, call) for _ in range(10)
+        ))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(r is results[0] for r in results)
+    stats = cache.stats()["tools"]["query_ioc_reputation"]
+    assert stats["misses"] == 1 and stats["coalesced"] == 9
+
+
+def test_hit_within_ttl_and_key_ignores_argument_order():
+    cache = _ToolResultCache({"enabled": True, "tools": {"run_splunk_query": 60}})
+    calls = []
+
+    async def run():
+        call = _counting_call(calls, delay=0)
+        await cache.get_or_call("splunk", "run_splunk_query", {"query": "q", "earliest_time": "-1h"}, call)
+        await cache.get_or_call("splunk", "run_splunk_query", {"earliest_time": "-1h", "query": "q"}, call)
+        await cache.get_or_call("splunk", "run_splunk_query", {"query": "other"}, call)
+
+    asyncio.run(run())
+    assert len(calls) == 2
+    assert cache.stats()["tools"]["run_splunk_query"]["hits"] == 1
+
+
+def test_error_results_and_exceptions_are_not_cached():
+    cache = _ToolResultCache({"enabled": True, "tools": {"thehive_get_case": 60}})
+    calls = []
+
+    async def error_result():
+        calls.append(1)
+        return SimpleNamespace(isError=True, content="boom")
+
+    async def failing():
+        calls.append(1)
+        raise RuntimeError("down")
+
+    async def run():
+        await cache.get_or_call("thehive", "thehive_get_case", {"case_id": "1"}, error_result)
+        await cache.get_or_call("thehive", "thehive_get_case", {"case_id": "1"}, error_result)
+        with pytest.raises(RuntimeError):
+            await cache.get_or_call("thehive", "thehive_get_case", {"case_id": "2"}, failing)
+        with pytest.raises(RuntimeError):
+            await cache.get_or_call("thehive", "thehive_get_case", {"case_id": "2"}, failing)
+
+    asyncio.run(run())
+    assert len(calls) == 4
+    assert cache.stats()["entries"] == 0
+
+
+def test_write_tools_are_never_cached_even_when_configured():
+    cache = _ToolResultCache({
+        "enabled": True,
+        "tools": {"waf_prod_op": 60, "thehive_create_ioc": 60, "thehive_get_case": 60},
+        "never_cache": ["thehive_get_case"],
+    })
+    assert cache.ttl_of("waf_prod_op") == 0
+    assert cache.ttl_of("thehive_create_ioc") == 0
+    assert cache.ttl_of("thehive_get_case") == 0
+
+
+@pytest.fixture
+def manager():
+    manager = MCPConnectionManager()
+    manager.apply_settings({
+        "schema_cache": False,
+        "result_cache": {"enabled": True, "tools": {"thehive_get_case": 60, "waf_prod_op": 60}},
+    })
+    manager.configure({
+        "thehive": {
+            "transport": "stdio",
+            "command": sys.executable,
+            "args": [str(STUB_MCP), "--group", "thehive", "--transport", "stdio", "--latency", "0.2"],
+        },
+    })
+    yield manager
+    manager.close()
+
+
+def test_stub_mcp_server_calls_through_manager(manager):
+    assert manager.status()["thehive"]["state"] == "connected"
+    waf_args = {"case_id": "1", "operation": "block", "entity": "1.2.3.4", "environment": "prod"}
+
+    async def run():
+        reads = await asyncio.gather(*(
+            manager.call_tool("thehive", "thehive_get_case", {"case_id": "42"}) for _ in range(5)
+        ))
+        writes = await asyncio.gather(*(manager.call_tool("thehive", "waf_prod_op", waf_args) for _ in range(2)))
+        again = await manager.call_tool("thehive", "thehive_get_case", {"case_id": "42"})
+        return reads, writes, again
+
+    reads, writes, again = asyncio.run(run())
+    assert "stub case 42" in reads[0].content[0].text
+    assert again is reads[0]
+    assert all(not w.isError for w in writes)
+    # 5 + 1 次读合并为 1 次远端调用；写操作每次都发到 server
+    assert manager.status()["thehive"]["calls"] == 3
+    stats = manager.result_cache_stats()["tools"]
+    assert stats["thehive_get_case"]["misses"] == 1
+    assert "waf_prod_op" not in stats
@@ -0,0 +1,107 @@
+"""MCPConnectionManager._call_session：排队后重新读取会话、只在连接层错误时标记会话断开"""
+
+import asyncio
+
+import anyio
+import pytest
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED, ErrorData
+
+from mcp_tools import MCPConnectionManager, _ServerConnection
+
+
+class _FakeSession:
+    def __init__(self, name, error=None, gate=None):
+        self.name = name
+        self.error = error
+        self.gate = gate
+        self.calls = 0
+
+    async def call_tool(self, tool, arguments=None, **kwargs):
+        self.calls += 1
+        if self.gate is not None:
+            await self.gate.wait()
+        if self.error is not None:
+            raise self.error
+        return f"{self.name}:{tool}"
+
+
+def _manager(session, max_concurrent_calls=8):
+    manager = MCPConnectionManager()
+    manager.max_concurrent_calls = max_concurrent_calls
+    conn = _ServerConnection("intel", {"transport": "stdio", "timeout": 1}, 1)
+    conn.session = session
+    conn.ready.set()
+    manager._servers["intel"] = conn
+    return manager, conn
+
+
+def test_queued_call_uses_session_after_reconnect():
+    async def run():
+        gate = asyncio.Event()
+        old = _FakeSession("old", gate=gate)
+        manager, conn = _manager(old, max_concurrent_calls=1)
+        first = asyncio.create_task(manager._call_session("intel", "query_ioc_reputation"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(manager._call_session("intel", "query_ioc_reputation"))
+        await asyncio.sleep(0)
+        assert conn.queued_calls == 1
+
+        # 第一个调用进行中时连接断开：会话被清空，稍后重连出新会话
+        conn.session = None
+        conn.ready.clear()
+        gate.set()
+        assert await first == "old:query_ioc_reputation"
+        await asyncio.sleep(0.05)
+        conn.session = _FakeSession("new")
+        conn.ready.set()
+        return await second, old.calls
+
+    result, old_calls = asyncio.run(run())
+    assert result == "new:query_ioc_reputation"
+    assert old_calls == 1
+
+
+def test_queued_call_fails_cleanly_when_connection_drained():
+    async def run():
+        gate = asyncio.Event()
+        manager, conn = _manager(_FakeSession("old", gate=gate), max_concurrent_calls=1)
+        first = asyncio.create_task(manager._call_session("intel", "get_indexes"))
+        await asyncio.sleep(0)
+        second = asyncio.create_task(manager._call_session("intel", "get_indexes"))
+        await asyncio.sleep(0)
+        conn.stop.set()
+        conn.session = None
+        gate.set()
+        await first
+        with pytest.raises(RuntimeError, match="不可用"):
+            await second
+        return conn
+
+    conn = asyncio.run(run())
+    assert (conn.active_calls, conn.queued_calls, conn.calls) == (0, 0, 1)
+    assert not conn.broken.is_set()
+
+
+@pytest.mark.parametrize("error, broken", [
+    (ValueError("bad arguments"), False),
+    (RuntimeError("output schema validation failed"), False),
+    (McpError(ErrorData(code=408, message="Timed out")), False),
+    (McpError(ErrorData(code=-32602, message="Invalid params")), False),
+    (McpError(ErrorData(code=CONNECTION_CLOSED, message="Connection closed")), True),
+    (anyio.ClosedResourceError(), True),
+    (anyio.BrokenResourceError(), True),
+    (ConnectionResetError("reset by peer"), True),
+    (ExceptionGroup("task group", [anyio.ClosedResourceError()]), True),
+])
+def test_only_transport_errors_mark_session_broken(error, broken):
+    manager, conn = _manager(_FakeSession("s", error=error))
+
+    async def run():
+        with pytest.raises(type(error)):
+            await manager._call_session("intel", "run_splunk_query", {"query": "x"})
+
+    asyncio.run(run())
+    assert conn.broken.is_set() is broken
+    assert (conn.last_error is not None) is broken
+    assert conn.active_calls == 0
@@ -0,0 +1,103 @@
+"""memory_namespaces：命名空间 id 不冲突、旧目录迁移、注入片段不超过 token 预算"""
+
+import pytest
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from memory_namespaces import (
+    NamespacedMemory,
+    NamespacedMemoryMiddleware,
+    USER_ROUTE,
+    _safe,
+    estimate_tokens,
+    namespace_settings,
+)
+from memory_store import MemoryStore
+
+
+def _memory(tmp_path, **settings):
+    store = MemoryStore(lock_dir=str(tmp_path / "locks"))
+    return NamespacedMemory(str(tmp_path / "ns"), store, {**namespace_settings({}), **settings})
+
+
+def test_ids_do_not_collide():
+    assert _safe("alice_corp_com", "anonymous") == "alice_corp_com"
+    assert _safe("alice@corp.com", "anonymous") != "alice_corp_com"
+    assert _safe("alice@corp.com", "anonymous").startswith("alice_corp_com.")
+
+    # 64 个字符的共同前缀：只在非法字符上不同的 id 也落到不同目录；超长 id 直接报错而不是截断
+    prefix = "a" * 63
+    names = {_safe(prefix + suffix, "anonymous") for suffix in ("@", "#", "_")}
+    assert len(names) == 3
+    for suffix in ("x", "y"):
+        with pytest.raises(ValueError):
+            _safe("a" * 64 + suffix, "anonymous")
+
+
+def test_dirs_for_separates_tenants_and_users(tmp_path):
+    memory = _memory(tmp_path)
+    a = memory.dirs_for({"tenant_id": "acme", "user_id": "alice@corp.com"})
+    b = memory.dirs_for({"tenant_id": "acme", "user_id": "alice_corp_com"})
+    assert a[USER_ROUTE] != b[USER_ROUTE]
+    assert memory.dirs_for({})[USER_ROUTE] == memory.root_dir / "default" / "users" / "anonymous"
+
+
+def test_legacy_dirs_are_migrated_on_first_access(tmp_path):
+    memory = _memory(tmp_path)
+    legacy = memory.root_dir / "acme_corp" / "users" / "alice_corp_com"
+    legacy.mkdir(parents=True)
+    (legacy / "notes.md").write_text("- 旧记忆\n", encoding="utf-8")
+
+    routes = memory.routes_for({"tenant_id": "acme.corp", "user_id": "alice@corp.com"})
+    user_dir = routes[USER_ROUTE].directory
+    assert (user_dir / "notes.md").read_text(encoding="utf-8") == "- 旧记忆\n"
+    assert user_dir.parent.parent.name == _safe("acme.corp", "default")
+    assert not (memory.root_dir / "acme_corp").exists()
+    assert memory.stats()["migrations"] == 2
+
+    # 迁移后原样的 alice_corp_com 拿到的是自己的空目录
+    other = memory.routes_for({"tenant_id": "acme.corp", "user_id": "alice_corp_com"})[USER_ROUTE].directory
+    assert not list(other.iterdir())
+
+
+def test_existing_new_dir_is_not_overwritten(tmp_path):
+    memory = _memory(tmp_path)
+    legacy = memory.root_dir / "default" / "users" / "bob_corp_com"
+    legacy.mkdir(parents=True)
+    (legacy / "old.md").write_text("- 旧\n", encoding="utf-8")
+    current = memory.root_dir / "default" / "users" / _safe("bob@corp.com", "anonymous")
+    current.mkdir(parents=True)
+    (current / "new.md").write_text("- 新\n", encoding="utf-8")
+
+    user_dir = memory.dirs_for({"user_id": "bob@corp.com"})[USER_ROUTE]
+    assert sorted(p.name for p in user_dir.iterdir()) == ["new.md"]
+    assert (legacy / "old.md").exists()
+    assert memory.migrations == 0
+
+
+def test_injection_stays_within_token_budget(tmp_path):
+    memory = _memory(tmp_path, budget_tokens=60, chunk_chars=120)
+    user_dir = memory.routes_for({"user_id": "alice"})[USER_ROUTE].directory
+    lines = [f"- 主机 host-{i} 属于 {'财务' if i % 3 == 0 else '研发'} 部门，负责人 owner-{i}，备注 {'x' * 40}" for i in range(30)]
+    (user_dir / "hosts.md").write_text("\n\n".join(lines) + "\n", encoding="utf-8")
+
+    snippets = memory.retrieve({"user_id": "alice"}, "财务 部门")
+    assert snippets
+    assert sum(estimate_tokens(text) for _, text in snippets) <= 60
+    assert all(path == USER_ROUTE + "hosts.md" for path, _ in snippets)
+    assert "财务" in snippets[0][1]
+
+    class _Request:
+        messages = [HumanMessage(content="财务 部门")]
+        system_message = SystemMessage(content="base")
+
+        def override(self, **kwargs):
+            return kwargs
+
+    captured = {}
+    middleware = NamespacedMemoryMiddleware(memory)
+    middleware._configurable = staticmethod(lambda: {"user_id": "alice"})
+    middleware.wrap_model_call(_Request(), lambda request: captured.update(request))
+    prompt = captured["system_message"].content[-1]["text"]
+    assert "## Relevant Memories" in prompt
+    assert prompt.count("[/memories/user/hosts.md]") == len(snippets)
+    assert memory.stats()["injected_tokens_max"] <= 60
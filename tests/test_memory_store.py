@@ -0,0 +1,73 @@
+"""memory_store：多进程并发追加不丢写入、过期版本的 CAS 被拒绝、读缓存能看到外部写入"""
+
+import multiprocessing
+import os
+from pathlib import Path
+
+import pytest
+
+from memory_store import MemoryConflict, MemoryStore, content_version
+
+PROCESSES = 4
+ENTRIES = 25
+
+
+def _append_entries(path: Path, lock_dir: str, worker: int) -> None:
+    store = MemoryStore(lock_dir=lock_dir)
+    for i in range(ENTRIES):
+        store.append(path, f"- worker {worker} entry {i}\n")
+
+
+def test_concurrent_appends_from_processes(tmp_path):
+    path = tmp_path / "memories" / "notes.md"
+    lock_dir = str(tmp_path / "locks")
+    ctx = multiprocessing.get_context("fork" if "fork" in multiprocessing.get_all_start_methods() else "spawn")
+    procs = [ctx.Process(target=_append_entries, args=(path, lock_dir, worker)) for worker in range(PROCESSES)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join(60)
+        assert proc.exitcode == 0
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == PROCESSES * ENTRIES
+    assert set(lines) == {f"- worker {w} entry {i}" for w in range(PROCESSES) for i in range(ENTRIES)}
+    # 原子替换不留下临时文件
+    assert [p.name for p in path.parent.iterdir()] == ["notes.md"]
+
+
+def test_compare_and_swap_rejects_stale_version(tmp_path):
+    store = MemoryStore(lock_dir=str(tmp_path / "locks"))
+    path = tmp_path / "notes.md"
+
+    v1 = store.compare_and_swap(path, None, b"first\n")
+    assert v1 == content_version(b"first\n")
+    with pytest.raises(MemoryConflict):
+        store.compare_and_swap(path, None, b"again\n")
+
+    v2 = store.compare_and_swap(path, v1, b"second\n")
+    with pytest.raises(MemoryConflict) as conflict:
+        store.compare_and_swap(path, v1, b"stale\n")
+    assert (conflict.value.expected, conflict.value.current) == (v1, v2)
+    assert path.read_bytes() == b"second\n"
+    assert store.stats()["conflicts"] == 2
+
+
+def test_read_cache_sees_external_write(tmp_path):
+    store = MemoryStore(lock_dir=str(tmp_path / "locks"))
+    path = tmp_path / "notes.md"
+    path.write_bytes(b"old\n")
+
+    assert store.read(path) == (b"old\n", content_version(b"old\n"))
+    assert store.read(path)[0] == b"old\n"
+    assert store.stats()["cache_hits"] == 1
+
+    # 另一个 worker 的写入：大小相同，只有 mtime 变化
+    path.write_bytes(b"new\n")
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    assert store.read(path) == (b"new\n", content_version(b"new\n"))
+
+    path.unlink()
+    assert store.read(path) == (None, None)
+    assert store.stats()["cached_files"] == 0
@@ -0,0 +1,94 @@
+"""model_routing：用假模型跑 Agent，验证调用前选择档位（tool 步骤走 router、升级路径、router 出错回退），每步只生成一次"""
+
+from langchain.agents import create_agent
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langchain_core.tools import tool
+
+from model_routing import ModelRoutingMiddleware, ModelTiers, routing_settings
+
+
+class FakeTierModel(GenericFakeChatModel):
+    """按顺序返回预设消息，调用记录到 log（model_copy 得到的各档位副本共用）；error 非空时每次调用都抛出"""
+
+    error: str = ""
+    log: list
+
+    def bind_tools(self, tools, **kwargs):
+        return self
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        self.log.append(1)
+        if self.error:
+            raise RuntimeError(self.error)
+        return super()._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+
+@tool
+def query_ioc_reputation(ioc: str) -> str:
+    """查询 IOC 信誉"""
+    return f"{ioc}: malicious"
+
+
+def _call(call_id, ioc="1.2.3.4"):
+    return AIMessage(content="", tool_calls=[{"name": "query_ioc_reputation", "args": {"ioc": ioc}, "id": call_id}])
+
+
+def _routing(router_messages, final_messages, router_error="", **settings):
+    models = {
+        "small": FakeTierModel(messages=iter(router_messages), error=router_error, log=[]),
+        "big": FakeTierModel(messages=iter(final_messages), log=[]),
+    }
+    config = {"model": {"name": "big"}, "model_routing": {"enabled": True, "tiers": {"router": "small"}, **settings}}
+    tiers = ModelTiers(config, lambda config, tier: models[tier["name"]])
+    options = routing_settings(config)
+    middleware = ModelRoutingMiddleware(tiers, options["escalate_final"], options["router_steps"], log=False)
+    agent = create_agent(model=tiers.final, tools=[query_ioc_reputation], middleware=[middleware])
+    return agent, middleware, models
+
+
+def test_default_keeps_every_step_on_router():
+    assert routing_settings({})["escalate_final"] is False
+    agent, middleware, models = _routing([_call("c1"), _call("c2", "evil.com"), AIMessage(content="恶意")], [])
+
+    out = agent.invoke({"messages": [HumanMessage("研判 1.2.3.4 与 evil.com")]})
+
+    assert out["messages"][-1].content == "恶意"
+    assert (len(models["small"].log), len(models["big"].log)) == (3, 0)
+    assert middleware.stats()["decisions"] == {"tool_calls": 2, "answer": 1, "escalated": 0, "router_error": 0}
+    assert middleware.stats()["router_share"] == 1.0
+
+
+def test_escalation_decided_before_the_call():
+    agent, middleware, models = _routing([_call("c1")], [AIMessage(content="结论：恶意")], escalate_final=True)
+
+    out = agent.invoke({"messages": [HumanMessage("研判 1.2.3.4")]})
+
+    # tool 选择在 router，拿到 tool 结果后的一步直接由 final 生成，router 的回答不会被丢弃重算
+    assert out["messages"][-1].content == "结论：恶意"
+    assert (len(models["small"].log), len(models["big"].log)) == (1, 1)
+    assert middleware.stats()["decisions"] == {"tool_calls": 1, "answer": 0, "escalated": 1, "router_error": 0}
+
+
+def test_router_steps_budget():
+    agent, middleware, models = _routing(
+        [_call("c1"), _call("c2", "evil.com")], [AIMessage(content="结论")], escalate_final=True, router_steps=2,
+    )
+
+    agent.invoke({"messages": [HumanMessage("研判")]})
+
+    assert (len(models["small"].log), len(models["big"].log)) == (2, 1)
+    # 直接回答（没有 tool 结果）的步骤不升级
+    agent, middleware, models = _routing([AIMessage(content="你好")], [], escalate_final=True)
+    assert agent.invoke({"messages": [HumanMessage("你好")]})["messages"][-1].content == "你好"
+    assert (len(models["small"].log), len(models["big"].log)) == (1, 0)
+
+
+def test_router_error_falls_back_to_final():
+    agent, middleware, models = _routing([], [_call("c1"), AIMessage(content="结论")], router_error="router down")
+
+    out = agent.invoke({"messages": [HumanMessage("研判 1.2.3.4")]})
+
+    assert out["messages"][-1].content == "结论"
+    assert len(models["big"].log) == 2
+    assert middleware.stats()["decisions"]["router_error"] == 2
@@ -0,0 +1,78 @@
+"""relevance：按用户消息选择 tools / skills、always_tools 与已调用 tools 保留、低分回退、中文 bigram 切分"""
+
+from langchain.agents.middleware import ModelRequest
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_core.tools import StructuredTool
+
+from relevance import RelevanceFilter, RelevanceFilterMiddleware, tokenize
+
+
+def _tool(name, description):
+    return StructuredTool.from_function(lambda query="": "", name=name, description=description)
+
+
+MCP_TOOLS = [
+    _tool("query_ioc_reputation", "查询 IP / 域名 / 哈希的威胁情报信誉"),
+    _tool("query_asset_info", "查询资产负责人与所属业务"),
+    _tool("run_splunk_query", "在 Splunk 中执行 SPL 搜索日志"),
+    _tool("get_indexes", "列出 Splunk 索引"),
+    _tool("waf_prod_op", "在生产 WAF 上封禁 IP"),
+    _tool("thehive_create_ioc", "在 TheHive 案件中创建 IOC"),
+]
+BUILTIN = _tool("read_file", "读取文件")
+SKILLS = [
+    {"name": "ioc-triage", "description": "研判 IOC 威胁情报信誉"},
+    {"name": "splunk-search", "description": "编写 Splunk SPL 查询日志"},
+    {"name": "phishing-response", "description": "钓鱼邮件处置流程"},
+]
+
+
+def _filter(**settings):
+    return RelevanceFilter(MCP_TOOLS, skills=lambda: SKILLS, **{"top_k_skills": 1, "top_k_tools": 2, **settings})
+
+
+def _tools_bound(middleware, messages):
+    request = ModelRequest(model=GenericFakeChatModel(messages=iter([])), messages=messages, tools=[*MCP_TOOLS, BUILTIN])
+    captured = {}
+    middleware.wrap_model_call(request, lambda r: captured.setdefault("tools", [t.name for t in r.tools]))
+    return captured["tools"]
+
+
+def test_tokenize_cjk_bigrams():
+    assert tokenize("查询威胁情报") == ["查询", "询威", "威胁", "胁情", "情报"]
+    assert tokenize("封 IP") == ["封", "ip"]
+    assert tokenize("run_splunk_query 日志") == ["run", "splunk", "query", "日志"]
+
+
+def test_selects_relevant_tools_and_skills():
+    skills, tools = _filter().select("用 Splunk 搜索日志")
+    assert skills == ["splunk-search"]
+    assert tools[0] == "run_splunk_query"
+    assert len(tools) <= 2
+    # 中文 bigram 同样能匹配没有空格分词的描述
+    assert _filter().select("查询这个域名的威胁情报")[1][0] == "query_ioc_reputation"
+
+
+def test_middleware_keeps_always_and_called_tools():
+    middleware = RelevanceFilterMiddleware(_filter(top_k_tools=1, always_tools=["thehive_create_ioc"]))
+    bound = _tools_bound(middleware, [HumanMessage("用 Splunk 搜索日志")])
+    assert bound == ["run_splunk_query", "thehive_create_ioc", "read_file"]
+
+    history = [
+        HumanMessage("先查一下 1.2.3.4 的信誉"),
+        AIMessage(content="", tool_calls=[{"name": "query_ioc_reputation", "args": {}, "id": "c1"}]),
+        ToolMessage(content="malicious", name="query_ioc_reputation", tool_call_id="c1"),
+        HumanMessage("再用 Splunk 搜索日志"),
+    ]
+    bound = _tools_bound(middleware, history)
+    assert bound == ["query_ioc_reputation", "run_splunk_query", "thehive_create_ioc", "read_file"]
+
+
+def test_falls_back_below_min_score():
+    relevance = _filter(min_score=1.0)
+    assert relevance.select("你好") == (None, None)
+    middleware = RelevanceFilterMiddleware(relevance)
+    assert _tools_bound(middleware, [HumanMessage("你好")]) == [t.name for t in MCP_TOOLS] + ["read_file"]
+    stats = relevance.stats()
+    assert (stats["skill_fallbacks"], stats["tool_fallbacks"]) == (1, 1)
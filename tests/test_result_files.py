@@ -0,0 +1,75 @@
+"""result_files：大 tool 结果逐行落盘为 JSONL、消息替换为预览 + 路径、read 分页，清理时跳过仍在读取的会话"""
+
+import json
+import os
+import re
+import time
+from types import SimpleNamespace
+
+from langchain_core.messages import ToolMessage
+
+from result_files import ROUTE, ResultSpillMiddleware, sweep_results
+
+
+def _request(thread_id):
+    return SimpleNamespace(runtime=SimpleNamespace(config={"configurable": {"thread_id": thread_id}}))
+
+
+def _splunk_result(rows):
+    records = [{"host": f"h{i}", "count": i, "tags": ["a"]} for i in range(rows)]
+    return ToolMessage(
+        content=json.dumps({"sid": "s1", "results": records}),
+        tool_call_id="call_1",
+        name="run_splunk_query",
+    )
+
+
+def test_large_result_spilled_and_paged(tmp_path):
+    middleware = ResultSpillMiddleware(str(tmp_path), min_chars=1000, preview_rows=2)
+
+    message = middleware.wrap_tool_call(_request("t1"), lambda request: _splunk_result(200))
+
+    path = re.search(r"已写入 (/results/\S+?)，", message.content).group(1)
+    assert path.startswith(ROUTE + "call_1-") and path.endswith(".jsonl")
+    assert "字段 results 中的 200 条记录" in message.content
+    assert "schema: host: string, count: number, tags: array" in message.content
+    assert 'meta: {"sid": "s1"}' in message.content
+    assert message.content.count('"host": "h') == 2
+    assert (message.tool_call_id, message.name) == ("call_1", "run_splunk_query")
+
+    real = tmp_path / "t1" / path[len(ROUTE):]
+    assert len(real.read_text(encoding="utf-8").splitlines()) == 200
+
+    backend = middleware.routes_for({"thread_id": "t1"})[ROUTE]
+    page = backend.read("/" + real.name, offset=10, limit=3).splitlines()
+    assert len(page) == 3
+    assert page[0].split("\t", 1)[0].strip() == "11"
+    assert json.loads(page[0].split("\t", 1)[1]) == {"host": "h10", "count": 10, "tags": ["a"]}
+    assert "exceeds file length" in backend.read("/" + real.name, offset=500, limit=3)
+    # 其他会话看不到这份结果
+    assert "not found" in middleware.routes_for({"thread_id": "t2"})[ROUTE].read("/" + real.name)
+
+
+def test_small_result_is_unchanged(tmp_path):
+    middleware = ResultSpillMiddleware(str(tmp_path), min_chars=100000)
+    original = _splunk_result(10)
+    assert middleware.wrap_tool_call(_request("t1"), lambda request: original) is original
+    assert not any(tmp_path.iterdir())
+
+
+def test_sweep_keeps_results_still_being_read(tmp_path):
+    middleware = ResultSpillMiddleware(str(tmp_path), min_chars=1000)
+    for thread in ("reading", "idle"):
+        middleware.wrap_tool_call(_request(thread), lambda request: _splunk_result(200))
+    old = time.time() - 48 * 3600
+    for path in tmp_path.rglob("*"):
+        os.utime(path, (old, old))
+    for thread in ("reading", "idle"):
+        os.utime(tmp_path / thread, (old, old))
+
+    # 会话目录本身很久未修改，但其中的结果刚被分页读取过
+    name = next((tmp_path / "reading").iterdir()).name
+    middleware.routes_for({"thread_id": "reading"})[ROUTE].read("/" + name, offset=0, limit=5)
+
+    assert sweep_results(str(tmp_path), retention_hours=24) == 1
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["reading"]
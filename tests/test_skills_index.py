@@ -0,0 +1,83 @@
+"""skills_index：frontmatter 解析、按 mtime 增量刷新、注入 system prompt 的 skills 列表"""
+
+import os
+
+from langchain_core.messages import SystemMessage
+
+from skills_index import IndexedSkillsMiddleware, SkillsIndex, _parse_frontmatter, append_to_system_message
+
+
+def _skill(root, name, frontmatter, body="正文"):
+    path = root / name / "SKILL.md"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(f"---\n{frontmatter}\n---\n{body}\n", encoding="utf-8")
+    return path
+
+
+def test_parse_frontmatter():
+    meta = _parse_frontmatter(
+        "---\nname: ioc-triage\ndescription: 研判 IOC-\nallowed-tools: query_ioc_reputation query_asset_info\nlicense: MIT\n---\n",
+        "/skills/ioc-triage/SKILL.md",
+    )
+    assert meta == {
+        "name": "ioc-triage",
+        "description": "研判 IOC-",
+        "path": "/skills/ioc-triage/SKILL.md",
+        "metadata": {},
+        "license": "MIT",
+        "compatibility": None,
+        "allowed_tools": ["query_ioc_reputation", "query_asset_info"],
+    }
+    assert len(_parse_frontmatter(f"---\nname: x\ndescription: {'a' * 2000}\n---\n", "/skills/x/SKILL.md")["description"]) == 1024
+    assert _parse_frontmatter("---\nname: x\n---\n", "/skills/x/SKILL.md") is None
+    assert _parse_frontmatter("---\nname: [x\n---\n", "/skills/x/SKILL.md") is None
+
+
+def test_index_refreshes_changed_skills_only(tmp_path):
+    root = tmp_path / "skills"
+    _skill(root, "a", "name: a\ndescription: first")
+    path_b = _skill(root, "b", "name: b\ndescription: second")
+    (root / "no-frontmatter").mkdir()
+    (root / "no-frontmatter" / "SKILL.md").write_text("# 没有 frontmatter\n", encoding="utf-8")
+    cache = tmp_path / "index.json"
+
+    index = SkillsIndex(str(root), cache_path=str(cache), check_interval=0)
+    assert sorted(s["name"] for s in index.skills()) == ["a", "b"]
+    assert index.parsed == 2
+
+    _skill(root, "b", "name: b\ndescription: changed")
+    stat = path_b.stat()
+    os.utime(path_b, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+    index.refresh(force=True)
+    assert {s["name"]: s["description"] for s in index.skills()} == {"a": "first", "b": "changed"}
+    assert index.parsed == 3
+
+    # 进程重启后从索引缓存恢复，不再解析未变化的文件
+    restarted = SkillsIndex(str(root), cache_path=str(cache), check_interval=0)
+    assert restarted.parsed == 0
+    assert len(restarted.skills()) == 2
+
+
+def test_append_to_system_message_keeps_existing_blocks():
+    assert append_to_system_message(None, "skills").content == [{"type": "text", "text": "skills"}]
+    merged = append_to_system_message(SystemMessage(content="base"), "skills")
+    assert [block["text"] for block in merged.content] == ["base", "\n\nskills"]
+
+
+def test_middleware_lists_selected_skills(tmp_path):
+    root = tmp_path / "skills"
+    _skill(root, "a", "name: a\ndescription: first\nallowed-tools: get_indexes")
+    _skill(root, "b", "name: b\ndescription: second")
+    middleware = IndexedSkillsMiddleware(SkillsIndex(str(root)), selector=lambda messages: ["a"])
+
+    class _Request:
+        messages = []
+        system_message = SystemMessage(content="base")
+
+        def override(self, **kwargs):
+            return kwargs
+
+    prompt = middleware.modify_request(_Request())["system_message"].content[-1]["text"]
+    assert "**Skills Skills**: `/skills/`" in prompt
+    assert "- **a**: first\n  -> Allowed tools: get_indexes\n  -> Read `/skills/a/SKILL.md` for full instructions" in prompt
+    assert "**b**" not in prompt
@@ -0,0 +1,140 @@
+"""tracing：span 嵌套的父子关系、/metrics 输出符合 Prometheus 文本格式（直方图 bucket、token 与错误计数）"""
+
+import asyncio
+import re
+import uuid
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, LLMResult
+
+from tracing import MetricsMiddleware, TracingCallbackHandler, current_span, render_metrics, span
+
+_SAMPLE = re.compile(
+    r'^(?P<name>[a-zA-Z_:][a-zA-Z0-9_:]*)'
+    r'(?:\{(?P<labels>(?:[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")(?:,[a-zA-Z_][a-zA-Z0-9_]*="(?:[^"\\]|\\.)*")*)\})?'
+    r' (?P<value>[-+]?(?:\d+(?:\.\d*)?(?:[eE][-+]?\d+)?|\+Inf|-Inf|NaN))$'
+)
+_LABEL = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)="((?:[^"\\]|\\.)*)"')
+
+
+def _parse(text):
+    """按 Prometheus 文本格式解析，格式不合法时断言失败；返回 {family: (type, [(name, labels, value)])}"""
+    assert text.endswith("\n")
+    families, current = {}, None
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            current = line.split(" ")[2]
+            assert current not in families, f"重复的指标: {current}"
+            families[current] = [None, []]
+        elif line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert name == current and kind in ("counter", "gauge", "histogram")
+            families[name][0] = kind
+        else:
+            match = _SAMPLE.match(line)
+            assert match, f"非法的样本行: {line!r}"
+            name = match["name"]
+            kind = families[current][0]
+            suffixes = ("_bucket", "_sum", "_count") if kind == "histogram" else ("",)
+            assert any(name == current + suffix for suffix in suffixes), f"{name} 不属于 {current}"
+            labels = dict(_LABEL.findall(match["labels"] or ""))
+            families[current][1].append((name, labels, float(match["value"])))
+    return families
+
+
+def _histogram_series(samples, family, **labels):
+    """返回某个 label 组合的 ([(le, 累计数)], sum, count)"""
+    pick = lambda suffix: [(l, v) for n, l, v in samples if n == family + suffix and all(l.get(k) == w for k, w in labels.items())]
+    buckets = [(float(l["le"]), v) for l, v in pick("_bucket")]
+    return buckets, pick("_sum")[0][1], pick("_count")[0][1]
+
+
+def test_span_nesting():
+    assert current_span() is None
+    with span("request", thread_id="t1") as root:
+        with span("agent.run") as child:
+            with span("tool.call", tool="get_indexes") as leaf:
+                assert current_span() is leaf
+
+            async def in_thread():
+                # asyncio.to_thread 复制上下文，线程中的 span 同样挂在当前 span 之下
+                def work():
+                    with span("memory.read") as item:
+                        return item
+                return await asyncio.to_thread(work)
+
+            threaded = asyncio.run(in_thread())
+        assert current_span() is root
+    assert current_span() is None
+
+    assert root.parent_id is None
+    assert child.parent_id == root.span_id
+    assert leaf.parent_id == threaded.parent_id == child.span_id
+    assert root.trace_id == child.trace_id == leaf.trace_id == threaded.trace_id
+    assert all(item.end_ns is not None for item in (root, child, leaf, threaded))
+    assert leaf.attributes == {"tool": "get_indexes"}
+
+
+def test_span_records_error():
+    try:
+        with span("failing") as item:
+            raise ValueError("boom")
+    except ValueError:
+        pass
+    assert item.error == "ValueError: boom"
+
+
+def test_metrics_exposition_format():
+    model = f"stub-{uuid.uuid4().hex[:6]}"
+    handler = TracingCallbackHandler()
+    run_id = uuid.uuid4()
+    handler.on_chat_model_start({"name": model}, [], run_id=run_id)
+    handler.on_llm_new_token("x", run_id=run_id)
+    message = AIMessage(content="ok", usage_metadata={"input_tokens": 12, "output_tokens": 3, "total_tokens": 15})
+    handler.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]), run_id=run_id)
+
+    app = FastAPI()
+
+    @app.get("/boom")
+    def boom():
+        raise RuntimeError("boom")
+
+    @app.get("/ok")
+    def ok():
+        return {"ok": True}
+
+    client = TestClient(MetricsMiddleware(app), raise_server_exceptions=False)
+    assert client.get("/ok").status_code == 200
+    assert client.get("/boom").status_code == 500
+    with span('label "quoted"\nname'):
+        pass
+
+    families = _parse(render_metrics())
+
+    kind, samples = families["deepagents_llm_tokens_total"]
+    assert kind == "counter"
+    tokens = {l["type"]: v for n, l, v in samples if l["model"] == model}
+    assert tokens == {"input": 12.0, "output": 3.0}
+
+    kind, samples = families["deepagents_http_errors_total"]
+    assert kind == "counter"
+    assert any(l == {"method": "GET", "path": "/boom", "status": "500"} and v >= 1 for _, l, v in samples)
+
+    kind, samples = families["deepagents_http_request_duration_seconds"]
+    assert kind == "histogram"
+    buckets, total, count = _histogram_series(samples, "deepagents_http_request_duration_seconds", path="/ok", status="200")
+    assert buckets[-1] == (float("inf"), count) and count >= 1 and total >= 0
+    bounds = [b for b, _ in buckets]
+    assert bounds == sorted(bounds)
+    assert [v for _, v in buckets] == sorted(v for _, v in buckets)
+
+    _, samples = families["deepagents_llm_request_duration_seconds"]
+    assert _histogram_series(samples, "deepagents_llm_request_duration_seconds", model=model, status="ok")[2] == 1
+    _, samples = families["deepagents_llm_time_to_first_token_seconds"]
+    assert _histogram_series(samples, "deepagents_llm_time_to_first_token_seconds", model=model)[2] == 1
+    # label 值中的引号与换行被转义
+    _, samples = families["deepagents_span_duration_seconds"]
+    assert any(l.get("span") == 'label \\"quoted\\"\\nname' for _, l, _ in samples)
+    assert families["deepagents_admission_queue_depth"][0] == "gauge"
@@ -0,0 +1,450 @@
+"""请求追踪与指标 - span 记录、OTLP/JSON 本地导出、Prometheus /metrics
+
+config.json 格式:
+{
+  "tracing": {
+    "exporter": "none",                 # none | file | console
+    "path": "./.cache/traces.jsonl",    # exporter=file 时的输出文件
+    "service_name": "deepagents-minimal"
+  }
+}
+
+每个 span 结束时都会计入 deepagents_span_duration_seconds 直方图（与 exporter 无关）；
+exporter 开启后按 OTLP/JSON（resourceSpans）格式每批一行写出，可直接交给
+OpenTelemetry Collector 的 file receiver 或 otel-cli 等工具导入。
+
+span 的父子关系通过 contextvars 传递：请求入口开启根 span，Agent 运行、
+tool 调用与 memory 读取（含 asyncio.to_thread 中的调用）自动挂在其下。
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+# ---------- 指标 ----------
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (), buckets: Tuple[float, ...] = _DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # key -> (各 bucket 计数, sum, count)
+        self._values: Dict[Tuple[str, ...], List[Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = tuple(str(labels.get(n, "")) for n in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            item = self._values.get(key)
+            if item is None:
+                item = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                item[0][index] += 1
+            item[1] += value
+            item[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labelnames, key, 'le="%s"' % bound)
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key, 'le="+Inf"')
+                lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {total}")
+                lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+SPAN_SECONDS = Histogram("deepagents_span_duration_seconds", "Duration of traced spans", ("span", "status"))
+HTTP_SECONDS = Histogram("deepagents_http_request_duration_seconds", "HTTP request latency (until the response body is fully sent)", ("method", "path", "status"))
+HTTP_ERRORS = Counter("deepagents_http_errors_total", "HTTP responses with status >= 500", ("method", "path", "status"))
+LLM_SECONDS = Histogram("deepagents_llm_request_duration_seconds", "LLM call latency", ("model", "status"))
+LLM_TTFT_SECONDS = Histogram("deepagents_llm_time_to_first_token_seconds", "LLM time to first streamed token", ("model",))
+LLM_TOKENS = Counter("deepagents_llm_tokens_total", "LLM token usage", ("model", "type"))
+LLM_TIER_SECONDS = Histogram("deepagents_llm_tier_duration_seconds", "LLM call latency per routing tier", ("tier", "status"))
+LLM_TIER_TOKENS = Counter("deepagents_llm_tier_tokens_total", "LLM token usage per routing tier", ("tier", "type"))
+LLM_ROUTES = Counter("deepagents_llm_routes_total", "Model routing decisions", ("tier", "decision"))
+TOOL_SECONDS = Histogram("deepagents_tool_call_duration_seconds", "Tool call latency", ("tool", "server", "status"))
+ADMISSION_QUEUE_DEPTH = Gauge("deepagents_admission_queue_depth", "Requests waiting for an agent execution slot")
+ADMISSION_WAIT_SECONDS = Histogram("deepagents_admission_wait_seconds", "Time spent waiting for an agent execution slot", ("outcome",))
+ADMISSION_REJECTED = Counter("deepagents_admission_rejected_total", "Requests rejected with 429", ("reason",))
+MCP_QUEUE_DEPTH = Gauge("deepagents_mcp_queue_depth", "MCP tool calls waiting for a QPS token or concurrency slot", ("server",))
+MCP_WAIT_SECONDS = Histogram("deepagents_mcp_queue_wait_seconds", "Time MCP tool calls spent waiting before being sent", ("server",))
+SSE_FLUSH_SECONDS = Histogram(
+    "deepagents_sse_flush_seconds",
+    "Time for one SSE event to be handed to the client",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0),
+)
+
+_METRICS = [
+    SPAN_SECONDS, HTTP_SECONDS, HTTP_ERRORS, LLM_SECONDS, LLM_TTFT_SECONDS, LLM_TOKENS,
+    LLM_TIER_SECONDS, LLM_TIER_TOKENS, LLM_ROUTES, TOOL_SECONDS, SSE_FLUSH_SECONDS,
+    ADMISSION_QUEUE_DEPTH, ADMISSION_WAIT_SECONDS, ADMISSION_REJECTED, MCP_QUEUE_DEPTH, MCP_WAIT_SECONDS,
+]
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- span ----------
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "attributes", "start_ns", "end_ns", "error")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict[str, Any]) -> None:
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.name = name
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update({k: v for k, v in attributes.items() if v is not None})
+
+    def end(self, error: Optional[BaseException] = None) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        SPAN_SECONDS.observe((self.end_ns - self.start_ns) / 1e9, span=self.name, status="error" if self.error else "ok")
+        _exporter.export(self)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("deepagents_current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def start_span(name: str, parent: Optional[Span] = None, **attributes: Any) -> Span:
+    """开启一个 span（默认父 span 取当前上下文），需手动 end()；不改变当前上下文"""
+    return Span(name, parent if parent is not None else _current_span.get(), attributes)
+
+
+@contextmanager
+def use_span(item: Span) -> Iterator[Span]:
+    """在 with 块内把已有 span 设为当前 span（如在新 task 中延续请求的根 span），不负责结束"""
+    token = _current_span.set(item)
+    try:
+        yield item
+    finally:
+        _current_span.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Span]:
+    """在 with 块内开启 span 并设为当前 span，异常时记录错误"""
+    current = start_span(name, **attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+# ---------- 导出 ----------
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(item: Span) -> Dict[str, Any]:
+    data: Dict[str, Any] = {
+        "traceId": item.trace_id,
+        "spanId": item.span_id,
+        "name": item.name,
+        "kind": 1,
+        "startTimeUnixNano": str(item.start_ns),
+        "endTimeUnixNano": str(item.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in item.attributes.items()],
+        "status": {"code": 2, "message": item.error} if item.error else {"code": 1},
+    }
+    if item.parent_id:
+        data["parentSpanId"] = item.parent_id
+    return data
+
+
+class _SpanExporter:
+    """后台线程批量导出已结束的 span，请求路径上只做入队"""
+
+    def __init__(self) -> None:
+        self.mode = "none"
+        self.path: Optional[Path] = None
+        self.service_name = "deepagents-minimal"
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=10000)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def configure(self, settings: Dict[str, Any]) -> None:
+        self.mode = str(settings.get("exporter", "none")).lower()
+        self.path = Path(settings.get("path", "./.cache/traces.jsonl"))
+        self.service_name = str(settings.get("service_name", "deepagents-minimal"))
+        if self.mode == "none":
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def export(self, item: Span) -> None:
+        if self.mode == "none":
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 512:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                print(f"⚠️  span 导出失败: {type(e).__name__}: {e}")
+            time.sleep(0.5)
+
+    def _write(self, batch: List[Span]) -> None:
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": self.service_name}}]},
+                "scopeSpans": [{"scope": {"name": "deepagents_minimal"}, "spans": [_otlp_span(s) for s in batch]}],
+            }]
+        }
+        line = json.dumps(payload, ensure_ascii=False, default=str)
+        if self.mode == "console":
+            print(line)
+        elif self.mode == "file" and self.path is not None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+_exporter = _SpanExporter()
+
+
+def configure_tracing(config: Optional[Dict[str, Any]] = None) -> None:
+    settings = (config or {}).get("tracing")
+    _exporter.configure(settings if isinstance(settings, dict) else {})
+
+
+# ---------- LangChain 回调：模型与 tool 调用 ----------
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """
+    把模型调用（总耗时、首 token 延迟、token 数）与 tool 调用记录为 span 和指标。
+
+    run_inline=True：在调用方的上下文中同步执行，span 能拿到请求的根 span 作为父节点。
+    """
+
+    run_inline = True
+
+    def __init__(self, server_of: Optional[Callable[[str], Optional[str]]] = None) -> None:
+        self._server_of = server_of
+        self._runs: Dict[Any, Dict[str, Any]] = {}
+
+    def _start(self, run_id: Any, name: str, **attributes: Any) -> None:
+        self._runs[run_id] = {"span": start_span(name, **attributes), "started": time.perf_counter(), "first_token": None}
+
+    # 模型
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: Any, *, run_id: Any, metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        model = (metadata or {}).get("ls_model_name") or (serialized or {}).get("name") or "unknown"
+        self._start(run_id, "llm.call", model=model)
+
+    def on_llm_new_token(self, token: str, *, run_id: Any, **kwargs: Any) -> None:
+        run = self._runs.get(run_id)
+        if run is not None and run["first_token"] is None:
+            run["first_token"] = time.perf_counter()
+
+    def on_llm_end(self, response: Any, *, run_id: Any, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        item: Span = run["span"]
+        model = item.attributes.get("model")
+        if run["first_token"] is not None:
+            ttft = run["first_token"] - run["started"]
+            item.set(ttft_ms=round(ttft * 1000, 1))
+            LLM_TTFT_SECONDS.observe(ttft, model=model)
+        usage = usage_of(response)
+        for kind in ("input_tokens", "output_tokens"):
+            if usage.get(kind):
+                item.set(**{f"gen_ai.usage.{kind}": usage[kind]})
+                LLM_TOKENS.inc(usage[kind], model=model, type=kind.split("_")[0])
+        LLM_SECONDS.observe(time.perf_counter() - run["started"], model=model, status="ok")
+        item.end()
+
+    def on_llm_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        LLM_SECONDS.observe(time.perf_counter() - run["started"], model=run["span"].attributes.get("model"), status="error")
+        run["span"].end(error)
+
+    # tool
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: Any, **kwargs: Any) -> None:
+        name = (serialized or {}).get("name") or "unknown"
+        server = self._server_of(name) if self._server_of else None
+        self._start(run_id, "tool.call", tool=name, server=server or "builtin")
+
+    def on_tool_end(self, output: Any, *, run_id: Any, **kwargs: Any) -> None:
+        self._end_tool(run_id, "error" if getattr(output, "status", None) == "error" else "ok", None)
+
+    def on_tool_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+        self._end_tool(run_id, "error", error)
+
+    def _end_tool(self, run_id: Any, status: str, error: Optional[BaseException]) -> None:
+        run = self._runs.pop(run_id, None)
+        if run is None:
+            return
+        item: Span = run["span"]
+        TOOL_SECONDS.observe(
+            time.perf_counter() - run["started"],
+            tool=item.attributes.get("tool"),
+            server=item.attributes.get("server"),
+            status=status,
+        )
+        item.set(status=status)
+        item.end(error)
+
+
+def usage_of(response: Any) -> Dict[str, int]:
+    for generations in getattr(response, "generations", None) or []:
+        for generation in generations:
+            usage = getattr(getattr(generation, "message", None), "usage_metadata", None)
+            if usage:
+                return {"input_tokens": usage.get("input_tokens", 0), "output_tokens": usage.get("output_tokens", 0)}
+    token_usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+    return {"input_tokens": token_usage.get("prompt_tokens", 0), "output_tokens": token_usage.get("completion_tokens", 0)}
+
+
+# ---------- HTTP 指标（纯 ASGI middleware，不缓冲流式响应） ----------
+
+
+class MetricsMiddleware:
+    def __init__(self, app: Any) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Dict[str, Any], receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = {"code": 500}
+
+        async def _send(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            route = scope.get("route")
+            # 使用路由模板作为标签，未匹配的路径合并，避免标签基数失控
+            path = getattr(route, "path", None) or "unmatched"
+            code = str(status["code"])
+            HTTP_SECONDS.observe(time.perf_counter() - started, method=scope["method"], path=path, status=code)
+            if status["code"] >= 500:
+                HTTP_ERRORS.inc(method=scope["method"], path=path, status=code)